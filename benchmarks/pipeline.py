@@ -0,0 +1,201 @@
+"""Pipeline benchmark on synthetic raw data
+times every stage from raw csvs to a forecast (load_merge_raw_data, clean_df, preprocess_df, generate_dataset,
+windowing, training & predict_next_24) at sizes from a week to ten years of data, so that regressions show up
+at the size they matter at
+
+usage: python benchmarks/pipeline.py [--sizes 1w 1m 1y] [--repeats 3] [--output benchmarks/results/pipeline.json]
+                                     [--baseline benchmarks/results/pipeline_baseline.json] [--tolerance 0.5]
+"""
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List
+
+BASE_DIR = Path(__file__).parent.parent.absolute()
+sys.path.insert(0, str(BASE_DIR))
+
+from benchmarks import synthetic  # noqa: E402
+from config import config  # noqa: E402
+
+# days of data & number of raw files by size
+SIZES = {
+    "1w": (7, 1),
+    "1m": (30, 1),
+    "1y": (365, 12),
+    "10y": (3650, 120),
+}
+STAGES = [
+    "load_merge_raw_data",
+    "clean_df",
+    "preprocess_df",
+    "generate_dataset",
+    "window",
+    "train",
+    "predict_next_24",
+]
+# stages faster than this are too noisy to compare against the baseline
+MIN_SECONDS = 0.05
+
+
+def run_pipeline(
+    raw_data_dir: Path, work_dir: Path, window_backend: str
+) -> Dict[str, Dict]:
+    """Run every stage once on the raw data, profiling each.
+
+    Args:
+        raw_data_dir (Path): directory of raw csvs
+        work_dir (Path): directory for the scaler, model & test set
+        window_backend (str): backend of the WindowGenerator
+
+    Returns:
+        Dict[str, Dict]: wall & cpu seconds, rows, rows per second & peak RSS by stage
+    """
+    from powr import data, predict, profiling, train, utils, window
+
+    profiler = profiling.PROFILER
+    profiler.enabled = True
+    profiler.reset()
+    try:
+        with profiler.stage("load_merge_raw_data") as record:
+            df_raw = data.load_merge_raw_data(raw_data_dir, n_workers=4)
+            record["rows"] = len(df_raw)
+        with profiler.stage("clean_df", rows=len(df_raw)):
+            df_clean = data.clean_df(
+                df_raw, datatime_str_fmts=config.EXPECTED_TIME_FMTS
+            )
+        del df_raw
+        with profiler.stage("preprocess_df", rows=len(df_clean)):
+            df_clean = data.preprocess_df(df_clean)
+        with profiler.stage("generate_dataset", rows=len(df_clean)):
+            ds = data.generate_dataset(
+                df_clean,
+                Path(work_dir, "scaler.gz"),
+                train_size=config.TRAIN_SIZE,
+                val_size=config.VAL_SIZE,
+                test_size=config.TEST_SIZE,
+            )
+        del df_clean
+
+        multi_window = window.WindowGenerator(
+            input_width=config.WINDOW_SIZE,
+            label_width=config.FORECAST_STEPS,
+            shift=config.FORECAST_STEPS,
+            dataset_dict=ds,
+            batch_size=config.BATCH_SIZE,
+            shuffle_seed=config.SHUFFLE_SEED,
+            backend=window_backend,
+        )
+        # one epoch over every train window
+        with profiler.stage("window") as record:
+            record["rows"] = sum(len(inputs) for inputs, _ in multi_window.train)
+
+        num_features = ds["train"].shape[1]
+        model = train.build_model(config.FORECAST_STEPS, num_features)
+        with profiler.stage("train", rows=len(ds["train"])):
+            model, _ = train.train_model(model, multi_window, 1, solver="lstsq")
+
+        model_path = Path(work_dir, "linear_model.npz")
+        train.export_numpy_model(model, config.FORECAST_STEPS, num_features, model_path)
+        # a week of data has a test set shorter than a window
+        held_out_df = utils.concat_dfs([ds["val"], ds["test"]])
+        test_path = Path(work_dir, "test.csv")
+        utils.save_df(held_out_df, test_path)
+        # a cold prediction, loading the model & scaler
+        predict.MODEL_CACHE.clear()
+        predict.SCALER_CACHE.clear()
+        with profiler.stage("predict_next_24", rows=len(held_out_df)):
+            predict.predict_next_24(model_path, Path(work_dir, "scaler.gz"), test_path)
+    finally:
+        profiler.enabled = False
+
+    # the stages of the benchmark, not the powr stages nested in them
+    return {
+        record["stage"]: {key: value for key, value in record.items() if key != "stage"}
+        for record in profiler.records
+        if "/" not in record["stage"]
+    }
+
+
+def run(
+    sizes: List[str], repeats: int, window_backend: str, seed: int = 0
+) -> Dict[str, Dict]:
+    """Benchmark the pipeline at every size, keeping the median wall time of repeats runs per stage."""
+    results = {}
+    for size in sizes:
+        days, n_files = SIZES[size]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            raw_data_dir = Path(tmp_dir, "raw")
+            synthetic.write_raw_data(raw_data_dir, days, n_files, seed=seed)
+            runs = [
+                run_pipeline(raw_data_dir, Path(tmp_dir), window_backend)
+                for _ in range(repeats)
+            ]
+        stages = {}
+        for stage in STAGES:
+            median = statistics.median(run[stage]["wall_seconds"] for run in runs)
+            stages[stage] = min(
+                (run[stage] for run in runs),
+                key=lambda record: abs(record["wall_seconds"] - median),
+            )
+        results[size] = {"days": days, "files": n_files, "stages": stages}
+    return results
+
+
+def regressions(
+    results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float
+) -> List[str]:
+    """List stages whose wall time grew by more than tolerance (relative) over the baseline at the same size."""
+    failures = []
+    for size, result in results.items():
+        for stage, record in result["stages"].items():
+            if stage not in baseline.get(size, {}).get("stages", {}):
+                continue
+            baseline_seconds = baseline[size]["stages"][stage]["wall_seconds"]
+            if (
+                record["wall_seconds"] > baseline_seconds * (1 + tolerance)
+                and record["wall_seconds"] - baseline_seconds > MIN_SECONDS
+            ):
+                failures.append(
+                    f"{size} {stage}: {record['wall_seconds']}s vs {baseline_seconds}s baseline"
+                )
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", nargs="+", choices=list(SIZES), default=["1w", "1m", "1y"]
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--window-backend", default="numpy")
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path(BASE_DIR, "benchmarks/results/pipeline.json"),
+    )
+    parser.add_argument("--baseline", type=Path, default=None)
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.repeats, args.window_backend)
+    for size, result in results.items():
+        for stage, record in result["stages"].items():
+            print(
+                f"{size:<5}{stage:<22}{record['wall_seconds']:>10.3f} s{record['rows'] or 0:>12} rows"
+                f"{record['peak_rss_mb']:>10.1f} MB"
+            )
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(results, indent=2))
+    print(f"Saved pipeline benchmark to {args.output}")
+
+    if args.baseline is not None:
+        failures = regressions(
+            results, json.loads(args.baseline.read_text()), args.tolerance
+        )
+        if failures:
+            print("Pipeline regressions:\n" + "\n".join(failures))
+            sys.exit(1)
@@ -0,0 +1,177 @@
+"""Startup benchmark for main.py subcommands
+records the `python -X importtime` cost of invoking each subcommand through the CLI, i.e. main.py, the app
+callback, the command's decorators & its own imports, with everything they import transitively, so that import
+time regressions (e.g. tensorflow creeping into a light command) are visible.
+every command is cut short right after its leading imports, so that nothing but startup is measured
+
+usage: python benchmarks/startup.py [--repeats 3] [--output benchmarks/results/startup.json]
+                                    [--baseline benchmarks/results/startup_baseline.json] [--tolerance 0.5]
+"""
+import argparse
+import ast
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+BASE_DIR = Path(__file__).parent.parent.absolute()
+MAIN_PATH = Path(BASE_DIR, "main.py")
+# run in the measured interpreter: swaps the command's code for its leading imports & invokes it through the app,
+# only sys & main are imported beforehand
+RUNNER = """
+import sys
+import main
+
+namespace = dict(vars(main))
+exec(compile({source!r}, main.__file__, "exec"), namespace)
+command = getattr(main, {function!r})
+# the function typer calls, within e.g. _uses_artifact_caches
+getattr(command, "__wrapped__", command).__code__ = namespace[{function!r}].__code__
+main.app({args!r}, prog_name="main.py", standalone_mode=False)
+"""
+
+
+def _is_import(node: ast.stmt) -> bool:
+    return isinstance(node, (ast.Import, ast.ImportFrom))
+
+
+def command_startups(main_path: Path = MAIN_PATH) -> Dict[str, Dict]:
+    """Find every typer command in main.py & what invoking it up to the end of its leading imports takes.
+
+    Args:
+        main_path (Path, optional): path to main.py. Defaults to MAIN_PATH.
+
+    Returns:
+        Dict[str, Dict]: by subcommand name, the command's function, its leading imports, the source of the function
+                        cut short after them & the CLI arguments to invoke it with (stubs for required arguments)
+    """
+    tree = ast.parse(main_path.read_text())
+    startups = {}
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef) or not any(
+            isinstance(decorator, ast.Call)
+            and getattr(decorator.func, "attr", None) == "command"
+            for decorator in node.decorator_list
+        ):
+            continue
+        body = node.body
+        docstring = body[:1] if ast.get_docstring(node) is not None else []
+        imports = []
+        for statement in body[len(docstring) :]:  # noqa: E203
+            if not _is_import(statement):
+                break
+            imports.append(statement)
+        modules = [
+            alias.name
+            if isinstance(statement, ast.Import)
+            else f"{statement.module}.{alias.name}"
+            for statement in imports
+            for alias in statement.names
+        ]
+        cut_short = ast.FunctionDef(
+            name=node.name,
+            args=node.args,
+            body=docstring + imports + [ast.Return(value=None)],
+            decorator_list=[],
+            returns=None,
+            type_comment=None,
+        )
+        n_required = len(node.args.args) - len(node.args.defaults)
+        command = node.name.replace("_", "-")
+        startups[command] = {
+            "function": node.name,
+            "modules": modules,
+            "source": ast.unparse(ast.fix_missing_locations(cut_short)),
+            "args": [command] + ["stub"] * n_required,
+        }
+    return startups
+
+
+def measure_startup(startup: Dict) -> Dict:
+    """Invoke a command up to the end of its leading imports in a fresh interpreter with -X importtime.
+
+    Args:
+        startup (Dict): the command's function, source & CLI arguments, see `command_startups`
+
+    Returns:
+        Dict: total import time in ms & the 5 heaviest top level imports
+    """
+    statement = RUNNER.format(
+        source=startup["source"], function=startup["function"], args=startup["args"]
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=BASE_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # lines look like "import time: self [us] | cumulative | imported package"
+    top_level = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, package = line[len("import time:") :].split("|")  # noqa: E203
+        if not package.startswith("  "):
+            top_level[package.strip()] = int(cumulative) / 1000
+    heaviest = sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:5]
+    return {"total_ms": round(sum(top_level.values()), 1), "heaviest": dict(heaviest)}
+
+
+def run(repeats: int) -> Dict[str, Dict]:
+    """Measure the startup cost of every subcommand, keeping the median of repeats runs."""
+    results = {}
+    for command, startup in command_startups().items():
+        runs = [measure_startup(startup) for _ in range(repeats)]
+        median = statistics.median(run["total_ms"] for run in runs)
+        results[command] = {
+            "modules": startup["modules"],
+            "total_ms": median,
+            "heaviest": min(runs, key=lambda run: abs(run["total_ms"] - median))[
+                "heaviest"
+            ],
+        }
+    return results
+
+
+def regressions(
+    results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float
+) -> List[str]:
+    """List subcommands whose import time grew by more than tolerance (relative) over the baseline."""
+    return [
+        f"{command}: {result['total_ms']}ms vs {baseline[command]['total_ms']}ms baseline"
+        for command, result in results.items()
+        if command in baseline
+        and result["total_ms"] > baseline[command]["total_ms"] * (1 + tolerance)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--output", type=Path, default=Path(BASE_DIR, "benchmarks/results/startup.json")
+    )
+    parser.add_argument("--baseline", type=Path, default=None)
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    args = parser.parse_args()
+
+    results = run(args.repeats)
+    for command, result in results.items():
+        print(
+            f"{command:<20}{result['total_ms']:>10.1f} ms  {list(result['heaviest'])}"
+        )
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(results, indent=2))
+    print(f"Saved startup benchmark to {args.output}")
+
+    if args.baseline is not None:
+        failures = regressions(
+            results, json.loads(args.baseline.read_text()), args.tolerance
+        )
+        if failures:
+            print("Import time regressions:\n" + "\n".join(failures))
+            sys.exit(1)
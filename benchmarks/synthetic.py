@@ -0,0 +1,119 @@
+"""Synthetic raw data generator
+writes raw power consumption csvs that look like the real ones: readings every few minutes with daily,
+weekly & yearly seasonality, timestamps in both EXPECTED_TIME_FMTS, duplicates, negatives & nulls
+
+usage: python benchmarks/synthetic.py --days 365 [--files 12] [--output-dir data/raw_synthetic] [--seed 0]
+"""
+import argparse
+import sys
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = Path(__file__).parent.parent.absolute()
+sys.path.insert(0, str(BASE_DIR))
+
+from config import config  # noqa: E402
+
+
+def synthetic_raw_df(
+    days: int,
+    start: str = "2015-01-01",
+    readings_per_bin: float = 2.0,
+    duplicate_rate: float = 0.01,
+    negative_rate: float = 0.005,
+    null_rate: float = 0.005,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Raw readings over days, in the raw data's format.
+
+    Args:
+        days (int): number of days of readings
+        start (str, optional): first day. Defaults to "2015-01-01".
+        readings_per_bin (float, optional): average readings per 5min bin. Defaults to 2.0.
+        duplicate_rate (float, optional): share of rows repeated. Defaults to 0.01.
+        negative_rate (float, optional): share of rows with negative values. Defaults to 0.005.
+        null_rate (float, optional): share of rows with null values. Defaults to 0.005.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: CREATED_AT, NAME, VALUE & UNIT columns, sorted by time except for the duplicates
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = int(days * 288 * readings_per_bin)
+    minutes = np.sort(rng.integers(0, days * 24 * 60, n_rows))
+    created_at = pd.Timestamp(start) + pd.to_timedelta(minutes, unit="min")
+
+    # daily, weekly & yearly seasonality of household consumption in W, plus noise
+    hours = minutes / 60
+    values = (
+        400
+        + 250 * np.sin(2 * np.pi * (hours - 7) / 24)
+        + 80 * np.sin(2 * np.pi * hours / (24 * 7))
+        + 150 * np.cos(2 * np.pi * hours / (24 * 365.25))
+        + rng.normal(0, 60, n_rows)
+    ).clip(0)
+    values[rng.random(n_rows) < negative_rate] *= -1
+
+    # a mix of both raw timestamp formats
+    created_at_strs = np.empty(n_rows, dtype=object)
+    fmt_codes = rng.integers(0, len(config.EXPECTED_TIME_FMTS), n_rows)
+    for code, fmt in enumerate(config.EXPECTED_TIME_FMTS):
+        created_at_strs[fmt_codes == code] = created_at[fmt_codes == code].strftime(fmt)
+
+    df = pd.DataFrame(
+        {
+            "CREATED_AT": created_at_strs,
+            "NAME": "powerConsumed",
+            "VALUE": values.round(2),
+            "UNIT": "W",
+        }
+    )
+    df.loc[rng.random(n_rows) < null_rate, "VALUE"] = np.nan
+    duplicates = df.sample(frac=duplicate_rate, random_state=seed)
+    return pd.concat([df, duplicates], ignore_index=True)
+
+
+def write_raw_data(
+    output_dir: Path, days: int, n_files: int = 1, seed: int = 0, **kwargs
+) -> List[Path]:
+    """Write synthetic raw readings split across n_files csvs of consecutive time ranges.
+
+    Args:
+        output_dir (Path): directory to write to, existing csvs are removed first
+        days (int): number of days of readings
+        n_files (int, optional): number of files. Defaults to 1.
+        seed (int, optional): random seed. Defaults to 0.
+        **kwargs: see `synthetic_raw_df`
+
+    Returns:
+        List[Path]: the written files
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for fpath in output_dir.glob("*.csv"):
+        fpath.unlink()
+    df = synthetic_raw_df(days, seed=seed, **kwargs)
+    fpaths = []
+    for i, chunk in enumerate(np.array_split(np.arange(len(df)), n_files)):
+        fpath = Path(output_dir, f"synthetic_{i:04d}.csv")
+        df.iloc[chunk].to_csv(fpath, index=False)
+        fpaths.append(fpath)
+    return fpaths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, required=True)
+    parser.add_argument("--files", type=int, default=1)
+    parser.add_argument(
+        "--output-dir", type=Path, default=Path(BASE_DIR, "data/raw_synthetic")
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fpaths = write_raw_data(args.output_dir, args.days, args.files, seed=args.seed)
+    print(
+        f"Saved {args.days} days of synthetic raw data to {len(fpaths)} files in {args.output_dir}"
+    )
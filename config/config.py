@@ -1,3 +1,4 @@
+import json
 import logging
 import time
 from logging.config import fileConfig
@@ -12,20 +13,87 @@ CLEAN_DATA_DIR = Path(DATA_DIR, "clean")
 DATASET_DIR = Path(DATA_DIR, "dataset")
 PREDICTION_DIR = Path(DATA_DIR, "predictions")
 MODEL_DIR = Path(BASE_DIR, "models")
+# per command stage metrics (& cProfile stats with --profile)
+METRICS_DIR = Path(BASE_DIR, "metrics")
+# whether commands write the metrics of their stages to METRICS_DIR unless told otherwise (--metrics/--no-metrics)
+WRITE_METRICS = False
+# most models & scalers kept loaded by the process wide artifact caches, least recently used are evicted
+MODEL_CACHE_SIZE = 8
+SCALER_CACHE_SIZE = 64
+# best weights & backups to resume interrupted training from, within the model dir
+CHECKPOINT_DIR_NAME = "checkpoints"
+# incremental ELT bookkeeping, kept next to the clean data
+ELT_MANIFEST_NAME = "manifest.json"
+ELT_STAGING_DIR_NAME = "staged"
 
 # Data expectations
 EXPECTED_TIME_FMTS = ["%d/%m/%Y %H:%M", "%Y/%m/%d %H:%M"]
 LABELLED_COLUMN_NAME = "VALUE"
+# on disk format of clean data & datasets, "csv" or "npy" (memory mapped, much faster to load)
+DATA_FORMAT = "csv"
+# float32 throughout, split views & in place scaling, for long histories on small workers
+LOW_MEMORY = False
+# stream the data in chunks of CHUNK_ROWS rows & train from memory mapped chunks, for data larger than memory
+OUT_OF_CORE = False
+CHUNK_ROWS = 100_000
 
 # Model expectations
-WINDOW_SIZE = int(24 * 60 / 5)
-# NOTE these including other hyperparameters should go into args.json
-# keeping them here for now in the interest of time
-EPOCHS = 20
-PATIENCE = 2
+# the model always forecasts the next 24 hours in 5min steps
+FORECAST_STEPS = int(24 * 60 / 5)
+
+# Hyperparameters live in args.json, `main.py tune` searches over them & can update it
+ARGS_PATH = Path(CONFIG_DIR, "args.json")
+DEFAULT_ARGS = {
+    # input (lookback) steps of a window
+    "window_size": FORECAST_STEPS,
+    "epochs": 20,
+    "patience": 2,
+    "batch_size": 32,
+    "train_size": 0.7,
+    "val_size": 0.2,
+    "test_size": 0.1,
+}
+ARGS = {**DEFAULT_ARGS, **json.loads(ARGS_PATH.read_text())}
+WINDOW_SIZE = int(ARGS["window_size"])
+EPOCHS = int(ARGS["epochs"])
+PATIENCE = int(ARGS["patience"])
+BATCH_SIZE = int(ARGS["batch_size"])
+TRAIN_SIZE = float(ARGS["train_size"])
+VAL_SIZE = float(ARGS["val_size"])
+TEST_SIZE = float(ARGS["test_size"])
+# values `main.py tune` tries, the test split gets whatever train & val leave
+TUNE_SEARCH_SPACE = {
+    "window_size": [FORECAST_STEPS // 4, FORECAST_STEPS // 2, FORECAST_STEPS],
+    "epochs": [20],
+    "patience": [2, 4],
+    "batch_size": [32, 128],
+    "train_size": [0.6, 0.7],
+    "val_size": [0.2],
+}
+# "adam" (gradient descent) or "lstsq" (closed form least squares, RIDGE is its L2 penalty)
+SOLVER = "adam"
+RIDGE = 0.0
+SHUFFLE_SEED = None
+# "tf" (tf.data pipelines) or "numpy" (strided views, windows aren't copied)
+WINDOW_BACKEND = "tf"
+SEQUENCE_STRIDE = 1
+# cache the tf backend's val & test windows in memory (True) or files (path prefix), they hold ~WINDOW_SIZE
+# copies of the data, the shuffled train windows are never cached
+WINDOW_CACHE = True
+# randomly sample this many train windows every epoch (numpy backend), all if None
+WINDOWS_PER_EPOCH = None
+# tensorflow thread pools, 0 lets tensorflow decide (or splits the cores between data parallel workers)
+INTRA_OP_THREADS = 0
+INTER_OP_THREADS = 0
+# local worker processes to train data parallel across, batch size is per worker
+TRAIN_WORKERS = 1
 
 # Setup logging
-fileConfig(Path(BASE_DIR, "logging_config.ini"), disable_existing_loggers=False)
-logging.Formatter.converter = time.gmtime
 logger = logging.getLogger("powr")
 logger.propagate = True
+
+
+def setup_logging() -> None:
+    """Configure logging from logging_config.ini, called by the CLI rather than on import."""
+    fileConfig(Path(BASE_DIR, "logging_config.ini"), disable_existing_loggers=False)
+    logging.Formatter.converter = time.gmtime
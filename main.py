@@ -1,82 +1,266 @@
+import functools
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
+from typing import Callable, Dict, List
 
 import typer
 
 from config import config
 from config.config import logger
-from powr import data, evaluate, predict, train, utils, window
 
 # Initialize Typer CLI app
+# NOTE powr modules are imported within the commands that use them, so that a command
+# doesn't pay for importing tensorflow, matplotlib etc. unless it needs them
 app = typer.Typer()
 
 
+@app.callback()
+def main(
+    ctx: typer.Context,
+    metrics: bool = typer.Option(
+        config.WRITE_METRICS,
+        "--metrics/--no-metrics",
+        help="Write wall & cpu time, rows, rows/s & peak memory of the command's stages to the metrics dir.",
+    ),
+    profile: bool = typer.Option(
+        False,
+        help="Also dump cProfile stats of the command to the metrics dir, implies --metrics.",
+    ),
+    metrics_dir: Path = config.METRICS_DIR,
+):
+    """powr: power consumption forecasting pipeline."""
+    config.setup_logging()
+    if ctx.invoked_subcommand is None or ctx.resilient_parsing:
+        return
+    if not (metrics or profile):
+        return
+
+    import contextlib
+
+    from powr import profiling
+
+    # the command writes wall & cpu time, rows, rows/s & peak memory of its stages to <command>.json
+    command = ctx.invoked_subcommand.replace("-", "_")
+    profiling.PROFILER.enabled = True
+    profiling.PROFILER.reset()
+    stack = contextlib.ExitStack()
+    if profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        stack.callback(_dump_cprofile, profiler, Path(metrics_dir, f"{command}.prof"))
+    stack.callback(_write_metrics, Path(metrics_dir, f"{command}.json"), command)
+    stack.enter_context(profiling.stage(command))
+    if profile:
+        # callbacks run in reverse, the command's stage & the metrics aren't profiled
+        stack.callback(profiler.disable)
+        profiler.enable()
+    ctx.call_on_close(stack.close)
+
+
+def _write_metrics(metrics_path: Path, command: str) -> None:
+    """Write the metrics the profiler collected during a command."""
+    from powr import profiling
+
+    profiling.PROFILER.write(metrics_path, command=command)
+    logger.info(f"✅ Saved metrics to {metrics_path}!")
+
+
+def _dump_cprofile(profiler, prof_path: Path) -> None:
+    """Dump cProfile stats of a command & log its most expensive calls."""
+    import io
+    import pstats
+
+    prof_path.parent.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(prof_path)
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(15)
+    logger.info(f"✅ Saved cProfile stats to {prof_path}!\n{summary.getvalue()}")
+
+
 @app.command()
-def elt_data():
+def elt_data(
+    n_workers: int = 1,
+    fmt: str = config.DATA_FORMAT,
+    incremental: bool = False,
+    low_memory: bool = config.LOW_MEMORY,
+    raw_data_dir: Path = config.RAW_DATA_DIR,
+    clean_data_dir: Path = config.CLEAN_DATA_DIR,
+):
     """Extra, load, and transform our data."""
+    from powr import data, elt, utils
+
+    cleaned_data_path = Path(clean_data_dir, f"data.{fmt}")
+    if incremental:
+        # only processes raw data files that arrived since the last run
+        df_clean = elt.elt_incremental(
+            raw_data_dir,
+            cleaned_data_path,
+            datatime_str_fmts=config.EXPECTED_TIME_FMTS,
+            manifest_path=Path(clean_data_dir, config.ELT_MANIFEST_NAME),
+            staging_dir=Path(clean_data_dir, config.ELT_STAGING_DIR_NAME),
+            n_workers=n_workers,
+        )
+        logger.info(f"✅ Incrementally updated data, {len(df_clean)} rows!")
+        logger.info(f"✅ Saved data to {cleaned_data_path}!")
+        return
 
     # Extract + Load
-    df_raw = data.load_merge_raw_data(config.RAW_DATA_DIR)
+    df_raw = data.load_merge_raw_data(raw_data_dir, n_workers=n_workers)
     logger.info("✅ Loaded & merged data!")
 
     # Clean
     df_clean = data.clean_df(df_raw, datatime_str_fmts=config.EXPECTED_TIME_FMTS)
+    del df_raw
     logger.info("✅ Cleaned data!")
 
     # Transform
-    df_clean = data.preprocess_df(df_clean)
+    df_clean = data.preprocess_df(df_clean, low_memory=low_memory)
     logger.info("✅ Preprocessed data!")
 
     # Save
-    cleaned_data_path = Path(config.CLEAN_DATA_DIR, "data.csv")
-    df_clean.to_csv(cleaned_data_path, index=True)
+    utils.save_df(df_clean, cleaned_data_path)
     logger.info(f"✅ Saved data to {cleaned_data_path}!")
 
 
 @app.command()
-def generate_dataset():
-    """Generate our dataset."""
+def generate_dataset(
+    fmt: str = config.DATA_FORMAT,
+    clean_data_dir: Path = config.CLEAN_DATA_DIR,
+    dataset_dir: Path = config.DATASET_DIR,
+    model_dir: Path = config.MODEL_DIR,
+    low_memory: bool = config.LOW_MEMORY,
+    out_of_core: bool = config.OUT_OF_CORE,
+    chunksize: int = config.CHUNK_ROWS,
+):
+    """Generate our dataset, as memory mapped chunks per set if out of core."""
+    from powr import data, utils
+
+    cleaned_data_path = Path(clean_data_dir, f"data.{fmt}")
+    scaler_path = Path(model_dir, "scaler.pkl")
+    if out_of_core:
+        # streams the preprocessed data, never loading it as a whole
+        data.generate_dataset_chunks(
+            cleaned_data_path,
+            dataset_dir,
+            scaler_path,
+            train_size=config.TRAIN_SIZE,
+            val_size=config.VAL_SIZE,
+            test_size=config.TEST_SIZE,
+            chunksize=chunksize,
+        )
+        logger.info(f"✅ Scaler saved to {scaler_path}!")
+        logger.info(f"✅ Saved dataset chunks to {dataset_dir}!")
+        return
 
     # Load
-    cleaned_data_path = Path(config.CLEAN_DATA_DIR, "data.csv")
-    df_clean = utils._load_df_head_parse_datetime(
-        cleaned_data_path, header_row=0, date_col="CREATED_AT", index_col="CREATED_AT"
-    )
+    df_clean = utils.load_df(cleaned_data_path)
     logger.info("✅ Loaded preprocessed data!")
 
     # Generate
-    scaler_path = Path(config.MODEL_DIR, "scaler.pkl")
-    ds = data.generate_dataset(df_clean, scaler_path)
+    ds = data.generate_dataset(
+        df_clean,
+        scaler_path,
+        train_size=config.TRAIN_SIZE,
+        val_size=config.VAL_SIZE,
+        test_size=config.TEST_SIZE,
+        low_memory=low_memory,
+    )
+    del df_clean
     logger.info("✅ Generated dataset!")
 
     # Save
-    utils.save_dataset(ds, config.DATASET_DIR)
+    utils.save_dataset(ds, dataset_dir, fmt=fmt)
     logger.info(f"✅ Scaler saved to {scaler_path}!")
-    logger.info(f"✅ Saved dataset to {config.DATASET_DIR}!")
+    logger.info(f"✅ Saved dataset to {dataset_dir}!")
+
+
+def _window_kwargs(window_backend: str) -> Dict:
+    """WindowGenerator arguments of the model, other than the dataset."""
+    return dict(
+        input_width=config.WINDOW_SIZE,
+        label_width=config.FORECAST_STEPS,
+        shift=config.FORECAST_STEPS,
+        label_columns=[config.LABELLED_COLUMN_NAME],
+        batch_size=config.BATCH_SIZE,
+        shuffle_seed=config.SHUFFLE_SEED,
+        backend=window_backend,
+        sequence_stride=config.SEQUENCE_STRIDE,
+        windows_per_epoch=config.WINDOWS_PER_EPOCH,
+        cache=config.WINDOW_CACHE,
+    )
 
 
 @app.command()
-def train_model():
-    """Train our model."""
+def train_model(
+    fmt: str = config.DATA_FORMAT,
+    window_backend: str = config.WINDOW_BACKEND,
+    solver: str = config.SOLVER,
+    ridge: float = config.RIDGE,
+    n_workers: int = config.TRAIN_WORKERS,
+    intra_op_threads: int = config.INTRA_OP_THREADS,
+    inter_op_threads: int = config.INTER_OP_THREADS,
+    out_of_core: bool = config.OUT_OF_CORE,
+    dataset_dir: Path = config.DATASET_DIR,
+    model_dir: Path = config.MODEL_DIR,
+):
+    """Train our model, data parallel across n_workers local processes if more than 1,
+    from the memory mapped dataset chunks if out of core."""
+    from powr import distributed, evaluate, train, utils, window
+
+    # has to happen before tensorflow runs any op, data parallel workers configure their own
+    if intra_op_threads or inter_op_threads:
+        train.configure_threads(
+            intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads
+        )
+    data_parallel = n_workers > 1 and solver == "adam" and not out_of_core
+    if out_of_core:
+        # only the numpy backend windows chunks
+        fmt, window_backend = utils.CHUNKED_FORMAT, "numpy"
 
     # Load
-    ds = utils.load_dataset(config.DATASET_DIR)
+    ds = utils.load_dataset(dataset_dir, fmt=fmt)
     logger.info("✅ Loaded dataset!")
 
     # Train
-    num_features = ds["train"].shape[1]
-    model = train.build_model(config.WINDOW_SIZE, num_features)
-    multi_window = window.WindowGenerator(
-        input_width=config.WINDOW_SIZE,
-        label_width=config.WINDOW_SIZE,
-        shift=config.WINDOW_SIZE,
-        dataset_dict=ds,
-        label_columns=[config.LABELLED_COLUMN_NAME],
-    )
+    num_features = ds["train"][0].shape[1] if out_of_core else ds["train"].shape[1]
+    window_kwargs = _window_kwargs(window_backend)
+    multi_window = window.WindowGenerator(dataset_dict=ds, **window_kwargs)
 
-    model, history = train.train_model(
-        model, multi_window, config.EPOCHS, config.PATIENCE
-    )
-    logger.info("✅ Trained model!")
+    checkpoint_dir = Path(model_dir, config.CHECKPOINT_DIR_NAME)
+    if data_parallel:
+        model, report = distributed.train_model_data_parallel(
+            dataset_dir,
+            window_kwargs,
+            checkpoint_dir,
+            config.EPOCHS,
+            config.PATIENCE,
+            n_workers=n_workers,
+            intra_op_threads=intra_op_threads,
+            inter_op_threads=inter_op_threads,
+            fmt=fmt,
+        )
+        logger.info(
+            f"✅ Trained model on {n_workers} workers, {report['windows_per_second']:.1f} windows/s!"
+        )
+    else:
+        model = train.build_model(config.FORECAST_STEPS, num_features)
+        model, history = train.train_model(
+            model,
+            multi_window,
+            config.EPOCHS,
+            config.PATIENCE,
+            solver=solver,
+            ridge=ridge,
+            checkpoint_dir=checkpoint_dir,
+        )
+        logger.info("✅ Trained model!")
 
     # Evaluate
     val_performance, test_performance = evaluate.evaluate_model(model, multi_window)
@@ -85,24 +269,224 @@ def train_model():
     )
 
     # Train on full dataset before saving
-    model, history = train.train_model(
-        model, multi_window, config.EPOCHS, config.PATIENCE
-    )
+    if solver == "lstsq":
+        model, history = train.train_model(
+            model,
+            multi_window,
+            config.EPOCHS,
+            config.PATIENCE,
+            all_data=True,
+            solver=solver,
+            ridge=ridge,
+        )
+    elif data_parallel:
+        model, report = distributed.train_model_data_parallel(
+            dataset_dir,
+            window_kwargs,
+            checkpoint_dir,
+            None,
+            n_workers=n_workers,
+            intra_op_threads=intra_op_threads,
+            inter_op_threads=inter_op_threads,
+            fmt=fmt,
+            refit=True,
+        )
+    else:
+        model, history = train.refit_model(model, multi_window, checkpoint_dir)
     logger.info("✅ Trained model again on full dataset!")
 
     # Save
-    model_path = Path(config.MODEL_DIR, "linear_model")
+    model_path = Path(model_dir, "linear_model")
     model.save(model_path)
     logger.info(f"✅ Saved model to {model_path}!")
 
+    # Export weights for tensorflow free inference
+    numpy_model_path = Path(model_dir, "linear_model.npz")
+    train.export_numpy_model(
+        model, config.FORECAST_STEPS, num_features, numpy_model_path
+    )
+    logger.info(f"✅ Exported numpy model to {numpy_model_path}!")
+    return val_performance, test_performance
+
+
+@app.command()
+def train_scaling(
+    worker_counts: List[int] = typer.Option([1, 2, 4]),
+    epochs: int = 3,
+    fmt: str = config.DATA_FORMAT,
+    window_backend: str = config.WINDOW_BACKEND,
+    dataset_dir: Path = config.DATASET_DIR,
+    output_path: Path = Path(config.MODEL_DIR, "train_scaling.csv"),
+):
+    """Report training throughput versus the number of data parallel workers, to size training machines."""
+    from powr import distributed
+
+    report_df = distributed.scaling_report(
+        dataset_dir,
+        _window_kwargs(window_backend),
+        worker_counts,
+        epochs=epochs,
+        fmt=fmt,
+    )
+    logger.info(f"✅ Scaling report: \n{report_df.to_markdown(index=False)}")
+
+    # Save
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    report_df.to_csv(output_path, index=False)
+    logger.info(f"✅ Saved scaling report to {output_path}!")
+    return report_df
+
 
 @app.command()
-def predict_powr():
+def tune(
+    n_trials: int = 0,
+    n_workers: int = 0,
+    threads_per_trial: int = 1,
+    prune: bool = True,
+    update_args: bool = False,
+    fmt: str = config.DATA_FORMAT,
+    clean_data_dir: Path = config.CLEAN_DATA_DIR,
+    output_dir: Path = Path(config.MODEL_DIR, "tuning"),
+):
+    """Search over window, split & training hyperparameters with concurrent trials & write a leaderboard."""
+    from powr import tune as tuning
+
+    leaderboard = tuning.tune(
+        config.TUNE_SEARCH_SPACE,
+        Path(clean_data_dir, f"data.{fmt}"),
+        output_dir,
+        forecast_steps=config.FORECAST_STEPS,
+        label_columns=[config.LABELLED_COLUMN_NAME],
+        n_trials=n_trials or None,
+        n_workers=n_workers or None,
+        threads_per_trial=threads_per_trial,
+        prune=prune,
+    )
+    logger.info(f"✅ Leaderboard: \n{leaderboard.to_markdown(index=False)}")
+    logger.info(f"✅ Saved leaderboard to {Path(output_dir, tuning.LEADERBOARD_NAME)}!")
+
+    best_args_path = Path(output_dir, tuning.BEST_ARGS_NAME)
+    if not best_args_path.exists():
+        logger.error("❌ No trial completed!")
+        raise typer.Exit(code=1)
+    if update_args:
+        best_args = json.loads(best_args_path.read_text())
+        config.ARGS_PATH.write_text(
+            json.dumps({**config.ARGS, **best_args}, indent=2) + "\n"
+        )
+        logger.info(f"✅ Updated {config.ARGS_PATH} with the best hyperparameters!")
+    return leaderboard
+
+
+def _uses_artifact_caches(command: Callable) -> Callable:
+    """Size the process wide model & scaler caches from config for a command
+    & log their hits, misses & evictions once it's done."""
+
+    @functools.wraps(command)
+    def wrapper(*args, **kwargs):
+        from powr import predict
+
+        caches = {"model": predict.MODEL_CACHE, "scaler": predict.SCALER_CACHE}
+        caches["model"].resize(config.MODEL_CACHE_SIZE)
+        caches["scaler"].resize(config.SCALER_CACHE_SIZE)
+        try:
+            return command(*args, **kwargs)
+        finally:
+            for name, cache in caches.items():
+                logger.info(f"✅ {name.capitalize()} cache: {cache.stats}")
+
+    return wrapper
+
+
+def _model_path(model_dir: Path, numpy_model: bool, tflite_model: bool) -> Path:
+    """Path of the trained model, or of one of its exported inference artifacts."""
+    if numpy_model:
+        return Path(model_dir, "linear_model.npz")
+    if tflite_model:
+        return Path(model_dir, "linear_model.tflite")
+    return Path(model_dir, "linear_model")
+
+
+@app.command()
+def export_model(
+    quantization: str = "none",
+    compare: bool = True,
+    fmt: str = config.DATA_FORMAT,
+    dataset_dir: Path = config.DATASET_DIR,
+    model_dir: Path = config.MODEL_DIR,
+):
+    """Export the trained model as a TFLite model (optionally float16/int8 quantized) & a concrete function
+    SavedModel for faster inference, & compare them against the keras model on the test set."""
+    from powr import predict, train, utils
+
+    # Load
+    model_path = Path(model_dir, "linear_model")
+    model = predict.load_model(model_path)
+    ds = utils.load_dataset(dataset_dir, fmt=fmt)
+    num_features = ds["test"].shape[1]
+    logger.info("✅ Loaded model & dataset!")
+
+    # Export
+    serving_model_path = Path(model_dir, "linear_model_serving")
+    train.export_serving_model(
+        model, config.WINDOW_SIZE, num_features, serving_model_path
+    )
+    logger.info(f"✅ Exported concrete function model to {serving_model_path}!")
+    tflite_model_path = Path(model_dir, "linear_model.tflite")
+    train.export_tflite_model(
+        model,
+        config.WINDOW_SIZE,
+        num_features,
+        tflite_model_path,
+        quantization=quantization,
+        # int8 activations are calibrated on a window per day of the train set
+        representative_windows=predict.sample_windows(
+            ds["train"], config.WINDOW_SIZE, config.FORECAST_STEPS
+        ),
+    )
+    logger.info(
+        f"✅ Exported {quantization} quantized TFLite model to {tflite_model_path}!"
+    )
+    if not compare:
+        return
+
+    # Compare
+    report_df = predict.compare_models(
+        {
+            "keras": model_path,
+            "serving": serving_model_path,
+            f"tflite_{quantization}": tflite_model_path,
+        },
+        predict.sample_windows(ds["test"], config.WINDOW_SIZE, config.FORECAST_STEPS),
+        reference="keras",
+    )
+    logger.info(
+        f"✅ Compared exported models: \n{report_df.to_markdown(index=False, floatfmt='.4g')}"
+    )
+
+    # Save
+    report_path = Path(model_dir, "export_report.csv")
+    report_df.to_csv(report_path, index=False)
+    logger.info(f"✅ Saved export report to {report_path}!")
+    return report_df
+
+
+@app.command()
+@_uses_artifact_caches
+def predict_powr(
+    fmt: str = config.DATA_FORMAT,
+    dataset_dir: Path = config.DATASET_DIR,
+    model_dir: Path = config.MODEL_DIR,
+    prediction_dir: Path = config.PREDICTION_DIR,
+    numpy_model: bool = False,
+    tflite_model: bool = False,
+):
     """Predict the power consumption for the next 24hrs using the last 24 hours."""
+    from powr import predict
 
-    model_path = Path(config.MODEL_DIR, "linear_model")
-    scaler_path = Path(config.MODEL_DIR, "scaler.pkl")
-    last_24_data_path = Path(config.DATASET_DIR, "test.csv")
+    model_path = _model_path(model_dir, numpy_model, tflite_model)
+    scaler_path = Path(model_dir, "scaler.pkl")
+    last_24_data_path = Path(dataset_dir, f"test.{fmt}")
 
     predictions = predict.predict_next_24(
         model_path=model_path,
@@ -112,9 +496,241 @@ def predict_powr():
     logger.info(f"✅ Predictions: \n{predictions.to_markdown(index=False)}")
 
     # Save
-    prediction_path = Path(config.PREDICTION_DIR, "predictions.csv")
+    prediction_path = Path(prediction_dir, "predictions.csv")
     predictions.to_csv(prediction_path, index=False)
     logger.info(f"✅ Saved predictions to {prediction_path}!")
+    return predictions
+
+
+@app.command()
+@_uses_artifact_caches
+def backtest(
+    stride: str = "1D",
+    start: str = "",
+    end: str = "",
+    split: str = "all",
+    fmt: str = config.DATA_FORMAT,
+    dataset_dir: Path = config.DATASET_DIR,
+    model_dir: Path = config.MODEL_DIR,
+    prediction_dir: Path = config.PREDICTION_DIR,
+    numpy_model: bool = False,
+    tflite_model: bool = False,
+):
+    """Backtest 24 hour forecasts from an origin every stride (e.g. daily) between start & end."""
+    import pandas as pd
+
+    from powr import backtest as backtesting
+    from powr import predict, utils
+
+    # Load
+    ds = utils.load_dataset(dataset_dir, fmt=fmt)
+    df = (
+        pd.concat([ds["train"], ds["val"], ds["test"]], copy=False)
+        if split == "all"
+        else ds[split]
+    )
+    model_path = _model_path(model_dir, numpy_model, tflite_model)
+    model = predict.MODEL_CACHE.get(model_path)
+    scaler = predict.SCALER_CACHE.get(Path(model_dir, "scaler.pkl"))
+    logger.info("✅ Loaded dataset, model & scaler!")
+
+    # Backtest
+    results = backtesting.backtest(
+        model,
+        scaler,
+        df,
+        window_size=config.WINDOW_SIZE,
+        horizon=config.FORECAST_STEPS,
+        stride=stride,
+        start=start or None,
+        end=end or None,
+        target_column=config.LABELLED_COLUMN_NAME,
+    )
+    overall = results["overall"]
+    logger.info(
+        f"✅ Backtested {overall['n_origins']} forecasts, MAE: {overall['mae']:.4f}, MAPE: {overall['mape']:.2f}%"
+    )
+
+    # Save
+    for name in ["steps", "origins"]:
+        metrics_path = Path(prediction_dir, f"backtest_{name}.csv")
+        results[name].to_csv(metrics_path, index=False)
+        logger.info(f"✅ Saved backtest {name} metrics to {metrics_path}!")
+    return results
+
+
+def _init_batch_worker(threads_per_worker: int) -> None:
+    """Limit the threads of a batch worker process so that workers don't oversubscribe cores."""
+    # OpenMP & BLAS size their thread pools when numpy & tensorflow are imported, i.e. before any powr import
+    for name in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]:
+        os.environ[name] = str(threads_per_worker)
+    from powr import train
+
+    config.setup_logging()
+    train.configure_threads(
+        intra_op_threads=threads_per_worker, inter_op_threads=threads_per_worker
+    )
+
+
+def _run_customer_pipeline(customer_dir: Path, output_dir: Path, fmt: str) -> Dict:
+    """Run elt-data -> generate-dataset -> train-model -> predict-powr for one customer.
+    exceptions are caught & reported, so that one customer failing doesn't affect the others
+
+    Args:
+        customer_dir (Path): directory with the raw data files of the customer
+        output_dir (Path): directory to write the customer's clean data, dataset, model & predictions to
+        fmt (str): on disk format of clean data & datasets
+
+    Returns:
+        Dict: summary of the customer's run
+    """
+    dirs = {
+        name: Path(output_dir, customer_dir.name, name)
+        for name in ["clean", "dataset", "models", "predictions"]
+    }
+    summary = {"customer": customer_dir.name, "status": "ok", "error": None}
+    start = time.perf_counter()
+    try:
+        for customer_subdir in dirs.values():
+            customer_subdir.mkdir(parents=True, exist_ok=True)
+        elt_data(fmt=fmt, raw_data_dir=customer_dir, clean_data_dir=dirs["clean"])
+        generate_dataset(
+            fmt=fmt,
+            clean_data_dir=dirs["clean"],
+            dataset_dir=dirs["dataset"],
+            model_dir=dirs["models"],
+        )
+        val_performance, test_performance = train_model(
+            fmt=fmt, dataset_dir=dirs["dataset"], model_dir=dirs["models"]
+        )
+        predict_powr(
+            fmt=fmt,
+            dataset_dir=dirs["dataset"],
+            model_dir=dirs["models"],
+            prediction_dir=dirs["predictions"],
+        )
+        summary.update(val_loss=val_performance[0], test_loss=test_performance[0])
+    except Exception as error:
+        logger.error(f"❌ {customer_dir.name} failed!\n{traceback.format_exc()}")
+        summary.update(status="failed", error=repr(error))
+    summary["seconds"] = round(time.perf_counter() - start, 2)
+    return summary
+
+
+def _run_customer_in_process(
+    customer_dir: Path,
+    output_dir: Path,
+    fmt: str,
+    threads_per_worker: int,
+    pipeline: Callable[[Path, Path, str], Dict] = _run_customer_pipeline,
+) -> Dict:
+    """Run a customer's pipeline in a process of its own, so that the process dying (e.g. OOM or a segfault)
+    only fails that customer, a shared pool would break & fail every customer still queued on it.
+
+    Args:
+        customer_dir (Path): directory with the raw data files of the customer
+        output_dir (Path): directory to write the customer's outputs to
+        fmt (str): on disk format of clean data & datasets
+        threads_per_worker (int): threads of the process
+        pipeline (Callable[[Path, Path, str], Dict], optional): the customer's pipeline, a module level function.
+                                    Defaults to _run_customer_pipeline.
+
+    Returns:
+        Dict: summary of the customer's run
+    """
+    # spawn rather than fork, tensorflow isn't fork safe
+    with ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_batch_worker,
+        initargs=(threads_per_worker,),
+    ) as executor:
+        try:
+            return executor.submit(pipeline, customer_dir, output_dir, fmt).result()
+        except BrokenProcessPool as error:
+            logger.error(f"❌ {customer_dir.name}'s worker process died!")
+            return {
+                "customer": customer_dir.name,
+                "status": "failed",
+                "error": repr(error),
+            }
+
+
+@app.command()
+def batch(
+    customers_dir: Path,
+    output_dir: Path,
+    n_workers: int = os.cpu_count() or 1,
+    threads_per_worker: int = 0,
+    fmt: str = config.DATA_FORMAT,
+):
+    """Run the whole pipeline for every customer (sub directory of raw data files) in customers_dir."""
+    import pandas as pd
+
+    customer_dirs = sorted(path for path in customers_dir.iterdir() if path.is_dir())
+    # split the cores between workers unless told otherwise
+    threads_per_worker = threads_per_worker or max(
+        (os.cpu_count() or 1) // n_workers, 1
+    )
+    logger.info(
+        f"✅ Found {len(customer_dirs)} customers, running {n_workers} workers x {threads_per_worker} threads!"
+    )
+
+    # every customer runs in a process of its own, n_workers at a time
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        summaries = list(
+            executor.map(
+                lambda customer_dir: _run_customer_in_process(
+                    customer_dir, output_dir, fmt, threads_per_worker
+                ),
+                customer_dirs,
+            )
+        )
+
+    # Save
+    summary_df = pd.DataFrame(
+        summaries,
+        columns=["customer", "status", "seconds", "val_loss", "test_loss", "error"],
+    ).sort_values("customer", ignore_index=True)
+    summary_path = Path(output_dir, "summary.csv")
+    summary_df.to_csv(summary_path, index=False)
+    n_failed = int((summary_df["status"] != "ok").sum())
+    logger.info(f"✅ Batch summary: \n{summary_df.to_markdown(index=False)}")
+    logger.info(f"✅ Saved batch summary to {summary_path}!")
+    if n_failed:
+        logger.error(f"❌ {n_failed} of {len(summary_df)} customers failed!")
+        raise typer.Exit(code=1)
+
+
+@app.command()
+@_uses_artifact_caches
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    max_batch_size: int = 64,
+    max_wait_ms: float = 5.0,
+    model_dir: Path = config.MODEL_DIR,
+    numpy_model: bool = False,
+):
+    """Serve forecasts over HTTP, POST the last 24 hours of readings to /predict,
+    a json list of 288 5min bins like [{"CREATED_AT": "2022-01-01 00:00:00", "VALUE": 42.0}, ...] in real units."""
+    from powr import predict, service
+
+    model_path = Path(model_dir, "linear_model.npz" if numpy_model else "linear_model")
+    model = predict.MODEL_CACHE.get(model_path)
+    scaler = predict.SCALER_CACHE.get(Path(model_dir, "scaler.pkl"))
+    logger.info("✅ Loaded model & scaler!")
+
+    forecast_service = service.ForecastService(
+        model, scaler, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms
+    )
+    server = service.make_server(forecast_service, host=host, port=port)
+    logger.info(f"✅ Serving forecasts on http://{host}:{port}/predict!")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        logger.info("✅ Stopped serving!")
 
 
 @app.command()
@@ -0,0 +1,224 @@
+"""Module for rolling origin backtesting
+forecasts from every (e.g. daily) origin across a date range in large batches & scores each step of the horizon,
+without one predict call per origin"""
+from typing import TYPE_CHECKING, Dict, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import MinMaxScaler
+
+if TYPE_CHECKING:
+    import tensorflow as tf
+
+    from powr.predict import NumpyLinearModel
+
+
+def forecast_origins(
+    index: pd.DatetimeIndex,
+    window_size: int,
+    horizon: int,
+    stride: Union[str, pd.Timedelta] = "1D",
+    start: Union[str, pd.Timestamp, None] = None,
+    end: Union[str, pd.Timestamp, None] = None,
+) -> np.ndarray:
+    """Positions of the forecast origins, the last row of the inputs of every forecast,
+    every stride from start to end, that have a full window before & a full horizon after them.
+
+    Args:
+        index (pd.DatetimeIndex): sorted index of the data
+        window_size (int): number of input rows of a forecast
+        horizon (int): number of rows a forecast predicts
+        stride (Union[str, pd.Timedelta], optional): time between origins. Defaults to "1D".
+        start (Union[str, pd.Timestamp, None], optional): first origin, the earliest possible if None.
+                                    Defaults to None.
+        end (Union[str, pd.Timestamp, None], optional): last origin, the latest possible if None. Defaults to None.
+
+    Returns:
+        np.ndarray: positions of the origins in the index
+    """
+    first, last = window_size - 1, len(index) - horizon - 1
+    if last < first:
+        return np.array([], dtype=np.int64)
+
+    def _as_index_ns(timestamp):
+        timestamp = pd.Timestamp(timestamp)
+        if index.tz is not None and timestamp.tz is None:
+            timestamp = timestamp.tz_localize(index.tz)
+        return timestamp.value
+
+    index_ns = index.asi8
+    start_ns = (
+        index_ns[first] if start is None else max(_as_index_ns(start), index_ns[first])
+    )
+    end_ns = index_ns[last] if end is None else min(_as_index_ns(end), index_ns[last])
+    if end_ns < start_ns:
+        return np.array([], dtype=np.int64)
+
+    origins_ns = np.arange(start_ns, end_ns + 1, pd.Timedelta(stride).value)
+    # last row at or before every origin time, rows missing from the index don't shift the origins
+    positions = np.searchsorted(index_ns, origins_ns, side="right") - 1
+    return np.unique(positions[(positions >= first) & (positions <= last)])
+
+
+def backtest_forecasts(
+    model: Union["tf.keras.Model", "NumpyLinearModel"],
+    scaler: MinMaxScaler,
+    df: pd.DataFrame,
+    origins: np.ndarray,
+    window_size: int,
+    horizon: int,
+    target_column: str = "VALUE",
+    batch_size: int = 4096,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Forecast from every origin in batches & line the forecasts up with the actual values, both denormalised.
+
+    Args:
+        model (Union[tf.keras.Model, NumpyLinearModel]): the model to predict with
+        scaler (MinMaxScaler): the scaler the data was normalised with
+        df (pd.DataFrame): normalised data, in the dataset's format
+        origins (np.ndarray): positions of the origins in df, see `forecast_origins`
+        window_size (int): number of input rows of a forecast
+        horizon (int): number of rows a forecast predicts
+        target_column (str, optional): forecasted column. Defaults to "VALUE".
+        batch_size (int, optional): number of origins per model call. Defaults to 4096.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: forecasts & actuals, both of shape (n_origins, horizon)
+    """
+    data = np.asarray(df, dtype=np.float32)
+    target_index = df.columns.get_loc(target_column)
+    # (rows, features, window_size) view => (rows, window_size, features) view, neither copies the data
+    windows = np.lib.stride_tricks.sliding_window_view(
+        data, window_size, axis=0
+    ).transpose(0, 2, 1)
+    first_rows = origins - (window_size - 1)
+
+    forecasts = np.empty((len(origins), horizon), dtype=np.float64)
+    for start in range(0, len(origins), batch_size):
+        batch_rows = first_rows[start : start + batch_size]  # noqa: E203
+        # fancy indexing materialises only this batch's windows
+        predictions = model.predict(
+            windows[batch_rows], batch_size=len(batch_rows), verbose=0
+        )
+        forecasts[start : start + len(batch_rows)] = np.reshape(  # noqa: E203
+            predictions, (len(batch_rows), horizon, -1)
+        )[:, :, target_index]
+
+    actuals = np.lib.stride_tricks.sliding_window_view(data[:, target_index], horizon)[
+        origins + 1
+    ]
+
+    # MinMaxScaler.inverse_transform, for the target column only
+    def _inverse(values):
+        return (values - scaler.min_[target_index]) / scaler.scale_[target_index]
+
+    return _inverse(forecasts), _inverse(actuals.astype(np.float64))
+
+
+def _abs_errors(
+    forecasts: np.ndarray, actuals: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Absolute & absolute percentage errors, the latter nan where the actual value is 0."""
+    abs_errors = np.abs(forecasts - actuals)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        abs_pct_errors = np.where(
+            actuals != 0, abs_errors / np.abs(actuals) * 100, np.nan
+        )
+    return abs_errors, abs_pct_errors
+
+
+def _nanmean(values: np.ndarray, axis: Union[int, None] = None) -> np.ndarray:
+    """np.nanmean without the warning for all nan (or empty) slices."""
+    counts = np.sum(~np.isnan(values), axis=axis)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(counts > 0, np.nansum(values, axis=axis) / counts, np.nan)
+
+
+def horizon_metrics(
+    forecasts: np.ndarray, actuals: np.ndarray, step_minutes: int = 5
+) -> pd.DataFrame:
+    """MAE & MAPE of every step of the horizon across all origins.
+    actual values of 0 are left out of MAPE
+
+    Args:
+        forecasts (np.ndarray): forecasts of shape (n_origins, horizon)
+        actuals (np.ndarray): actual values of shape (n_origins, horizon)
+        step_minutes (int, optional): minutes between steps. Defaults to 5.
+
+    Returns:
+        pd.DataFrame: step, lead_minutes, mae & mape (in %) columns, one row per step
+    """
+    abs_errors, abs_pct_errors = _abs_errors(forecasts, actuals)
+    steps = np.arange(1, forecasts.shape[1] + 1)
+    return pd.DataFrame(
+        {
+            "step": steps,
+            "lead_minutes": steps * step_minutes,
+            "mae": _nanmean(abs_errors, axis=0),
+            "mape": _nanmean(abs_pct_errors, axis=0),
+        }
+    )
+
+
+def backtest(
+    model: Union["tf.keras.Model", "NumpyLinearModel"],
+    scaler: MinMaxScaler,
+    df: pd.DataFrame,
+    window_size: int,
+    horizon: int,
+    stride: Union[str, pd.Timedelta] = "1D",
+    start: Union[str, pd.Timestamp, None] = None,
+    end: Union[str, pd.Timestamp, None] = None,
+    target_column: str = "VALUE",
+    batch_size: int = 4096,
+) -> Dict[str, Union[pd.DataFrame, Dict]]:
+    """Rolling origin backtest of the model over df, forecasting from an origin every stride from start to end.
+
+    Args:
+        model (Union[tf.keras.Model, NumpyLinearModel]): the model to predict with
+        scaler (MinMaxScaler): the scaler the data was normalised with
+        df (pd.DataFrame): normalised data, in the dataset's format & on a 5min grid
+        window_size (int): number of input rows of a forecast
+        horizon (int): number of rows a forecast predicts
+        stride (Union[str, pd.Timedelta], optional): time between origins. Defaults to "1D".
+        start (Union[str, pd.Timestamp, None], optional): first origin, the earliest possible if None.
+                                    Defaults to None.
+        end (Union[str, pd.Timestamp, None], optional): last origin, the latest possible if None. Defaults to None.
+        target_column (str, optional): forecasted column. Defaults to "VALUE".
+        batch_size (int, optional): number of origins per model call. Defaults to 4096.
+
+    Returns:
+        Dict[str, Union[pd.DataFrame, Dict]]: per step metrics ("steps"), per origin metrics ("origins")
+                                    & metrics across all steps & origins ("overall"), MAPE is in %
+    """
+    origins = forecast_origins(
+        df.index, window_size, horizon, stride=stride, start=start, end=end
+    )
+    forecasts, actuals = backtest_forecasts(
+        model,
+        scaler,
+        df,
+        origins,
+        window_size,
+        horizon,
+        target_column=target_column,
+        batch_size=batch_size,
+    )
+    abs_errors, abs_pct_errors = _abs_errors(forecasts, actuals)
+    origin_metrics = pd.DataFrame(
+        {
+            "origin": df.index[origins],
+            "mae": _nanmean(abs_errors, axis=1),
+            "mape": _nanmean(abs_pct_errors, axis=1),
+        }
+    )
+    overall = {
+        "n_origins": len(origins),
+        "mae": float(_nanmean(abs_errors)),
+        "mape": float(_nanmean(abs_pct_errors)),
+    }
+    return {
+        "steps": horizon_metrics(forecasts, actuals),
+        "origins": origin_metrics,
+        "overall": overall,
+    }
@@ -1,20 +1,70 @@
 """Module that contains data ops"""
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path, PosixPath
-from typing import Dict, List
+from typing import Dict, Iterator, List, Tuple
 
 import joblib
 import numpy as np
 import pandas as pd
+import sklearn
 from sklearn.preprocessing import MinMaxScaler
 
-from powr import utils
+from powr import features, profiling, utils
 
+# raw data files picked up by the loaders, compression is inferred from the extension
+# NOTE .zst files need the optional zstandard package
+RAW_DATA_FILE_PATTERNS = ("*.csv", "*.csv.gz", "*.csv.zst")
 
-def load_merge_raw_data(raw_data_dir: Path) -> pd.DataFrame:
+NOT_EQUIVALENT_ERROR_MSG = "Dataframes are not equivalent, they should have same columns, index & dtypes. Check your data."
+
+
+def _list_raw_data_files(
+    raw_data_dir: Path, patterns: Tuple[str, ...] = RAW_DATA_FILE_PATTERNS
+) -> List[Path]:
+    """List raw data files in a directory, sorted by name so that merge order is deterministic.
+
+    Args:
+        raw_data_dir (Path): path (abs or rel) to directory containing raw data
+        patterns (Tuple[str, ...], optional): glob patterns of raw data files.
+                                    Defaults to RAW_DATA_FILE_PATTERNS.
+
+    Returns:
+        List[Path]: sorted absolute paths of raw data files
+    """
+    fpaths = {
+        fpath.absolute() for pattern in patterns for fpath in raw_data_dir.glob(pattern)
+    }
+    return sorted(fpaths)
+
+
+def _validate_raw_data_schemas(fpaths: List[Path], schema_sample_rows: int) -> None:
+    """Validate that raw data files share a schema using only their header & first few rows.
+
+    Args:
+        fpaths (List[Path]): paths to raw data files
+        schema_sample_rows (int): number of rows to read from each file to infer dtypes
+
+    Raises:
+        TypeError: if the samples are not compatible
+    """
+    df_samples = [pd.read_csv(fpath, nrows=schema_sample_rows) for fpath in fpaths]
+    if not utils.are_df_samples_compatible(df_samples):
+        raise TypeError(NOT_EQUIVALENT_ERROR_MSG)
+
+
+@profiling.profiled()
+def load_merge_raw_data(
+    raw_data_dir: Path, n_workers: int = 1, schema_sample_rows: int = 1000
+) -> pd.DataFrame:
     """Load raw data from a directory and merge into a single dataframe.
+        - schemas are checked from a sample of each file before any file is read in full
+        - files are read concurrently when n_workers > 1
+        - gzip/zstd compressed csvs are supported
 
     Args:
         raw_data_dir (Path): path (abs or rel) to directory containing raw data
+        n_workers (int, optional): number of files to read concurrently. Defaults to 1.
+        schema_sample_rows (int, optional): rows read per file to validate schemas. Defaults to 1000.
 
     Returns:
         pd.DataFrame: raw data merged into a dataframe
@@ -23,96 +73,251 @@ def load_merge_raw_data(raw_data_dir: Path) -> pd.DataFrame:
         TypeError: if dataframes are not equivalent
     """
 
-    abs_fpaths_raw_data_files = [
-        fpath.absolute() for fpath in raw_data_dir.glob("*.csv")
-    ]
-    df_raw_list = [pd.read_csv(fpath) for fpath in abs_fpaths_raw_data_files]
+    abs_fpaths_raw_data_files = _list_raw_data_files(raw_data_dir)
+    _validate_raw_data_schemas(abs_fpaths_raw_data_files, schema_sample_rows)
+
+    # pandas' C parser releases the GIL, so threads are enough to overlap reads
+    with ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+        df_raw_list = list(executor.map(pd.read_csv, abs_fpaths_raw_data_files))
 
     if utils.are_dfs_equivalent(df_raw_list):
         df_raw = pd.concat(df_raw_list, axis=0, ignore_index=True)
         return df_raw
 
-    raise TypeError(
-        "Dataframes are not equivalent, they should have same columns, index & dtypes. Check your data."
-    )
+    raise TypeError(NOT_EQUIVALENT_ERROR_MSG)
 
 
-def clean_df(
-    raw_dataframe: pd.DataFrame,
-    datatime_str_fmts: List[str],
+def iter_raw_data(
+    raw_data_dir: Path, chunksize: int = 100_000, schema_sample_rows: int = 1000
+) -> Iterator[pd.DataFrame]:
+    """Stream raw data from a directory in chunks, so that memory use is bounded by chunksize
+    rather than by the size of the raw data directory.
+    NOTE dtypes are only validated on a sample of each file & can differ between chunks
+
+    Args:
+        raw_data_dir (Path): path (abs or rel) to directory containing raw data
+        chunksize (int, optional): maximum number of rows per chunk. Defaults to 100_000.
+        schema_sample_rows (int, optional): rows read per file to validate schemas. Defaults to 1000.
+
+    Yields:
+        Iterator[pd.DataFrame]: chunks of raw data, in file order
+
+    Raises:
+        TypeError: if dataframes are not equivalent
+    """
+    abs_fpaths_raw_data_files = _list_raw_data_files(raw_data_dir)
+    _validate_raw_data_schemas(abs_fpaths_raw_data_files, schema_sample_rows)
+
+    for fpath in abs_fpaths_raw_data_files:
+        with pd.read_csv(fpath, chunksize=chunksize) as reader:
+            for chunk in reader:
+                yield chunk
+
+
+def _drop_invalid_rows(
+    raw_dataframe: pd.DataFrame, datatime_str_fmts: List[str]
 ) -> pd.DataFrame:
-    """Clean raw dataframe
+    """Row level cleaning, can be applied to raw data files independently
        - drops rows with null values
        - converts date column to datetime
        - drops duplicate rows
        - drops rows with negative power consumption values
-       - sorts dataframe by datetime
-       - removes date time duplicates by mean imputation
-       - time series resampling to 5min frequency by summing values in bins
 
     Args:
         raw_dataframe (pd.DataFrame): raw dataframe
-        datatime_str_fmts (List[str], optional): list of strptime formats to try.
+        datatime_str_fmts (List[str]): list of strptime formats to try.
 
     Returns:
-        pd.DataFrame: cleaned dataframe
+        pd.DataFrame: valid rows of the raw dataframe
     """
-
     df = raw_dataframe.copy(deep=True)
 
     # drop rows with null values
     df.dropna(how="any", inplace=True)
 
-    # convert date column to datetime
-    # pretty slow but okay for a first pass, can vectorise/optimise later
-    df["CREATED_AT"] = df["CREATED_AT"].apply(
-        lambda x: utils._str_to_datetime(x, datatime_str_fmts)
+    # convert date column to datetime, one format at a time over the whole column
+    df["CREATED_AT"] = utils._str_series_to_datetime(
+        df["CREATED_AT"], datatime_str_fmts
     )
 
     # drop duplicate rows & rows where power consumption is negative
     df.drop_duplicates(keep="first", ignore_index=True, inplace=True)
     df.drop(df[df["VALUE"] < 0].index, inplace=True)
 
-    # drop columns that are not unique across rows
-    nunique = df.nunique()
-    cols_to_drop = nunique[nunique == 1].index
-    df.drop(cols_to_drop, axis=1, inplace=True)
+    return df
+
+
+def _bin_rows(
+    created_at: pd.Series,
+    columns_df: pd.DataFrame,
+    drop_duplicates: bool = True,
+    drop_constant_columns: bool = True,
+    bin_freq: str = "5min",
+) -> pd.DataFrame:
+    """Fused row cleaning & resampling of parsed rows, with integer bucket arithmetic on epoch ns
+    instead of sort_values, groupby & resample
+       - drops duplicate rows (on first appearance codes, no sort)
+       - drops rows with negative power consumption values
+       - drops columns that hold a single value
+       - removes date time duplicates by mean imputation (bincount over timestamp codes)
+       - sums values into bins of bin_freq (bincount over bin offsets)
 
-    # sorting values by datetime
-    df.sort_values(by=["CREATED_AT"], inplace=True, ignore_index=True)
-    df.reset_index(drop=True, inplace=True)
+    Args:
+        created_at (pd.Series): parsed UTC datetimes of the rows
+        columns_df (pd.DataFrame): the other (non null) columns of the rows, with a VALUE column
+        drop_duplicates (bool, optional): drop duplicate rows. Defaults to True.
+        drop_constant_columns (bool, optional): drop columns that hold a single value. Defaults to True.
+        bin_freq (str, optional): frequency of the time series. Defaults to "5min".
+
+    Returns:
+        pd.DataFrame: time series indexed by CREATED_AT, same as `_resample_rows` after `_drop_invalid_rows`
+    """
+    timestamps = pd.DatetimeIndex(created_at)
+    valid = (columns_df["VALUE"] >= 0).to_numpy()
+    if not valid.all():
+        timestamps, columns_df = timestamps[valid], columns_df[valid]
+    timestamps_ns = timestamps.asi8
+
+    # factorizing once per column gives the number of unique values & the row codes
+    ts_codes, ts_uniques = pd.factorize(timestamps_ns, sort=False)
+    column_codes = {}
+    for col in columns_df.columns:
+        codes, uniques = pd.factorize(columns_df[col].to_numpy(), sort=False)
+        if drop_constant_columns and len(uniques) == 1:
+            continue
+        column_codes[col] = (codes, len(uniques))
+
+    keep = slice(None)
+    if drop_duplicates and len(timestamps_ns):
+        # equal rows get equal codes, numbered in order of first appearance
+        row_codes = ts_codes
+        for codes, n_uniques in column_codes.values():
+            # combined codes stay below n_rows**2, re-factorizing brings them back below n_rows
+            row_codes, _ = pd.factorize(row_codes * n_uniques + codes, sort=False)
+        # first appearance of a code is where it exceeds every code before it
+        seen_max = np.maximum.accumulate(row_codes)
+        keep = np.empty(len(row_codes), dtype=bool)
+        keep[0] = True
+        keep[1:] = row_codes[1:] > seen_max[:-1]
+
+    value_columns = [
+        col
+        for col in column_codes
+        if pd.api.types.is_numeric_dtype(columns_df[col].dtype)
+    ]
 
-    # remove date time duplicates by mean imputation
-    df = df.groupby("CREATED_AT").mean(numeric_only=True)
+    bin_ns = pd.Timedelta(bin_freq).value
+    if len(ts_uniques):
+        first_ns = int(ts_uniques.min())
+        first_bin_ns = first_ns - first_ns % bin_ns
+        bin_codes = (ts_uniques - first_bin_ns) // bin_ns
+        n_bins = int(bin_codes.max()) + 1
+    else:
+        first_bin_ns, bin_codes, n_bins = 0, ts_uniques, 0
+
+    kept_ts_codes = ts_codes[keep]
+    counts = np.bincount(kept_ts_codes, minlength=len(ts_uniques))
+    binned = {}
+    for col in value_columns:
+        values = columns_df[col].to_numpy(dtype=np.float64)[keep]
+        # mean of the rows of every timestamp, then the sum of the timestamps of every bin
+        means = np.bincount(kept_ts_codes, weights=values, minlength=len(ts_uniques))
+        means /= counts
+        binned[col] = np.bincount(bin_codes, weights=means, minlength=n_bins)
+
+    index = pd.date_range(
+        start=pd.Timestamp(first_bin_ns, tz=timestamps.tz),
+        periods=n_bins,
+        freq=bin_freq,
+        name="CREATED_AT",
+    )
+    return pd.DataFrame(binned, index=index, columns=value_columns)
 
-    # time series resampling to 5min frequency by summing values in bins
-    df = df.resample("5min").sum()
 
-    return df
+def _resample_rows(rows_df: pd.DataFrame) -> pd.DataFrame:
+    """Turn valid rows into a 5min time series
+       - removes date time duplicates by mean imputation
+       - time series resampling to 5min frequency by summing values in bins
 
+    Args:
+        rows_df (pd.DataFrame): valid rows with a CREATED_AT datetime column
+
+    Returns:
+        pd.DataFrame: 5min time series indexed by CREATED_AT
+    """
+    return _bin_rows(
+        rows_df["CREATED_AT"],
+        rows_df.drop(columns="CREATED_AT"),
+        drop_duplicates=False,
+        drop_constant_columns=False,
+    )
+
+
+@profiling.profiled(rows=profiling.count_input_rows)
+def clean_df(
+    raw_dataframe: pd.DataFrame,
+    datatime_str_fmts: List[str],
+) -> pd.DataFrame:
+    """Clean raw dataframe
+       - drops rows with null values
+       - converts date column to datetime
+       - drops duplicate rows
+       - drops rows with negative power consumption values
+       - drops columns that hold a single value
+       - removes date time duplicates by mean imputation
+       - time series resampling to 5min frequency by summing values in bins
+
+    everything after datetime parsing is a single fused pass, see `_bin_rows`
+
+    Args:
+        raw_dataframe (pd.DataFrame): raw dataframe
+        datatime_str_fmts (List[str], optional): list of strptime formats to try.
+
+    Returns:
+        pd.DataFrame: cleaned dataframe
+    """
+
+    df = raw_dataframe.dropna(how="any")
+    created_at = utils._str_series_to_datetime(df["CREATED_AT"], datatime_str_fmts)
 
-def preprocess_df(cleaned_df: pd.DataFrame) -> pd.DataFrame:
+    return _bin_rows(created_at, df.drop(columns="CREATED_AT"))
+
+
+@profiling.profiled()
+def preprocess_df(cleaned_df: pd.DataFrame, low_memory: bool = False) -> pd.DataFrame:
     """Preprocess data
         - modelling time as hourly, daily cyclical variables in the form of sin & cos
-
+          (float32, computed by the registered features of `features.FeaturePipeline`)
 
     Args:
         df (pd.DataFrame): dataframe
+        low_memory (bool, optional): build the preprocessed data as a single float32 block,
+                                    column by column without intermediate copies. Defaults to False.
 
     Returns:
         pd.DataFrame: preprocessed dataframe
     """
 
-    df = cleaned_df.copy(deep=True)
-
     # modelling time as hourly, daily, monthly cyclical variables in the form of sin & cos
-    ts = df.index.astype(np.int64) // 10**9
-    df["day_sin"] = np.sin(ts * (2 * np.pi / 86400))
-    df["day_cos"] = np.cos(ts * (2 * np.pi / 86400))
-    df["hour_sin"] = np.sin(ts * (2 * np.pi / 3600))
-    df["hour_cos"] = np.cos(ts * (2 * np.pi / 3600))
-    df["month_sin"] = np.sin(ts * (2 * np.pi / 2.628e6))
-    df["month_cos"] = np.cos(ts * (2 * np.pi / 2.628e6))
+    pipeline = features.DEFAULT_PIPELINE
+    if low_memory:
+        value_columns = cleaned_df.columns.drop(pipeline.columns, errors="ignore")
+        block = np.empty(
+            (len(cleaned_df), len(value_columns) + len(pipeline.columns)),
+            dtype=np.float32,
+        )
+        for position, col in enumerate(value_columns):
+            block[:, position] = cleaned_df[col].to_numpy()
+        time_features = block[:, len(value_columns) :]  # noqa: E203
+        pipeline.transform(cleaned_df.index, out=time_features)
+        df = pd.DataFrame(
+            block,
+            index=cleaned_df.index,
+            columns=[*value_columns, *pipeline.columns],
+            copy=False,
+        )
+    else:
+        df = pipeline.transform_df(cleaned_df)
 
     # NOTE moving averages might not be available during prediction time, so ommitting them as a cautionary measure
     # calculating rolling averages of power consumption
@@ -123,9 +328,14 @@ def preprocess_df(cleaned_df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+@profiling.profiled()
 def generate_dataset(
     cleaned_df: pd.DataFrame,
     train_min_max_scaler_path: PosixPath,
+    train_size: float = 0.7,
+    val_size: float = 0.2,
+    test_size: float = 0.1,
+    low_memory: bool = False,
 ) -> Dict[str, pd.DataFrame]:
     """Generate dataset
         - splits data into train, val & test sets
@@ -135,15 +345,35 @@ def generate_dataset(
         cleaned_df (pd.DataFrame): preprocessed dataframe
         train_min_max_scaler_path (PosixPath): path to load from or save train min max scaler
                                     will check if the path exists then loads it otherwise creates one and saves it
+        train_size (float, optional): train dataset size. Defaults to 0.7.
+        val_size (float, optional): validation dataset size. Defaults to 0.2.
+        test_size (float, optional): test dataset size. Defaults to 0.1.
+        low_memory (bool, optional): copy the data once into a float32 block that is scaled in place,
+                                    the sets are views of it. Defaults to False.
 
     Returns:
         Dict[str, pd.DataFrame]: dictionary of train, val & test sets
     """
 
-    df = cleaned_df.copy(deep=True)
+    if low_memory:
+        # the only copy of the data, cleaned_df stays as it is
+        block = np.empty(cleaned_df.shape, dtype=np.float32)
+        for position, col in enumerate(cleaned_df.columns):
+            block[:, position] = cleaned_df[col].to_numpy()
+        df = pd.DataFrame(
+            block, index=cleaned_df.index, columns=cleaned_df.columns, copy=False
+        )
+    else:
+        df = cleaned_df.copy(deep=True)
 
     # split data into train, val & test sets
-    ds = utils.split_dataset_df(df)
+    ds = utils.split_dataset_df(
+        df,
+        train_size=train_size,
+        test_size=test_size,
+        val_size=val_size,
+        copy=not low_memory,
+    )
 
     # Load or create a scaler
     if train_min_max_scaler_path.exists():
@@ -157,12 +387,107 @@ def generate_dataset(
     for ds_type in ds:
         # fits only on training data
         if ds_type == "train":
-            scaled = utils.scale_features(ds[ds_type], scaler=scaler, fit=True)
+            scaled = utils.scale_features(
+                ds[ds_type], scaler=scaler, fit=True, inplace=low_memory
+            )
         else:
-            scaled = utils.scale_features(ds[ds_type], scaler=scaler, fit=False)
+            scaled = utils.scale_features(
+                ds[ds_type], scaler=scaler, fit=False, inplace=low_memory
+            )
         scaler = scaled["scaler"]
         ds[ds_type] = scaled["df"]
 
     # saves scaler back to disk
     joblib.dump(scaler, train_min_max_scaler_path)
     return ds
+
+
+def _split_bounds(
+    n_rows: int, train_size: float, val_size: float
+) -> Dict[str, Tuple[int, int]]:
+    """Row ranges of the train, val & test sets, split as `utils.split_dataset_df` does."""
+    train_end = int(n_rows * train_size)
+    val_end = int(n_rows * (train_size + val_size))
+    return {
+        "train": (0, train_end),
+        "val": (train_end, val_end),
+        "test": (val_end, n_rows),
+    }
+
+
+@profiling.profiled()
+def generate_dataset_chunks(
+    cleaned_data_path: Path,
+    dataset_dir: Path,
+    train_min_max_scaler_path: PosixPath,
+    train_size: float = 0.7,
+    val_size: float = 0.2,
+    test_size: float = 0.1,
+    chunksize: int = 100_000,
+) -> Dict[str, List[pd.DataFrame]]:
+    """Generate dataset out of core, memory use is bounded by chunksize rather than by the size of the data
+        - streams the saved preprocessed data in chunks, twice
+        - fits the scaler on the training rows incrementally
+        - splits & normalises every chunk, saving it as float32 npy chunks of its set (see `utils.save_df_chunk`)
+
+    Args:
+        cleaned_data_path (Path): path to the saved preprocessed data, a .csv or a .npy file
+        dataset_dir (Path): directory to save the train, val & test chunks to, in a subdirectory per set
+        train_min_max_scaler_path (PosixPath): path to load from or save train min max scaler
+                                    will check if the path exists then loads it otherwise creates one and saves it
+        train_size (float, optional): train dataset size. Defaults to 0.7.
+        val_size (float, optional): validation dataset size. Defaults to 0.2.
+        test_size (float, optional): test dataset size. Defaults to 0.1.
+        chunksize (int, optional): maximum number of rows processed at once. Defaults to 100_000.
+
+    Returns:
+        Dict[str, List[pd.DataFrame]]: dictionary of train, val & test sets as lists of memory mapped chunks
+    """
+    bounds = _split_bounds(
+        utils.count_df_rows(cleaned_data_path), train_size=train_size, val_size=val_size
+    )
+
+    # Load or create a scaler, refit from scratch as `generate_dataset` does
+    if train_min_max_scaler_path.exists():
+        scaler = sklearn.base.clone(joblib.load(train_min_max_scaler_path))
+    else:
+        scaler = MinMaxScaler(feature_range=(-1, 1))
+
+    # fits only on training data, a chunk at a time
+    train_end = bounds["train"][1]
+    start = 0
+    for chunk in utils.iter_df_chunks(cleaned_data_path, chunksize):
+        if start >= train_end:
+            break
+        scaler.partial_fit(chunk[: train_end - start])
+        start += len(chunk)
+
+    # normalise data, every chunk is split between the sets it overlaps
+    for ds_type in bounds:
+        utils.clear_df_chunks(Path(dataset_dir, ds_type))
+    chunk_indices = dict.fromkeys(bounds, 0)
+    start = 0
+    for chunk in utils.iter_df_chunks(cleaned_data_path, chunksize):
+        stop = start + len(chunk)
+        for ds_type, (ds_start, ds_stop) in bounds.items():
+            part_start, part_stop = max(start, ds_start), min(stop, ds_stop)
+            if part_start >= part_stop:
+                continue
+            part = chunk[part_start - start : part_stop - start]  # noqa: E203
+            # a float32 copy of the part, the saved data might be memory mapped read only
+            part = pd.DataFrame(
+                np.array(part, dtype=np.float32),
+                index=part.index,
+                columns=part.columns,
+                copy=False,
+            )
+            utils.scale_features(part, scaler=scaler, fit=False, inplace=True)
+            utils.save_df_chunk(
+                part, Path(dataset_dir, ds_type), chunk_indices[ds_type]
+            )
+            chunk_indices[ds_type] += 1
+        start = stop
+
+    # saves scaler back to disk
+    joblib.dump(scaler, train_min_max_scaler_path)
+    return utils.load_dataset(dataset_dir, fmt=utils.CHUNKED_FORMAT)
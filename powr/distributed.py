@@ -0,0 +1,338 @@
+"""Data parallel training on CPU
+runs `train.train_model` / `train.refit_model` in several local worker processes under a
+MultiWorkerMirroredStrategy, every worker trains on its own shard of the windows & gradients are all reduced"""
+import json
+import math
+import multiprocessing
+import os
+import queue
+import socket
+import statistics
+import tempfile
+import time
+import traceback
+from pathlib import Path, PosixPath
+from typing import Dict, List, Tuple, Union
+
+import pandas as pd
+import tensorflow as tf
+
+from powr import train, utils, window
+
+DATA_PARALLEL_WEIGHTS_NAME = "data_parallel.weights.h5"
+
+
+def free_ports(n: int) -> List[int]:
+    """Find n free local ports for the workers of a cluster to listen on.
+
+    Args:
+        n (int): number of ports
+
+    Returns:
+        List[int]: free ports
+    """
+    sockets = []
+    for _ in range(n):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("localhost", 0))
+        sockets.append(sock)
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+def tf_config(ports: List[int], index: int) -> Dict:
+    """TF_CONFIG of a worker of a localhost cluster, worker 0 is the chief.
+
+    Args:
+        ports (List[int]): port of every worker
+        index (int): index of the worker
+
+    Returns:
+        Dict: TF_CONFIG
+    """
+    return {
+        "cluster": {"worker": [f"localhost:{port}" for port in ports]},
+        "task": {"type": "worker", "index": index},
+    }
+
+
+def epoch_windows(multi_window: window.WindowGenerator, df: pd.DataFrame) -> int:
+    """Number of windows all the shards of a window generator train on in an epoch over df.
+
+    Args:
+        multi_window (window.WindowGenerator): (sharded) window generator
+        df (pd.DataFrame): data the windows are made from
+
+    Returns:
+        int: number of windows
+    """
+    num_shards = multi_window.num_shards
+    num_windows = (
+        len(df) - multi_window.total_window_size
+    ) // multi_window.sequence_stride + 1
+    if multi_window.backend == "numpy":
+        if multi_window.windows_per_epoch is not None:
+            num_windows = min(num_windows, multi_window.windows_per_epoch)
+        return num_windows // num_shards * num_shards
+    num_batches = math.ceil(num_windows / multi_window.batch_size)
+    num_batches = num_batches // num_shards * num_shards
+    return min(num_batches * multi_window.batch_size, num_windows)
+
+
+class EpochTimer(tf.keras.callbacks.Callback):
+    """Record the wall time of every epoch."""
+
+    def on_train_begin(self, logs=None):
+        self.seconds: List[float] = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.seconds.append(time.perf_counter() - self._start)
+
+
+def _fit_worker(
+    index: int, ports: List[int], spec: Dict, results: multiprocessing.Queue
+) -> None:
+    """Train on one shard as a worker of a localhost MultiWorkerMirroredStrategy cluster,
+    puts `(index, report, error)` on the results queue.
+
+    Args:
+        index (int): index of the worker, 0 is the chief
+        ports (List[int]): port of every worker
+        spec (Dict): what to train, see `train_model_data_parallel`
+        results (multiprocessing.Queue): queue to report back on
+    """
+    try:
+        os.environ["TF_CONFIG"] = json.dumps(tf_config(ports, index))
+        train.configure_threads(spec["intra_op_threads"], spec["inter_op_threads"])
+        strategy = tf.distribute.MultiWorkerMirroredStrategy()
+
+        ds = utils.load_dataset(spec["dataset_dir"], fmt=spec["fmt"])
+        num_features = ds["train"].shape[1]
+        multi_window = window.WindowGenerator(
+            dataset_dict=ds,
+            num_shards=len(ports),
+            shard_index=index,
+            **spec["window_kwargs"],
+        )
+
+        timer = EpochTimer()
+        with strategy.scope():
+            model = train.build_model(multi_window.label_width, num_features)
+            if spec["refit"]:
+                model.build((None, multi_window.input_width, num_features))
+                train.compile_model(model)
+                model, history = train.refit_model(
+                    model,
+                    multi_window,
+                    spec["checkpoint_dir"],
+                    epochs=spec["epochs"],
+                    callbacks=[timer],
+                )
+            else:
+                model, history = train.train_model(
+                    model,
+                    multi_window,
+                    spec["epochs"],
+                    spec["patience"],
+                    checkpoint_dir=spec["checkpoint_dir"],
+                    callbacks=[timer],
+                )
+        if spec["refit"]:
+            train.save_weights(
+                model, Path(spec["checkpoint_dir"], DATA_PARALLEL_WEIGHTS_NAME)
+            )
+
+        train_df = (
+            pd.concat(
+                [multi_window.train_df, multi_window.val_df, multi_window.test_df]
+            )
+            if spec["refit"]
+            else multi_window.train_df
+        )
+        report = {
+            "num_features": num_features,
+            "history": history.history,
+            "epoch_seconds": timer.seconds,
+            "epoch_windows": epoch_windows(multi_window, train_df),
+        }
+        results.put((index, report, None))
+    except Exception:
+        results.put((index, None, traceback.format_exc()))
+
+
+def train_model_data_parallel(
+    dataset_dir: PosixPath,
+    window_kwargs: Dict,
+    checkpoint_dir: PosixPath,
+    epochs: Union[int, None],
+    patience: int = 2,
+    n_workers: int = 2,
+    intra_op_threads: int = 0,
+    inter_op_threads: int = 0,
+    fmt: str = "csv",
+    refit: bool = False,
+) -> Tuple[tf.keras.Model, Dict]:
+    """Train a model built by `train.build_model` with `train.train_model` (or `train.refit_model`)
+    across n_workers local processes, every worker loads the dataset & trains on its own shard of the windows.
+
+    The batch size in window_kwargs is per worker, i.e. the global batch size is n_workers times as large.
+    The chief (worker 0) checkpoints to checkpoint_dir as `train.train_model` does.
+
+    Args:
+        dataset_dir (PosixPath): directory of the dataset saved by `utils.save_dataset`
+        window_kwargs (Dict): `window.WindowGenerator` arguments other than the dataset & sharding,
+                                    shuffle_seed defaults to 0, so that every worker shuffles the same way
+        checkpoint_dir (PosixPath): checkpoint directory, see `train.train_model`
+        epochs (Union[int, None]): number of epochs, the best epoch if None when refitting
+        patience (int, optional): the number of epochs to wait before early stopping. Defaults to 2.
+        n_workers (int, optional): number of worker processes. Defaults to 2.
+        intra_op_threads (int, optional): threads used within an op by every worker,
+                                    0 splits the cores between the workers. Defaults to 0.
+        inter_op_threads (int, optional): threads used to run independent ops by every worker,
+                                    0 uses as many as intra_op_threads. Defaults to 0.
+        fmt (str, optional): on disk format of the dataset. Defaults to "csv".
+        refit (bool, optional): warm start from the best checkpoint & train on all the data,
+                                    see `train.refit_model`. Defaults to False.
+
+    Raises:
+        RuntimeError: if a worker fails, the other workers are terminated
+
+    Returns:
+        Tuple[tf.keras.Model, Dict]: the (compiled) trained model & a report of the chief's training history,
+                                    epoch times & throughput in windows per second
+    """
+    intra_op_threads = intra_op_threads or max((os.cpu_count() or 1) // n_workers, 1)
+    spec = {
+        "dataset_dir": dataset_dir,
+        "fmt": fmt,
+        "window_kwargs": {
+            **window_kwargs,
+            "shuffle_seed": window_kwargs.get("shuffle_seed") or 0,
+        },
+        "checkpoint_dir": Path(checkpoint_dir),
+        "epochs": epochs,
+        "patience": patience,
+        "refit": refit,
+        "intra_op_threads": intra_op_threads,
+        "inter_op_threads": inter_op_threads or intra_op_threads,
+    }
+    Path(checkpoint_dir).mkdir(parents=True, exist_ok=True)
+
+    ports = free_ports(n_workers)
+    # spawn rather than fork, tensorflow isn't fork safe
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=_fit_worker, args=(index, ports, spec, results), daemon=True
+        )
+        for index in range(n_workers)
+    ]
+    for process in processes:
+        process.start()
+
+    reports: Dict[int, Dict] = {}
+    try:
+        while len(reports) < n_workers:
+            try:
+                index, report, error = results.get(timeout=1)
+            except queue.Empty:
+                # a worker that died without reporting would leave the others waiting on it forever
+                dead = [process for process in processes if process.exitcode]
+                if dead:
+                    raise RuntimeError(
+                        f"Data parallel worker died with exit code {dead[0].exitcode}"
+                    )
+                continue
+            if error is not None:
+                raise RuntimeError(f"Data parallel worker {index} failed!\n{error}")
+            reports[index] = report
+    finally:
+        for process in processes:
+            if len(reports) < n_workers:
+                process.terminate()
+            process.join()
+
+    chief = reports[0]
+    model = train.build_model(window_kwargs["label_width"], chief["num_features"])
+    model.build((None, window_kwargs["input_width"], chief["num_features"]))
+    train.compile_model(model)
+    # the chief checkpoints the best weights when fitting & the last ones when refitting
+    model.load_weights(
+        Path(
+            checkpoint_dir,
+            DATA_PARALLEL_WEIGHTS_NAME if refit else train.BEST_WEIGHTS_NAME,
+        )
+    )
+
+    # the first epoch traces the model & fills the dataset caches
+    steady_seconds = chief["epoch_seconds"][1:] or chief["epoch_seconds"]
+    chief.update(
+        n_workers=n_workers,
+        intra_op_threads=spec["intra_op_threads"],
+        inter_op_threads=spec["inter_op_threads"],
+        windows_per_second=chief["epoch_windows"] / statistics.median(steady_seconds),
+    )
+    return model, chief
+
+
+def scaling_report(
+    dataset_dir: PosixPath,
+    window_kwargs: Dict,
+    worker_counts: List[int],
+    epochs: int = 3,
+    fmt: str = "csv",
+    cores: Union[int, None] = None,
+) -> pd.DataFrame:
+    """Measure training throughput versus the number of data parallel workers,
+    the cores are split evenly between the workers of every run.
+
+    Args:
+        dataset_dir (PosixPath): directory of the dataset saved by `utils.save_dataset`
+        window_kwargs (Dict): `window.WindowGenerator` arguments other than the dataset & sharding
+        worker_counts (List[int]): numbers of workers to measure
+        epochs (int, optional): epochs per run, early stopping is off. Defaults to 3.
+        fmt (str, optional): on disk format of the dataset. Defaults to "csv".
+        cores (Union[int, None], optional): cores to split between the workers, all if None. Defaults to None.
+
+    Returns:
+        pd.DataFrame: throughput (train windows per second), speedup & efficiency over the first worker count
+    """
+    cores = cores or os.cpu_count() or 1
+    rows = []
+    for n_workers in worker_counts:
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            _, report = train_model_data_parallel(
+                dataset_dir,
+                window_kwargs,
+                Path(checkpoint_dir),
+                epochs,
+                patience=epochs,
+                n_workers=n_workers,
+                intra_op_threads=max(cores // n_workers, 1),
+                fmt=fmt,
+            )
+        rows.append(
+            {
+                "n_workers": n_workers,
+                "threads_per_worker": report["intra_op_threads"],
+                "epochs": len(report["epoch_seconds"]),
+                "seconds": round(sum(report["epoch_seconds"]), 2),
+                "windows_per_second": round(report["windows_per_second"], 1),
+            }
+        )
+
+    report_df = pd.DataFrame(rows)
+    base = report_df.iloc[0]
+    report_df["speedup"] = (
+        report_df["windows_per_second"] / base["windows_per_second"]
+    ).round(2)
+    report_df["efficiency"] = (
+        report_df["speedup"] * base["n_workers"] / report_df["n_workers"]
+    ).round(2)
+    return report_df
@@ -0,0 +1,360 @@
+"""Module for incremental ELT
+keeps a manifest of processed raw data files & their row level cleaned (staged) rows,
+so that only newly arrived raw data files have to be read, parsed & resampled"""
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+import pandas as pd
+
+from powr import data, utils
+
+MANIFEST_VERSION = 1
+
+
+def _file_fingerprint(fpath: Path, previous: Union[Dict, None] = None) -> Dict:
+    """Fingerprint a file by size, mtime & sha256 of its content.
+    the content hash is reused from the previous fingerprint when size & mtime are unchanged
+
+    Args:
+        fpath (Path): path to the file
+        previous (Union[Dict, None], optional): previous fingerprint of the file. Defaults to None.
+
+    Returns:
+        Dict: fingerprint with size, mtime_ns & sha256 keys
+    """
+    stat = fpath.stat()
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if (
+        previous is not None
+        and previous["size"] == fingerprint["size"]
+        and previous["mtime_ns"] == fingerprint["mtime_ns"]
+    ):
+        fingerprint["sha256"] = previous["sha256"]
+        return fingerprint
+
+    sha256 = hashlib.sha256()
+    with open(fpath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    fingerprint["sha256"] = sha256.hexdigest()
+    return fingerprint
+
+
+def _load_manifest(manifest_path: Path) -> Union[Dict, None]:
+    """Load the ELT manifest, None if there isn't a (compatible) one.
+
+    Args:
+        manifest_path (Path): path to the manifest json
+
+    Returns:
+        Union[Dict, None]: the manifest
+    """
+    if not manifest_path.exists():
+        return None
+    manifest = json.loads(manifest_path.read_text())
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def _stage_raw_files(
+    fpaths: List[Path],
+    staging_dir: Path,
+    datatime_str_fmts: List[str],
+    fingerprints: Dict[str, Dict],
+    n_workers: int = 1,
+) -> Tuple[Dict[str, pd.DataFrame], Dict[str, str]]:
+    """Read raw data files, drop their invalid rows & save the staged rows to the staging dir.
+
+    Args:
+        fpaths (List[Path]): paths to raw data files
+        staging_dir (Path): directory to save staged rows to
+        datatime_str_fmts (List[str]): list of strptime formats to try
+        fingerprints (Dict[str, Dict]): fingerprints of the raw data files by name,
+                                    updated in place with the staged file & time range
+        n_workers (int, optional): number of files to read concurrently. Defaults to 1.
+
+    Returns:
+        Tuple[Dict[str, pd.DataFrame], Dict[str, str]]: staged rows by raw data file name & raw data dtypes
+
+    Raises:
+        TypeError: if dataframes are not equivalent
+    """
+    with ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+        df_raw_list = list(executor.map(pd.read_csv, fpaths))
+    if not utils.are_dfs_equivalent(df_raw_list):
+        raise TypeError(data.NOT_EQUIVALENT_ERROR_MSG)
+
+    staged = {}
+    for fpath, df_raw in zip(fpaths, df_raw_list):
+        rows = data._drop_invalid_rows(df_raw, datatime_str_fmts)
+        staged_path = Path(staging_dir, f"{fpath.name}.pkl")
+        rows.to_pickle(staged_path)
+        fingerprints[fpath.name].update(
+            {
+                "staged": staged_path.name,
+                "first_timestamp": int(rows["CREATED_AT"].min().value)
+                if len(rows)
+                else None,
+                "last_timestamp": int(rows["CREATED_AT"].max().value)
+                if len(rows)
+                else None,
+            }
+        )
+        staged[fpath.name] = rows
+    raw_dtypes = {col: str(dtype) for col, dtype in df_raw_list[0].dtypes.items()}
+    return staged, raw_dtypes
+
+
+def _full_rebuild(
+    fpaths: List[Path],
+    clean_data_path: Path,
+    datatime_str_fmts: List[str],
+    manifest_path: Path,
+    staging_dir: Path,
+    n_workers: int = 1,
+) -> pd.DataFrame:
+    """Rebuild the clean data store, staging & manifest from all raw data files.
+
+    Args:
+        fpaths (List[Path]): paths to all raw data files
+        clean_data_path (Path): path to save the clean (preprocessed) data to
+        datatime_str_fmts (List[str]): list of strptime formats to try
+        manifest_path (Path): path to save the manifest to
+        staging_dir (Path): directory to save staged rows to
+        n_workers (int, optional): number of files to read concurrently. Defaults to 1.
+
+    Returns:
+        pd.DataFrame: the clean (preprocessed) data
+    """
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    for staged_path in staging_dir.glob("*.pkl"):
+        staged_path.unlink()
+
+    fingerprints = {fpath.name: _file_fingerprint(fpath) for fpath in fpaths}
+    staged, raw_dtypes = _stage_raw_files(
+        fpaths, staging_dir, datatime_str_fmts, fingerprints, n_workers
+    )
+
+    # rows duplicated across files only get dropped once all files are merged
+    rows = pd.concat(staged.values(), axis=0, ignore_index=True)
+    rows.drop_duplicates(keep="first", ignore_index=True, inplace=True)
+
+    # drop columns that are not unique across rows, remembering their value
+    # so that new data that makes them unique again triggers a full rebuild
+    nunique = rows.nunique()
+    cols_to_drop = nunique[nunique == 1].index
+    constant_columns = {col: rows[col].iloc[0] for col in cols_to_drop}
+    rows.drop(cols_to_drop, axis=1, inplace=True)
+
+    df_clean = data._resample_rows(rows)
+    df_preprocessed = data.preprocess_df(df_clean)
+    utils.save_df(df_preprocessed, clean_data_path)
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "clean_data": clean_data_path.name,
+        "raw_dtypes": raw_dtypes,
+        "value_columns": df_clean.columns.to_list(),
+        "constant_columns": json.loads(json.dumps(constant_columns, default=str)),
+        "last_timestamp": df_clean.index.max().isoformat(),
+        "files": fingerprints,
+    }
+    manifest_path.write_text(json.dumps(manifest, indent=2))
+    return df_preprocessed
+
+
+def _needs_full_rebuild(
+    manifest: Union[Dict, None],
+    fingerprints: Dict[str, Dict],
+    clean_data_path: Path,
+) -> bool:
+    """Whether processed raw data files or the clean data store changed since the last run.
+
+    Args:
+        manifest (Union[Dict, None]): manifest of the last run
+        fingerprints (Dict[str, Dict]): current fingerprints of all raw data files by name
+        clean_data_path (Path): path to the clean data store
+
+    Returns:
+        bool: True if the clean data has to be rebuilt from scratch
+    """
+    if (
+        manifest is None
+        or manifest["clean_data"] != clean_data_path.name
+        or not clean_data_path.exists()
+    ):
+        return True
+    for name, processed in manifest["files"].items():
+        if (
+            name not in fingerprints
+            or fingerprints[name]["sha256"] != processed["sha256"]
+        ):
+            return True
+    return False
+
+
+def _touched_bin_rows(
+    manifest: Dict, staging_dir: Path, bins: pd.DatetimeIndex
+) -> List[pd.DataFrame]:
+    """Load staged rows of already processed files that fall into the given 5min bins.
+    only staged files whose time range overlaps the bins are read
+
+    Args:
+        manifest (Dict): manifest of the last run
+        staging_dir (Path): directory with staged rows
+        bins (pd.DatetimeIndex): start of the 5min bins
+
+    Returns:
+        List[pd.DataFrame]: staged rows in the bins, per overlapping file
+    """
+    first_bin = bins.min().value
+    end_bin = (bins.max() + pd.Timedelta("5min")).value
+    overlapping = []
+    for processed in manifest["files"].values():
+        if processed["first_timestamp"] is None:
+            continue
+        if (
+            processed["last_timestamp"] < first_bin
+            or processed["first_timestamp"] >= end_bin
+        ):
+            continue
+        rows = pd.read_pickle(Path(staging_dir, processed["staged"]))
+        overlapping.append(rows[rows["CREATED_AT"].dt.floor("5min").isin(bins)])
+    return overlapping
+
+
+def _merge_bins(df_existing: pd.DataFrame, df_bins: pd.DataFrame) -> pd.DataFrame:
+    """Merge recomputed 5min bins into the existing clean (preprocessed) data.
+    bins between the existing & new data are empty, i.e. sum to 0 like they do with resampling,
+    only recomputed & new bins get preprocessed
+
+    Args:
+        df_existing (pd.DataFrame): existing clean (preprocessed) data
+        df_bins (pd.DataFrame): recomputed bins, indexed by bin start
+
+    Returns:
+        pd.DataFrame: merged clean (preprocessed) data
+    """
+    full_index = pd.date_range(
+        min(df_existing.index.min(), df_bins.index.min()),
+        max(df_existing.index.max(), df_bins.index.max()),
+        freq="5min",
+    )
+    changed_index = full_index.difference(df_existing.index).union(df_bins.index)
+    df_changed = pd.DataFrame(0.0, index=changed_index, columns=df_bins.columns)
+    df_changed.loc[df_bins.index, df_bins.columns] = df_bins.values
+    df_changed = data.preprocess_df(df_changed)
+
+    # existing data loaded from csv is float64, keep the dtypes of freshly preprocessed data
+    df_existing = df_existing.astype(df_changed.dtypes.to_dict())
+    df_merged = pd.concat(
+        [df_existing.drop(df_bins.index, errors="ignore"), df_changed], axis=0
+    )
+    # nightly data lands after the existing data, so this is usually already sorted
+    if not df_merged.index.is_monotonic_increasing:
+        df_merged.sort_index(inplace=True)
+    df_merged.index.name = "CREATED_AT"
+    return df_merged
+
+
+def elt_incremental(
+    raw_data_dir: Path,
+    clean_data_path: Path,
+    datatime_str_fmts: List[str],
+    manifest_path: Path,
+    staging_dir: Path,
+    n_workers: int = 1,
+) -> pd.DataFrame:
+    """Extract, load & transform only the raw data files that arrived since the last run.
+       - new files are cleaned row by row & staged
+       - 5min bins touched by new rows are recomputed together with already staged rows in them
+       - new & recomputed bins are preprocessed & merged into the existing clean data store
+       - falls back to a full rebuild if there is no manifest, a processed file changed or
+         new data invalidates a dropped (single valued) column
+    the result matches a full rebuild (up to floating point summation order)
+
+    Args:
+        raw_data_dir (Path): path (abs or rel) to directory containing raw data
+        clean_data_path (Path): path to the clean (preprocessed) data store, .csv or .npy
+        datatime_str_fmts (List[str]): list of strptime formats to try
+        manifest_path (Path): path to the manifest json of processed raw data files
+        staging_dir (Path): directory to keep staged rows of processed raw data files in
+        n_workers (int, optional): number of files to read concurrently. Defaults to 1.
+
+    Returns:
+        pd.DataFrame: the updated clean (preprocessed) data
+
+    Raises:
+        TypeError: if dataframes are not equivalent
+    """
+    fpaths = data._list_raw_data_files(raw_data_dir)
+    data._validate_raw_data_schemas(fpaths, schema_sample_rows=1000)
+
+    manifest = _load_manifest(manifest_path)
+    processed_files = manifest["files"] if manifest is not None else {}
+    fingerprints = {
+        fpath.name: _file_fingerprint(fpath, processed_files.get(fpath.name))
+        for fpath in fpaths
+    }
+    if _needs_full_rebuild(manifest, fingerprints, clean_data_path):
+        return _full_rebuild(
+            fpaths,
+            clean_data_path,
+            datatime_str_fmts,
+            manifest_path,
+            staging_dir,
+            n_workers,
+        )
+
+    df_existing = utils.load_df(clean_data_path)
+    for name, processed in manifest["files"].items():
+        # keeps mtimes current so that unchanged files don't get hashed again
+        processed.update(fingerprints[name])
+
+    new_fpaths = [fpath for fpath in fpaths if fpath.name not in processed_files]
+    if not new_fpaths:
+        manifest_path.write_text(json.dumps(manifest, indent=2))
+        return df_existing
+
+    new_fingerprints = {fpath.name: fingerprints[fpath.name] for fpath in new_fpaths}
+    staged, raw_dtypes = _stage_raw_files(
+        new_fpaths, staging_dir, datatime_str_fmts, new_fingerprints, n_workers
+    )
+    if raw_dtypes != manifest["raw_dtypes"]:
+        raise TypeError(data.NOT_EQUIVALENT_ERROR_MSG)
+    new_rows = pd.concat(staged.values(), axis=0, ignore_index=True)
+    for col, value in manifest["constant_columns"].items():
+        if (new_rows[col].astype(str) != str(value)).any():
+            return _full_rebuild(
+                fpaths,
+                clean_data_path,
+                datatime_str_fmts,
+                manifest_path,
+                staging_dir,
+                n_workers,
+            )
+
+    if len(new_rows):
+        # recompute every 5min bin new rows fall in, from all rows in those bins
+        value_columns = manifest["value_columns"]
+        bins = pd.DatetimeIndex(new_rows["CREATED_AT"].dt.floor("5min").unique())
+        rows = pd.concat(
+            _touched_bin_rows(manifest, staging_dir, bins) + [new_rows],
+            axis=0,
+            ignore_index=True,
+        )
+        rows.drop_duplicates(keep="first", ignore_index=True, inplace=True)
+        rows = rows.groupby("CREATED_AT")[value_columns].mean()
+        df_bins = rows.groupby(rows.index.floor("5min")).sum()
+
+        df_existing = _merge_bins(df_existing, df_bins)
+        utils.save_df(df_existing, clean_data_path)
+        manifest["last_timestamp"] = df_existing.index.max().isoformat()
+
+    manifest["files"].update(new_fingerprints)
+    manifest_path.write_text(json.dumps(manifest, indent=2))
+    return df_existing
@@ -1,11 +1,12 @@
-from typing import Any, Tuple
+from typing import TYPE_CHECKING, Any, Tuple
 
 import tensorflow as tf
 
-from powr.window import WindowGenerator
+if TYPE_CHECKING:
+    from powr.window import WindowGenerator
 
 
-def evaluate_model(model: tf.keras.Model, window: WindowGenerator) -> Tuple[Any, Any]:
+def evaluate_model(model: tf.keras.Model, window: "WindowGenerator") -> Tuple[Any, Any]:
     """Evaluate the given model on the given window.
 
     Args:
@@ -0,0 +1,200 @@
+"""Module for time features
+features are registered declaratively & computed in one vectorised pass into a preallocated float32 block,
+the same pipeline runs over years of training data & over the single bin needed at prediction time"""
+import functools
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+# the 5min grid of the clean data
+STEP_SECONDS = 300
+
+
+@functools.lru_cache(maxsize=None)
+def cyclical_table(
+    period_seconds: int, step_seconds: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """sin & cos of every step of a period, computed once per process.
+
+    Args:
+        period_seconds (int): period of the feature
+        step_seconds (int): time between entries, has to divide the period
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: float32 sin & cos tables of period_seconds // step_seconds entries
+    """
+    phases = np.arange(0, period_seconds, step_seconds) * (2 * np.pi / period_seconds)
+    sin_table = np.sin(phases).astype(np.float32)
+    cos_table = np.cos(phases).astype(np.float32)
+    # lookups never write to the tables, make sure nothing else does either
+    sin_table.flags.writeable = cos_table.flags.writeable = False
+    return sin_table, cos_table
+
+
+def _tile_into(out: np.ndarray, pattern: np.ndarray) -> None:
+    """Fill out with pattern repeated, doubling the filled part with every copy."""
+    filled = min(len(pattern), len(out))
+    out[:filled] = pattern[:filled]
+    while filled < len(out):
+        n_copy = min(filled, len(out) - filled)
+        out[filled : filled + n_copy] = out[:n_copy]  # noqa: E203
+        filled += n_copy
+    return None
+
+
+class CyclicalFeature:
+    def __init__(self, name: str, period_seconds: int):
+        """Time of the period modelled as sin & cos, e.g. `{name}_sin` & `{name}_cos` columns.
+
+        Args:
+            name (str): prefix of the feature's columns
+            period_seconds (int): period of the feature
+        """
+        self.name = name
+        self.period_seconds = period_seconds
+
+    @property
+    def columns(self) -> List[str]:
+        return [f"{self.name}_sin", f"{self.name}_cos"]
+
+    def compute(
+        self,
+        seconds: np.ndarray,
+        steps: Union[np.ndarray, None],
+        step_seconds: int,
+        out: np.ndarray,
+        consecutive: bool = False,
+    ) -> None:
+        """Write the feature's columns into out.
+
+        Args:
+            seconds (np.ndarray): int64 seconds since epoch of every row
+            steps (Union[np.ndarray, None]): seconds // step_seconds, None if the rows aren't on the grid
+            step_seconds (int): time between steps
+            out (np.ndarray): float32 (rows, 2) block to write sin & cos to
+            consecutive (bool, optional): whether the rows are consecutive steps of the grid. Defaults to False.
+        """
+        if steps is not None and self.period_seconds % step_seconds == 0:
+            # on the grid the phase repeats every period // step rows, look it up instead of computing it
+            sin_table, cos_table = cyclical_table(self.period_seconds, step_seconds)
+            if consecutive and len(steps):
+                # the rows are the tables rotated to the first row's phase & repeated
+                first_phase = int(steps[0] % len(sin_table))
+                _tile_into(out[:, 0], np.roll(sin_table, -first_phase))
+                _tile_into(out[:, 1], np.roll(cos_table, -first_phase))
+                return None
+            phases = steps % len(sin_table)
+            out[:, 0] = sin_table[phases]
+            out[:, 1] = cos_table[phases]
+            return None
+        radians = (seconds % self.period_seconds) * (2 * np.pi / self.period_seconds)
+        out[:, 0] = np.sin(radians)
+        out[:, 1] = np.cos(radians)
+        return None
+
+
+# registered features by name, in column order
+FEATURES: Dict[str, CyclicalFeature] = {}
+
+
+def register_feature(feature: CyclicalFeature) -> CyclicalFeature:
+    """Register a feature, so that pipelines without an explicit feature list compute it."""
+    FEATURES[feature.name] = feature
+    return feature
+
+
+register_feature(CyclicalFeature("day", 86400))
+register_feature(CyclicalFeature("hour", 3600))
+register_feature(CyclicalFeature("month", 2628000))
+
+
+class FeaturePipeline:
+    def __init__(
+        self,
+        features: Union[List[CyclicalFeature], None] = None,
+        step_seconds: int = STEP_SECONDS,
+    ):
+        """Compute time features of timestamps into a single float32 block.
+
+        Args:
+            features (Union[List[CyclicalFeature], None], optional): features to compute, in column order,
+                                    all the registered features if None. Defaults to None.
+            step_seconds (int, optional): grid the lookup tables are built for, rows off the grid
+                                    are computed directly. Defaults to STEP_SECONDS.
+        """
+        self._features = features
+        self.step_seconds = step_seconds
+
+    @property
+    def features(self) -> List[CyclicalFeature]:
+        # resolved on use, so that features registered after the pipeline was made are included
+        return list(FEATURES.values()) if self._features is None else self._features
+
+    @property
+    def columns(self) -> List[str]:
+        return [column for feature in self.features for column in feature.columns]
+
+    def transform(
+        self,
+        timestamps: Union[pd.DatetimeIndex, np.ndarray],
+        out: Union[np.ndarray, None] = None,
+    ) -> np.ndarray:
+        """Features of every timestamp.
+
+        Args:
+            timestamps (Union[pd.DatetimeIndex, np.ndarray]): timestamps, or int64 ns since epoch (UTC)
+            out (Union[np.ndarray, None], optional): float32 block to write the features to,
+                                    e.g. columns of a larger block, a new one if None. Defaults to None.
+
+        Returns:
+            np.ndarray: float32 block of shape (len(timestamps), len(columns))
+        """
+        timestamps_ns = (
+            timestamps.asi8 if isinstance(timestamps, pd.DatetimeIndex) else timestamps
+        )
+        seconds = np.asarray(timestamps_ns, dtype=np.int64) // 10**9
+        steps = seconds // self.step_seconds
+        consecutive = False
+        if not np.array_equal(steps * self.step_seconds, seconds):
+            steps = None
+        elif len(steps) and steps[-1] - steps[0] == len(steps) - 1:
+            # e.g. the clean data's 5min grid
+            consecutive = bool(np.all(np.diff(steps) == 1))
+
+        features = self.features
+        # column major, every feature column is contiguous & the block becomes a dataframe without a copy
+        block = out
+        if block is None:
+            block = np.empty(
+                (len(seconds), sum(len(feature.columns) for feature in features)),
+                dtype=np.float32,
+                order="F",
+            )
+        start = 0
+        for feature in features:
+            width = len(feature.columns)
+            out = block[:, start : start + width]  # noqa: E203
+            feature.compute(seconds, steps, self.step_seconds, out, consecutive)
+            start += width
+        return block
+
+    def transform_df(self, df: pd.DataFrame) -> pd.DataFrame:
+        """df with the feature columns added, see `data.preprocess_df`.
+
+        Args:
+            df (pd.DataFrame): dataframe indexed by timestamp
+
+        Returns:
+            pd.DataFrame: a copy of df with the feature columns
+        """
+        features_df = pd.DataFrame(
+            self.transform(df.index), columns=self.columns, index=df.index
+        )
+        return pd.concat(
+            [df.drop(columns=self.columns, errors="ignore"), features_df], axis=1
+        )
+
+
+# the pipeline behind data.preprocess_df
+DEFAULT_PIPELINE = FeaturePipeline()
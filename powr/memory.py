@@ -0,0 +1,51 @@
+"""Module for memory usage
+peak resident set size (RSS) of the process, per stage where the OS allows resetting the peak"""
+import re
+import resource
+import sys
+from pathlib import Path
+
+PROC_STATUS_PATH = Path("/proc/self/status")
+PROC_CLEAR_REFS_PATH = Path("/proc/self/clear_refs")
+
+
+def _proc_status_mb(field: str) -> float:
+    """A memory field (in kB) of /proc/self/status in MB, nan if unavailable."""
+    try:
+        status = PROC_STATUS_PATH.read_text()
+    except OSError:
+        return float("nan")
+    match = re.search(rf"^{field}:\s+(\d+) kB", status, flags=re.MULTILINE)
+    return int(match.group(1)) / 1024 if match else float("nan")
+
+
+def rss_mb() -> float:
+    """Current resident set size of the process in MB, nan if unavailable."""
+    return _proc_status_mb("VmRSS")
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the process in MB, since the last `reset_peak_rss`.
+
+    Returns:
+        float: peak RSS, from /proc on linux & getrusage (peak over the process' lifetime) elsewhere
+    """
+    peak = _proc_status_mb("VmHWM")
+    if peak == peak:
+        return peak
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kB elsewhere
+    return max_rss / 1024**2 if sys.platform == "darwin" else max_rss / 1024
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak resident set size to the current one, linux only.
+
+    Returns:
+        bool: whether the peak was reset
+    """
+    try:
+        PROC_CLEAR_REFS_PATH.write_text("5")
+    except OSError:
+        return False
+    return True
@@ -1,61 +1,290 @@
-from pathlib import PosixPath
-from typing import List
+import abc
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path, PosixPath
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Tuple, Union
 
 import joblib
+import numpy as np
 import pandas as pd
-import tensorflow as tf
+from sklearn.preprocessing import MinMaxScaler
 
-from powr import utils
+from powr import memory, profiling, utils
 
+if TYPE_CHECKING:
+    import tensorflow as tf
 
-def predict_next_24(
+# written into SavedModels by keras' model.save only
+KERAS_METADATA_NAME = "keras_metadata.pb"
+
+FEATURE_COLUMNS = [
+    "forecast_value",
+    "day_sin",
+    "day_cos",
+    "hour_sin",
+    "hour_cos",
+    "month_sin",
+    "month_cos",
+]
+
+
+class _BatchedModel(abc.ABC):
+    """predict of a keras model over predict_on_batch, for the inference artifacts"""
+
+    @abc.abstractmethod
+    def predict_on_batch(self, windows: np.ndarray) -> np.ndarray:
+        """Predict one batch of windows of shape (batch, time, features)."""
+
+    def predict(
+        self, windows: np.ndarray, batch_size: Union[int, None] = None, verbose: int = 0
+    ) -> np.ndarray:
+        """Predict windows of shape (batch, time, features), in batches of batch_size."""
+        batch_size = batch_size or len(windows) or 1
+        return np.concatenate(
+            [
+                self.predict_on_batch(windows[start : start + batch_size])  # noqa: E203
+                for start in range(0, max(len(windows), 1), batch_size)
+            ]
+        )
+
+
+class NumpyLinearModel(_BatchedModel):
+    """NumPy only version of the model built by train.build_model, for inference without tensorflow.
+    takes the last time step of every window, applies the Dense kernel & bias & reshapes,
+    exposes the same predict/predict_on_batch methods as a keras model"""
+
+    def __init__(
+        self, kernel: np.ndarray, bias: np.ndarray, output_steps: int, num_features: int
+    ):
+        self.kernel = kernel.astype(np.float32)
+        self.bias = bias.astype(np.float32)
+        self.output_steps = output_steps
+        self.num_features = num_features
+
+    @classmethod
+    def load(cls, npz_path: PosixPath) -> "NumpyLinearModel":
+        """Load a model exported with train.export_numpy_model."""
+        with np.load(npz_path) as artifact:
+            return cls(
+                kernel=artifact["kernel"],
+                bias=artifact["bias"],
+                output_steps=int(artifact["output_steps"]),
+                num_features=int(artifact["num_features"]),
+            )
+
+    def predict_on_batch(self, windows: np.ndarray) -> np.ndarray:
+        """Predict windows of shape (batch, time, features)."""
+        last_step = np.asarray(windows, dtype=np.float32)[:, -1, :]
+        outputs = last_step @ self.kernel + self.bias
+        return outputs.reshape(-1, self.output_steps, self.num_features)
+
+
+class TFLiteModel(_BatchedModel):
+    """TFLite model exported with train.export_tflite_model, run by the TFLite interpreter
+    (from the optional tflite_runtime package if installed, tensorflow otherwise),
+    exposes the same predict/predict_on_batch methods as a keras model"""
+
+    def __init__(self, interpreter: Any):
+        self.interpreter = interpreter
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        # the interpreter holds the tensors of the last call, calls can't overlap
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, tflite_path: PosixPath) -> "TFLiteModel":
+        """Load a model exported with train.export_tflite_model."""
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+
+            Interpreter = tf.lite.Interpreter
+        return cls(Interpreter(model_path=str(tflite_path)))
+
+    def predict_on_batch(self, windows: np.ndarray) -> np.ndarray:
+        """Predict windows of shape (batch, time, features)."""
+        windows = np.ascontiguousarray(windows, dtype=np.float32)
+        with self._lock:
+            if tuple(self._input["shape"]) != windows.shape:
+                # the batch dimension is dynamic, resizing only reallocates the tensors
+                self.interpreter.resize_tensor_input(
+                    self._input["index"], windows.shape
+                )
+                self.interpreter.allocate_tensors()
+                self._input = self.interpreter.get_input_details()[0]
+            self.interpreter.set_tensor(self._input["index"], windows)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output["index"])
+
+
+class SignatureModel(_BatchedModel):
+    """SavedModel exported with train.export_serving_model, runs its `serving_default` concrete function
+    without deserialising keras, exposes the same predict/predict_on_batch methods as a keras model"""
+
+    def __init__(self, saved_model: Any):
+        # the loaded object owns the variables the signature reads, keep it alive
+        self.saved_model = saved_model
+        self.signature = saved_model.signatures["serving_default"]
+
+    @classmethod
+    def load(cls, saved_model_path: PosixPath) -> "SignatureModel":
+        """Load a model exported with train.export_serving_model."""
+        import tensorflow as tf
+
+        return cls(tf.saved_model.load(str(saved_model_path)))
+
+    def predict_on_batch(self, windows: np.ndarray) -> np.ndarray:
+        """Predict windows of shape (batch, time, features)."""
+        outputs = self.signature(windows=np.asarray(windows, dtype=np.float32))
+        return next(iter(outputs.values())).numpy()
+
+
+def load_model(
     model_path: PosixPath,
-    scaler_path: PosixPath,
-    last_24_data_path: PosixPath,
-    feature_columns: List[str] = [
-        "forecast_value",
-        "day_sin",
-        "day_cos",
-        "hour_sin",
-        "hour_cos",
-        "month_sin",
-        "month_cos",
-    ],
-) -> pd.DataFrame:
-    """Predict the next 24 hours of power consumption.
+) -> Union["tf.keras.Model", NumpyLinearModel, TFLiteModel, SignatureModel]:
+    """Load a saved model, by its kind
+        - .npz files exported with train.export_numpy_model as a NumpyLinearModel, without importing tensorflow
+        - .tflite files exported with train.export_tflite_model as a TFLiteModel
+        - SavedModels exported with train.export_serving_model (without keras metadata) as a SignatureModel
+        - keras SavedModels as a keras model
 
     Args:
-        last_24_data_path (Dict[str, pd.DataFrame]): path to dataset with the last 24 hours of power consumption
-        model (tf.keras.Model): the model to predict with
-        scaler (MinMaxScaler): the scaler to use to denormalise the data
-        feature_columns (List[str], optional): list of feature columns to use.
-                        Defaults to
-                            ["forecast_value", "day_sin", "day_cos", "hour_sin", "hour_cos", "month_sin", "month_cos"].
+        model_path (PosixPath): path to the saved model
+
     Returns:
-        pd.DataFrame: the predicted values
+        Union[tf.keras.Model, NumpyLinearModel, TFLiteModel, SignatureModel]: the model
     """
-    test_df = utils._load_df_head_parse_datetime(
-        last_24_data_path, header_row=0, date_col="CREATED_AT", index_col="CREATED_AT"
-    )
-    # last window
-    last_24_data = test_df[-288:].to_numpy()
-    last_window = last_24_data.reshape(1, 288, last_24_data.shape[1])
+    model_path = Path(model_path)
+    if model_path.suffix == ".npz":
+        return NumpyLinearModel.load(model_path)
+    if model_path.suffix == ".tflite":
+        return TFLiteModel.load(model_path)
+    if model_path.is_dir() and not Path(model_path, KERAS_METADATA_NAME).exists():
+        return SignatureModel.load(model_path)
 
-    # Predict the next 24 hours
-    model = tf.keras.models.load_model(model_path)
-    next_24 = model.predict(last_window)
-    next_24 = next_24.reshape(288, last_24_data.shape[1])
+    import tensorflow as tf
 
-    # Inverse transform the predicted values
-    scaler = joblib.load(scaler_path)
-    next_24_scaled = scaler.inverse_transform(next_24)
+    return tf.keras.models.load_model(model_path)
+
+
+def load_scaler(scaler_path: PosixPath) -> MinMaxScaler:
+    """Load a saved (fitted) scaler.
+
+    Args:
+        scaler_path (PosixPath): path to the pickled scaler
+
+    Returns:
+        MinMaxScaler: the scaler
+    """
+    return joblib.load(scaler_path)
+
+
+def _artifact_fingerprint(path: Path) -> Tuple[int, int]:
+    """Fingerprint a file or directory (e.g. a SavedModel) by its newest mtime & total size.
+
+    Args:
+        path (Path): path to the artifact
+
+    Returns:
+        Tuple[int, int]: newest modification time in ns & total size in bytes
+    """
+    stats = [path.stat()]
+    if path.is_dir():
+        stats += [fpath.stat() for fpath in path.rglob("*") if fpath.is_file()]
+    return max(stat.st_mtime_ns for stat in stats), sum(stat.st_size for stat in stats)
+
+
+class ArtifactCache:
+    """Thread safe LRU cache of loaded artifacts, keyed on path.
+    an artifact is reloaded when its modification time or size changed since it was loaded"""
+
+    def __init__(self, loader: Callable[[Path], Any], max_size: int = 8):
+        self.loader = loader
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._artifacts: OrderedDict = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, path: PosixPath) -> Any:
+        """Get the loaded artifact at path, loading it on a miss or if it changed on disk."""
+        path = Path(path).absolute()
+        fingerprint = _artifact_fingerprint(path)
+        with self._lock:
+            cached = self._artifacts.get(path)
+            if cached is not None and cached[0] == fingerprint:
+                self.hits += 1
+                self._artifacts.move_to_end(path)
+                return cached[1]
+
+            self.misses += 1
+            artifact = self.loader(path)
+            self._artifacts[path] = (fingerprint, artifact)
+            self._artifacts.move_to_end(path)
+            self._evict()
+            return artifact
+
+    def resize(self, max_size: int) -> None:
+        """Change the maximum number of cached artifacts, evicting the least recently used ones."""
+        with self._lock:
+            self.max_size = max_size
+            self._evict()
+
+    def clear(self) -> None:
+        """Drop all cached artifacts & reset the stats."""
+        with self._lock:
+            self._artifacts.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._artifacts),
+            "max_size": self.max_size,
+        }
+
+    def _evict(self) -> None:
+        while len(self._artifacts) > self.max_size:
+            self._artifacts.popitem(last=False)
+            self.evictions += 1
+
+
+# process wide caches, predict_next_24 & batch callers should load through these
+MODEL_CACHE = ArtifactCache(load_model, max_size=8)
+SCALER_CACHE = ArtifactCache(load_scaler, max_size=64)
+
+
+def format_forecast(
+    next_24_scaled: np.ndarray,
+    last_timestamp: pd.Timestamp,
+    feature_columns: List[str] = FEATURE_COLUMNS,
+) -> pd.DataFrame:
+    """Format denormalised model output as a forecast for the 24 hours after last_timestamp.
 
-    # Create a dataframe with the predicted values
+    Args:
+        next_24_scaled (np.ndarray): denormalised model output of shape (288, n_features)
+        last_timestamp (pd.Timestamp): timestamp of the last 5min interval the forecast is based on
+        feature_columns (List[str], optional): list of feature columns of the model output.
+                        Defaults to FEATURE_COLUMNS.
+
+    Returns:
+        pd.DataFrame: the forecast with forecast_at, forecast_interval_start, forecast_interval_end
+                        & forecast_value columns
+    """
     next_24_df = pd.DataFrame(
         next_24_scaled,
         columns=feature_columns,
         index=pd.date_range(
-            start=test_df.index.max() + pd.Timedelta("5min"),
+            start=last_timestamp + pd.Timedelta("5min"),
             periods=288,
             freq="5min",
             tz="UTC",
@@ -77,3 +306,203 @@ def predict_next_24(
             "forecast_value",
         ]
     ]
+
+
+@profiling.profiled()
+def predict_next_24(
+    model_path: PosixPath,
+    scaler_path: PosixPath,
+    last_24_data_path: PosixPath,
+    feature_columns: List[str] = FEATURE_COLUMNS,
+) -> pd.DataFrame:
+    """Predict the next 24 hours of power consumption.
+
+    Args:
+        model_path (PosixPath): path to the saved model, a .npz exported model predicts without tensorflow
+        scaler_path (PosixPath): path to the scaler to use to denormalise the data
+        last_24_data_path (PosixPath): path to dataset (.csv or .npy) with the last 24 hours of power consumption
+        feature_columns (List[str], optional): list of feature columns to use.
+                        Defaults to
+                            ["forecast_value", "day_sin", "day_cos", "hour_sin", "hour_cos", "month_sin", "month_cos"].
+    Returns:
+        pd.DataFrame: the predicted values
+    """
+    test_df = utils.load_df(last_24_data_path)
+    # last window
+    last_24_data = test_df[-288:].to_numpy()
+    last_window = last_24_data.reshape(1, 288, last_24_data.shape[1])
+
+    # Predict the next 24 hours
+    model = MODEL_CACHE.get(model_path)
+    next_24 = model.predict(last_window)
+    next_24 = next_24.reshape(288, last_24_data.shape[1])
+
+    # Inverse transform the predicted values
+    scaler = SCALER_CACHE.get(scaler_path)
+    next_24_scaled = scaler.inverse_transform(next_24)
+
+    return format_forecast(next_24_scaled, test_df.index.max(), feature_columns)
+
+
+def _format_utc_timestamps(timestamps_ns: np.ndarray) -> np.ndarray:
+    """Format int64 nanosecond UTC timestamps as "%Y-%m-%dT%H:%M:%SZ" strings, vectorised.
+
+    Args:
+        timestamps_ns (np.ndarray): int64 nanoseconds since epoch
+
+    Returns:
+        np.ndarray: formatted timestamps
+    """
+    seconds = timestamps_ns.astype("datetime64[ns]").astype("datetime64[s]")
+    return np.char.add(np.datetime_as_string(seconds, unit="s"), "Z").astype(object)
+
+
+def predict_many(
+    model: Union["tf.keras.Model", NumpyLinearModel],
+    scaler: MinMaxScaler,
+    windows: np.ndarray,
+    last_timestamps: pd.DatetimeIndex,
+    window_ids: Union[List, None] = None,
+    target_column_index: int = 0,
+    batch_size: int = 1024,
+) -> pd.DataFrame:
+    """Predict the next 24 hours for many windows at once (e.g. many customers or forecast origins)
+        - all windows go through the model in batches of batch_size
+        - only the target column is denormalised
+        - timestamp columns are built without per row string formatting
+
+    Args:
+        model (Union[tf.keras.Model, NumpyLinearModel]): the model to predict with
+        scaler (MinMaxScaler): the scaler the windows were normalised with
+        windows (np.ndarray): normalised windows of shape (n_windows, 288, n_features)
+        last_timestamps (pd.DatetimeIndex): timestamp of the last row of every window
+        window_ids (Union[List, None], optional): id of every window, defaults to 0..n_windows-1.
+        target_column_index (int, optional): index of the forecasted column in the features. Defaults to 0.
+        batch_size (int, optional): number of windows per model call. Defaults to 1024.
+
+    Returns:
+        pd.DataFrame: forecasts of all windows with window_id, forecast_at, forecast_interval_start,
+                        forecast_interval_end & forecast_value columns, 288 rows per window
+    """
+    n_windows, _, n_features = windows.shape
+    if len(last_timestamps) != n_windows:
+        raise ValueError(
+            f"Expected {n_windows} last timestamps, got {len(last_timestamps)}"
+        )
+    if window_ids is None:
+        window_ids = list(range(n_windows))
+
+    predictions = model.predict(
+        windows.astype(np.float32, copy=False), batch_size=batch_size, verbose=0
+    )
+    predictions = predictions.reshape(n_windows, -1, n_features)
+    horizon = predictions.shape[1]
+
+    # MinMaxScaler.inverse_transform, for the target column only
+    forecast_values = (
+        predictions[:, :, target_column_index] - scaler.min_[target_column_index]
+    ) / scaler.scale_[target_column_index]
+
+    step_ns = pd.Timedelta("5min").value
+    last_ns = pd.DatetimeIndex(last_timestamps).asi8
+    starts_ns = last_ns[:, None] + step_ns * np.arange(1, horizon + 1)[None, :]
+
+    return pd.DataFrame(
+        {
+            "window_id": np.repeat(np.asarray(window_ids, dtype=object), horizon),
+            "forecast_at": np.repeat(_format_utc_timestamps(starts_ns[:, 0]), horizon),
+            "forecast_interval_start": _format_utc_timestamps(starts_ns.ravel()),
+            "forecast_interval_end": _format_utc_timestamps(
+                starts_ns.ravel() + step_ns
+            ),
+            "forecast_value": forecast_values.ravel(),
+        }
+    )
+
+
+def _profile_model(
+    model_path: PosixPath, windows: np.ndarray, n_forecasts: int
+) -> Dict:
+    """Load a model & forecast windows with it, timed, in the (fresh) process `compare_models` spawns."""
+    start = time.perf_counter()
+    model = load_model(model_path)
+    load_seconds = time.perf_counter() - start
+    # the process after loading, imports included
+    rss_mb = memory.rss_mb()
+
+    predictions = model.predict(windows, verbose=0)
+    forecast_seconds = []
+    for index in range(n_forecasts):
+        window = windows[index % len(windows)][np.newaxis]
+        start = time.perf_counter()
+        model.predict(window, verbose=0)
+        forecast_seconds.append(time.perf_counter() - start)
+    return {
+        "load_seconds": load_seconds,
+        "rss_mb": rss_mb,
+        "forecast_ms": float(np.median(forecast_seconds)) * 1000,
+        "predictions": np.asarray(predictions),
+    }
+
+
+def compare_models(
+    model_paths: Dict[str, PosixPath],
+    windows: np.ndarray,
+    reference: str,
+    n_forecasts: int = 50,
+) -> pd.DataFrame:
+    """Compare the accuracy, load time, memory & per forecast latency of saved models (e.g. exported artifacts)
+    against a reference model, every model is loaded in a fresh process so that import & load costs are counted.
+
+    Args:
+        model_paths (Dict[str, PosixPath]): paths of the saved models by name, see `load_model`
+        windows (np.ndarray): normalised windows of shape (n_windows, 288, n_features) to forecast
+        reference (str): name of the model the forecasts are compared against
+        n_forecasts (int, optional): number of single window forecasts to time. Defaults to 50.
+
+    Returns:
+        pd.DataFrame: model, size_mb, load_seconds, rss_mb, forecast_ms (median), mean_abs_error
+                        & max_abs_error (normalised) columns, a row per model
+    """
+    windows = np.asarray(windows, dtype=np.float32)
+    profiles = {}
+    for name, model_path in model_paths.items():
+        # spawn rather than fork, tensorflow isn't fork safe
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            profiles[name] = executor.submit(
+                _profile_model, model_path, windows, n_forecasts
+            ).result()
+
+    expected = profiles[reference]["predictions"]
+    rows = []
+    for name, profile in profiles.items():
+        errors = np.abs(profile.pop("predictions").reshape(expected.shape) - expected)
+        rows.append(
+            {
+                "model": name,
+                "size_mb": _artifact_fingerprint(Path(model_paths[name]))[1]
+                / 1024**2,
+                **profile,
+                "mean_abs_error": float(errors.mean()),
+                "max_abs_error": float(errors.max()),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def sample_windows(df: pd.DataFrame, window_size: int, stride: int) -> np.ndarray:
+    """Windows of df every stride time steps, e.g. a window per day to compare or calibrate models on.
+
+    Args:
+        df (pd.DataFrame): normalised data
+        window_size (int): number of time steps in a window
+        stride (int): time steps between the starts of consecutive windows
+
+    Returns:
+        np.ndarray: float32 windows of shape (n_windows, window_size, n_features)
+    """
+    return np.lib.stride_tricks.sliding_window_view(
+        df.to_numpy(dtype=np.float32), window_size, axis=0
+    )[::stride].transpose(0, 2, 1)
@@ -0,0 +1,192 @@
+"""Module for profiling pipeline stages
+records wall time, cpu time, rows processed, rows per second & peak memory of (nested) stages,
+to the logger & a json metrics file, collection is off unless enabled (e.g. by the CLI)"""
+import contextlib
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path, PosixPath
+from typing import Any, Callable, Dict, Iterator, List, Union
+
+from powr import memory
+
+logger = logging.getLogger("powr")
+
+
+def count_rows(result: Any, *args, **kwargs) -> Union[int, None]:
+    """Rows in a stage's result, a dataframe (or array) or a dict or list of them, None if it has no rows."""
+    if isinstance(result, (dict, list)):
+        values = result.values() if isinstance(result, dict) else result
+        counts = [count_rows(value) for value in values]
+        counts = [count for count in counts if count is not None]
+        return sum(counts) if counts else None
+    if hasattr(result, "shape") and len(getattr(result, "shape", ())) > 0:
+        return int(result.shape[0])
+    return None
+
+
+def count_input_rows(result: Any, data: Any, *args, **kwargs) -> Union[int, None]:
+    """Rows in a stage's first argument, for stages that don't return (all) the rows they process."""
+    return count_rows(data)
+
+
+class Profiler:
+    def __init__(self, enabled: bool = False):
+        """Collect metrics of the stages run while enabled.
+
+        Stages nest, e.g. `elt_data/data.clean_df`, the peak memory of a stage includes its inner stages.
+
+        Args:
+            enabled (bool, optional): whether to collect metrics. Defaults to False.
+        """
+        self.enabled = enabled
+        self.records: List[Dict] = []
+        self._open: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        """Drop the collected metrics."""
+        with self._lock:
+            self.records = []
+        return None
+
+    def _propagate_peak(self, peak_rss_mb: float) -> None:
+        """Raise the peak memory of the open stages, before the peak gets reset by an inner stage."""
+        for record in self._open:
+            record["peak_rss_mb"] = max(record["peak_rss_mb"], peak_rss_mb)
+        return None
+
+    @contextlib.contextmanager
+    def stage(self, name: str, rows: Union[int, None] = None) -> Iterator[Dict]:
+        """Profile a stage, the yielded record's rows can be set within it.
+
+        Args:
+            name (str): name of the stage
+            rows (Union[int, None], optional): rows the stage processes, if known upfront. Defaults to None.
+
+        Yields:
+            Iterator[Dict]: the stage's record
+        """
+        if not self.enabled:
+            yield {"rows": rows}
+            return
+
+        with self._lock:
+            self._propagate_peak(memory.peak_rss_mb())
+            memory.reset_peak_rss()
+            path = f"{self._open[-1]['stage']}/{name}" if self._open else name
+            record = {"stage": path, "rows": rows, "peak_rss_mb": 0.0}
+            self._open.append(record)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            wall_seconds = time.perf_counter() - wall_start
+            cpu_seconds = time.process_time() - cpu_start
+            with self._lock:
+                self._open.remove(record)
+                record["peak_rss_mb"] = max(record["peak_rss_mb"], memory.peak_rss_mb())
+                self._propagate_peak(record["peak_rss_mb"])
+                record.update(
+                    wall_seconds=round(wall_seconds, 4),
+                    cpu_seconds=round(cpu_seconds, 4),
+                    rows_per_second=round(record["rows"] / wall_seconds, 1)
+                    if record["rows"] and wall_seconds > 0
+                    else None,
+                    peak_rss_mb=round(record["peak_rss_mb"], 1),
+                )
+                self.records.append(record)
+            logger.info(format_record(record))
+
+    def profiled(
+        self,
+        name: Union[str, None] = None,
+        rows: Callable[..., Union[int, None]] = count_rows,
+    ) -> Callable:
+        """Decorator that profiles every call of a function as a stage.
+
+        Args:
+            name (Union[str, None], optional): name of the stage, `<module>.<function>` if None. Defaults to None.
+            rows (Callable[..., Union[int, None]], optional): rows processed, called with the result & the call's
+                                    arguments, bound positionally as far as they can be, so that it gets
+                                    them the same way whether they were passed by position or keyword.
+                                    Defaults to count_rows.
+        """
+
+        def decorator(func: Callable) -> Callable:
+            stage_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+            signature = inspect.signature(func)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self.stage(stage_name) as record:
+                    result = func(*args, **kwargs)
+                    record["rows"] = _count_call_rows(
+                        rows, signature, result, args, kwargs
+                    )
+                return result
+
+            return wrapper
+
+        return decorator
+
+    def write(self, metrics_path: PosixPath, **info) -> Dict:
+        """Write the collected metrics to a json file.
+
+        Args:
+            metrics_path (PosixPath): path of the json file
+            **info: extra top level fields, e.g. the command
+
+        Returns:
+            Dict: the written metrics
+        """
+        metrics = {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            **info,
+            "stages": self.records,
+        }
+        Path(metrics_path).parent.mkdir(parents=True, exist_ok=True)
+        Path(metrics_path).write_text(json.dumps(metrics, indent=2, default=str))
+        return metrics
+
+
+def _count_call_rows(
+    rows: Callable[..., Union[int, None]],
+    signature: inspect.Signature,
+    result: Any,
+    args: tuple,
+    kwargs: Dict,
+) -> Union[int, None]:
+    """Rows a profiled call processed, None if they can't be counted,
+    the profiler must never change the result of the call it profiles."""
+    try:
+        bound = signature.bind(*args, **kwargs)
+        return rows(result, *bound.args, **bound.kwargs)
+    except Exception as error:
+        logger.debug(f"Couldn't count the rows of a profiled call: {error!r}")
+        return None
+
+
+def format_record(record: Dict) -> str:
+    """One line summary of a stage's metrics."""
+    rows = ""
+    if record["rows"] is not None:
+        rows = f", {record['rows']} rows"
+        if record["rows_per_second"] is not None:
+            rows += f" ({record['rows_per_second']:.0f} rows/s)"
+    return (
+        f"⏱️ {record['stage']}: {record['wall_seconds']:.2f}s wall, {record['cpu_seconds']:.2f}s cpu"
+        f"{rows}, peak RSS {record['peak_rss_mb']} MB"
+    )
+
+
+# process wide profiler, powr functions are profiled through it
+PROFILER = Profiler()
+stage = PROFILER.stage
+profiled = PROFILER.profiled
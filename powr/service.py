@@ -0,0 +1,195 @@
+"""Module for serving forecasts over HTTP
+the model & scaler are loaded once, requests arriving close together are micro-batched
+into a single model call"""
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import MinMaxScaler
+
+from powr import features, predict
+
+logger = logging.getLogger("powr")
+
+WINDOW_SIZE = 288
+
+
+class MicroBatcher:
+    """Collects single windows submitted from many threads & predicts them in batches.
+    a batch is run as soon as max_batch_size windows are waiting, or max_wait_ms after
+    the first window of the batch arrived"""
+
+    def __init__(
+        self,
+        predict_fn: Callable[[np.ndarray], np.ndarray],
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5.0,
+    ):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, window: np.ndarray) -> np.ndarray:
+        """Predict a single window of shape (time, features), blocks until its batch ran."""
+        future: Future = Future()
+        self._queue.put((window, future))
+        return future.result()
+
+    def _next_batch(self) -> List[Tuple[np.ndarray, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            try:
+                predictions = self.predict_fn(np.stack([window for window, _ in batch]))
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            for (_, future), prediction in zip(batch, predictions):
+                future.set_result(prediction)
+
+
+class ForecastService:
+    """Keeps a model & scaler resident & turns the last 288 readings into a forecast,
+    building the time features & scaling them as the dataset was, see `data.preprocess_df`."""
+
+    def __init__(
+        self,
+        model,
+        scaler: MinMaxScaler,
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5.0,
+    ):
+        self.model = model
+        self.scaler = scaler
+        self.batcher = MicroBatcher(
+            lambda windows: np.asarray(self.model.predict_on_batch(windows)),
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+        )
+
+    def forecast(self, last_24_df: pd.DataFrame) -> pd.DataFrame:
+        """Forecast the 24 hours after the given readings.
+
+        Args:
+            last_24_df (pd.DataFrame): last 288 readings in real units, i.e. 5min bins of the clean data's
+                                    VALUE column, indexed by CREATED_AT
+
+        Raises:
+            ValueError: if there aren't enough readings or they don't have the scaler's number of columns
+
+        Returns:
+            pd.DataFrame: the forecast, in the same format as predict.predict_next_24
+        """
+        if len(last_24_df) < WINDOW_SIZE:
+            raise ValueError(
+                f"Expected the last {WINDOW_SIZE} readings, got {len(last_24_df)}"
+            )
+        last_24_df = features.DEFAULT_PIPELINE.transform_df(last_24_df[-WINDOW_SIZE:])
+        if hasattr(self.scaler, "feature_names_in_"):
+            # same column order as the dataset the scaler (& model) was fitted on
+            last_24_df = last_24_df[list(self.scaler.feature_names_in_)]
+        last_24_data = last_24_df.to_numpy(dtype=np.float32)
+        # checked before batching, a window of another shape would fail every request batched with it
+        expected_shape = (WINDOW_SIZE, self.scaler.n_features_in_)
+        if last_24_data.shape != expected_shape:
+            raise ValueError(
+                f"Expected readings of shape {expected_shape}, got {last_24_data.shape}"
+            )
+        # MinMaxScaler.transform
+        last_24_data = (last_24_data * self.scaler.scale_ + self.scaler.min_).astype(
+            np.float32
+        )
+        next_24 = self.batcher.submit(last_24_data)
+        next_24 = next_24.reshape(WINDOW_SIZE, last_24_data.shape[1])
+        next_24_scaled = self.scaler.inverse_transform(next_24)
+        return predict.format_forecast(next_24_scaled, last_24_df.index.max())
+
+
+def _make_handler(service: ForecastService) -> type:
+    """Make a request handler class bound to a forecast service."""
+
+    class ForecastHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body) -> None:
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self) -> None:
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok"})
+            else:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self) -> None:
+            """Forecast from a json list of the last 288 readings, records of 5min bins with CREATED_AT & VALUE."""
+            if self.path != "/predict":
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                records = json.loads(self.rfile.read(length))
+                last_24_df = pd.DataFrame.from_records(records)
+                last_24_df.index = pd.to_datetime(
+                    last_24_df.pop("CREATED_AT"), utc=True
+                )
+                forecast = service.forecast(last_24_df)
+            except (ValueError, KeyError, TypeError) as error:
+                self._send_json(400, {"error": str(error)})
+                return
+            except Exception as error:
+                # e.g. the model failing, the client still gets a response
+                logger.exception("❌ Forecast failed!")
+                self._send_json(500, {"error": repr(error)})
+                return
+            self._send_json(200, forecast.to_dict(orient="records"))
+
+        def log_message(self, format, *args) -> None:
+            # keeps per request access logs out of stderr
+            pass
+
+    return ForecastHandler
+
+
+def make_server(
+    service: ForecastService, host: str = "127.0.0.1", port: int = 8000
+) -> ThreadingHTTPServer:
+    """Make a threaded HTTP server for a forecast service
+        - GET /health
+        - POST /predict with a json list of the last 288 readings, e.g. [{"CREATED_AT": ..., "VALUE": ...}, ...]
+          in real units, the time features are built & the readings are scaled server side
+
+    Args:
+        service (ForecastService): service to forecast with
+        host (str, optional): host to bind to. Defaults to "127.0.0.1".
+        port (int, optional): port to bind to. Defaults to 8000.
+
+    Returns:
+        ThreadingHTTPServer: the (not yet started) server
+    """
+    return ThreadingHTTPServer((host, port), _make_handler(service))
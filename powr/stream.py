@@ -0,0 +1,223 @@
+"""Module for streaming forecasts
+aggregates raw readings into 5min bins as they arrive, the same way `data.clean_df` does,
+& keeps the last 24 hours of preprocessed & scaled bins in a ring buffer to forecast from on demand"""
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import MinMaxScaler
+
+from powr import features, predict, utils
+
+WINDOW_SIZE = 288
+BIN_NS = pd.Timedelta("5min").value
+
+
+class StreamingForecaster:
+    def __init__(
+        self,
+        model,
+        scaler: MinMaxScaler,
+        datatime_str_fmts: Union[List[str], None] = None,
+        window_size: int = WINDOW_SIZE,
+        feature_columns: Union[List[str], None] = None,
+    ):
+        """Forecast from readings as they arrive, every reading costs O(1) rather than O(history).
+
+        Readings of the open (latest) bin are deduplicated & averaged per timestamp, then summed,
+        as `data.clean_df` does. A bin is closed once a reading of a later bin arrives, bins without
+        readings in between are closed as 0. Closed bins get the `data.preprocess_df` features,
+        scaled with the stored scaler & pushed into a ring buffer of the last window_size bins.
+        Readings of already closed bins arrive too late to be counted & are dropped.
+
+        Args:
+            model: model with a predict_on_batch method (keras or predict.NumpyLinearModel)
+            scaler (MinMaxScaler): the scaler the model's dataset was normalised with
+            datatime_str_fmts (Union[List[str], None], optional): strptime formats of string timestamps.
+                                    Defaults to None.
+            window_size (int, optional): number of bins the model forecasts from. Defaults to WINDOW_SIZE.
+            feature_columns (Union[List[str], None], optional): columns of the model's dataset, in order,
+                                    the scaler's feature names if None. Defaults to None.
+        """
+        self.model = model
+        self.scaler = scaler
+        self.datatime_str_fmts = datatime_str_fmts or []
+        self.window_size = window_size
+        if feature_columns is None:
+            feature_columns = list(scaler.feature_names_in_)
+        self.feature_columns = feature_columns
+        # positions of the feature columns in VALUE followed by the time features
+        columns = ["VALUE", *features.DEFAULT_PIPELINE.columns]
+        self._column_positions = [columns.index(col) for col in feature_columns]
+
+        self._buffer = np.zeros((window_size, len(feature_columns)), dtype=np.float32)
+        self._head = 0
+        self.n_bins = 0
+        # start (ns since epoch) of the last closed bin
+        self.last_bin_ns: Union[int, None] = None
+        # open bin: start & (sum, count) of the distinct readings at every timestamp within it
+        self._open_bin_ns: Union[int, None] = None
+        self._open_readings: Dict[int, List[float]] = {}
+        self._open_seen: set = set()
+        self.late_readings = 0
+
+    @property
+    def is_ready(self) -> bool:
+        """Whether the buffer holds a full window to forecast from."""
+        return self.n_bins >= self.window_size
+
+    def prime(self, dataset_df: pd.DataFrame) -> None:
+        """Fill the buffer with the last bins of a (scaled) dataset, e.g. the test set, to forecast from.
+
+        Args:
+            dataset_df (pd.DataFrame): preprocessed & scaled bins indexed by CREATED_AT
+        """
+        last_bins = dataset_df[self.feature_columns][-self.window_size :]  # noqa: E203
+        self._buffer[-len(last_bins) :] = last_bins.to_numpy(  # noqa: E203
+            dtype=np.float32
+        )
+        self._head = 0
+        self.n_bins = len(last_bins)
+        self.last_bin_ns = int(last_bins.index.asi8[-1])
+        self._open_bin_ns = None
+        self._open_readings, self._open_seen = {}, set()
+        return None
+
+    def _timestamp_ns(self, created_at: Union[str, pd.Timestamp]) -> int:
+        """Nanoseconds since epoch (UTC) of a reading's timestamp."""
+        if isinstance(created_at, str):
+            created_at = utils._str_to_datetime(created_at, self.datatime_str_fmts)
+        timestamp = pd.Timestamp(created_at)
+        if timestamp.tz is None:
+            timestamp = timestamp.tz_localize("UTC")
+        return timestamp.value
+
+    def update(self, created_at: Union[str, pd.Timestamp], value: float) -> int:
+        """Add a raw reading.
+
+        Args:
+            created_at (Union[str, pd.Timestamp]): timestamp of the reading, strings are parsed with
+                                    datatime_str_fmts, naive timestamps are taken as UTC
+            value (float): power consumption of the reading
+
+        Returns:
+            int: number of bins the reading closed
+        """
+        # invalid rows are dropped, as in data.clean_df
+        if value is None or pd.isna(value) or value < 0 or pd.isna(created_at):
+            return 0
+        timestamp_ns = self._timestamp_ns(created_at)
+        bin_ns = timestamp_ns - timestamp_ns % BIN_NS
+
+        closed = 0
+        if self._open_bin_ns is None or bin_ns > self._open_bin_ns:
+            if self.last_bin_ns is not None and bin_ns <= self.last_bin_ns:
+                self.late_readings += 1
+                return 0
+            closed = self._close_bins(bin_ns)
+            self._open_bin_ns = bin_ns
+        elif bin_ns < self._open_bin_ns:
+            self.late_readings += 1
+            return 0
+
+        # duplicate rows are dropped, the remaining readings at a timestamp are averaged
+        reading = (timestamp_ns, float(value))
+        if reading in self._open_seen:
+            return closed
+        self._open_seen.add(reading)
+        totals = self._open_readings.setdefault(timestamp_ns, [0.0, 0])
+        totals[0] += float(value)
+        totals[1] += 1
+        return closed
+
+    def update_many(self, readings: pd.DataFrame) -> int:
+        """Add raw readings with CREATED_AT & VALUE columns, in arrival order.
+
+        Args:
+            readings (pd.DataFrame): raw readings
+
+        Returns:
+            int: number of bins the readings closed
+        """
+        return sum(
+            self.update(created_at, value)
+            for created_at, value in zip(readings["CREATED_AT"], readings["VALUE"])
+        )
+
+    def flush(self) -> int:
+        """Close the open bin, e.g. once its 5 minutes are over & no later reading arrived yet.
+
+        Returns:
+            int: number of bins closed
+        """
+        if self._open_bin_ns is None:
+            return 0
+        return self._close_bins(self._open_bin_ns + BIN_NS)
+
+    def _close_bins(self, next_bin_ns: int) -> int:
+        """Close the open bin & the empty bins up to (excluding) next_bin_ns, pushing them into the buffer."""
+        if self._open_bin_ns is None:
+            return 0
+        open_value = sum(total / count for total, count in self._open_readings.values())
+        # only the last window_size of the empty bins can ever be forecasted from
+        n_empty = (next_bin_ns - self._open_bin_ns) // BIN_NS - 1
+        empty_starts = self._open_bin_ns + BIN_NS * np.arange(
+            max(n_empty - self.window_size, 0) + 1, n_empty + 1
+        )
+        starts_ns = np.concatenate([[self._open_bin_ns], empty_starts]).astype(np.int64)
+        values = np.zeros(len(starts_ns))
+        values[0] = open_value
+        self._push(starts_ns, values)
+        self.n_bins += n_empty + 1
+
+        self._open_bin_ns = None
+        self._open_readings, self._open_seen = {}, set()
+        return n_empty + 1
+
+    def _scaled_rows(self, starts_ns: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """Preprocess & scale bins as in the dataset, returns rows in feature_columns order."""
+        # the pipeline behind data.preprocess_df, for just these bins
+        block = np.concatenate(
+            [values[:, None], features.DEFAULT_PIPELINE.transform(starts_ns)], axis=1
+        )[:, self._column_positions]
+        # MinMaxScaler.transform
+        return (block * self.scaler.scale_ + self.scaler.min_).astype(np.float32)
+
+    def _push(self, starts_ns: np.ndarray, values: np.ndarray) -> None:
+        """Push closed bins into the ring buffer, overwriting the oldest ones."""
+        rows = self._scaled_rows(starts_ns, values)[-self.window_size :]  # noqa: E203
+        positions = (self._head + np.arange(len(rows))) % self.window_size
+        self._buffer[positions] = rows
+        self._head = (self._head + len(rows)) % self.window_size
+        self.last_bin_ns = int(starts_ns[-1])
+        return None
+
+    def window(self) -> Tuple[np.ndarray, pd.Timestamp]:
+        """The last window_size closed bins, oldest first, & the start of the last one.
+
+        Raises:
+            ValueError: if fewer than window_size bins have been closed
+
+        Returns:
+            Tuple[np.ndarray, pd.Timestamp]: (window_size, features) scaled window & its last timestamp
+        """
+        if not self.is_ready:
+            raise ValueError(
+                f"Expected {self.window_size} closed bins to forecast from, got {self.n_bins}"
+            )
+        window = np.concatenate(
+            [self._buffer[self._head :], self._buffer[: self._head]]  # noqa: E203
+        )
+        return window, pd.Timestamp(self.last_bin_ns, tz="UTC")
+
+    def forecast(self) -> pd.DataFrame:
+        """Forecast the 24 hours after the last closed bin.
+
+        Returns:
+            pd.DataFrame: the forecast, in the same format as predict.predict_next_24
+        """
+        window, last_timestamp = self.window()
+        next_24 = np.asarray(self.model.predict_on_batch(window[None]))
+        next_24 = next_24.reshape(-1, len(self.feature_columns))
+        next_24_scaled = self.scaler.inverse_transform(next_24)
+        return predict.format_forecast(next_24_scaled, last_timestamp)
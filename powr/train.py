@@ -1,8 +1,90 @@
-from typing import Tuple
+import json
+import tempfile
+from pathlib import Path, PosixPath
+from typing import TYPE_CHECKING, Dict, Iterator, List, Tuple, Union
 
+import numpy as np
 import tensorflow as tf
 
-from powr.window import WindowGenerator
+from powr import profiling
+from powr.window import as_window_data
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from powr.window import WindowGenerator
+
+SOLVERS = ["adam", "lstsq"]
+TFLITE_QUANTIZATIONS = ["none", "float16", "int8"]
+BEST_WEIGHTS_NAME = "best.weights.h5"
+BEST_RECORD_NAME = "best.json"
+BACKUP_DIR_NAME = "backup"
+REFIT_BACKUP_DIR_NAME = "refit_backup"
+
+
+def _trained_rows(
+    result, model, window, epochs=None, patience=None, all_data=False, *args, **kwargs
+) -> int:
+    """Rows trained on, counted again for every epoch run, takes `train_model`'s arguments."""
+    _, history = result
+    dfs = [window.train_df]
+    if all_data:
+        dfs += [window.val_df, window.test_df]
+    # the lstsq solver returns a history without epochs
+    return sum(profiling.count_rows(df) or 0 for df in dfs) * max(
+        len(getattr(history, "epoch", [])), 1
+    )
+
+
+def _refit_rows(result, model, window, *args, **kwargs) -> int:
+    """Rows refitted on, counted again for every epoch run."""
+    return _trained_rows(result, model, window, all_data=True)
+
+
+def configure_threads(intra_op_threads: int = 0, inter_op_threads: int = 0) -> None:
+    """Configure tensorflow's thread pools, has to be called before tensorflow runs any op.
+
+    Args:
+        intra_op_threads (int, optional): threads used within an op, 0 lets tensorflow decide. Defaults to 0.
+        inter_op_threads (int, optional): threads used to run independent ops, 0 lets tensorflow decide.
+                                    Defaults to 0.
+    """
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+def is_chief(strategy: tf.distribute.Strategy) -> bool:
+    """Whether this process is the chief of a multi worker strategy (or isn't distributed across workers),
+    only the chief writes checkpoints.
+
+    Args:
+        strategy (tf.distribute.Strategy): the strategy the model was built under
+
+    Returns:
+        bool: True if this process is the chief
+    """
+    resolver = getattr(strategy, "cluster_resolver", None)
+    if resolver is None or not resolver.task_type:
+        return True
+    return resolver.task_type == "chief" or (
+        resolver.task_type == "worker" and resolver.task_id == 0
+    )
+
+
+def save_weights(model: tf.keras.Model, weights_path: PosixPath) -> None:
+    """Save the model's weights. Under a multi worker strategy every worker has to save, as saving may
+    all reduce variables, but only the chief's weights are written to weights_path.
+
+    Args:
+        model (tf.keras.Model): the model
+        weights_path (PosixPath): path to save the weights to
+    """
+    if is_chief(model.distribute_strategy):
+        model.save_weights(weights_path)
+        return None
+    with tempfile.TemporaryDirectory() as temp_dir:
+        model.save_weights(Path(temp_dir, Path(weights_path).name))
+    return None
 
 
 def build_model(output_steps: int, num_features: int) -> tf.keras.Model:
@@ -31,12 +113,184 @@ def build_model(output_steps: int, num_features: int) -> tf.keras.Model:
     return multi_linear_model
 
 
+def compile_model(model: tf.keras.Model) -> tf.keras.Model:
+    """Compile the model with the loss, optimizer & metrics it is trained & evaluated with.
+
+    Args:
+        model (tf.keras.Model): the model to compile
+
+    Returns:
+        tf.keras.Model: the compiled model
+    """
+    model.compile(
+        loss=tf.keras.losses.MeanSquaredError(),
+        optimizer=tf.keras.optimizers.Adam(),
+        metrics=[tf.keras.metrics.MeanAbsoluteError()],
+    )
+    return model
+
+
+class BestWeightsCheckpoint(tf.keras.callbacks.Callback):
+    def __init__(
+        self, checkpoint_dir: PosixPath, monitor: str = "val_loss", resume=False
+    ):
+        """Save the weights of the best epoch so far & record which epoch (1 based) it was.
+        Under a multi worker strategy only the chief saves them.
+
+        Args:
+            checkpoint_dir (PosixPath): directory to save the weights & record to
+            monitor (str, optional): metric to minimise. Defaults to "val_loss".
+            resume (bool, optional): carry on from the recorded best, e.g. when resuming an interrupted fit,
+                                    rather than removing it. Defaults to False.
+        """
+        super().__init__()
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.monitor = monitor
+        self.resume = resume
+        self.best = {"epoch": 0, monitor: float("inf")}
+        # whether the best weights in checkpoint_dir are from this fit (or the one it resumed)
+        self.saved = False
+
+    def on_train_begin(self, logs=None):
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        weights_path = Path(self.checkpoint_dir, BEST_WEIGHTS_NAME)
+        record_path = Path(self.checkpoint_dir, BEST_RECORD_NAME)
+        if self.resume and record_path.exists() and weights_path.exists():
+            self.best = load_best_record(self.checkpoint_dir)
+            self.saved = True
+        elif is_chief(self.model.distribute_strategy):
+            # a previous fit's best mustn't be mistaken for this one's
+            weights_path.unlink(missing_ok=True)
+            record_path.unlink(missing_ok=True)
+
+    def on_epoch_end(self, epoch, logs=None):
+        current = (logs or {}).get(self.monitor)
+        if current is None or current >= self.best[self.monitor]:
+            return
+        self.best = {"epoch": epoch + 1, self.monitor: float(current)}
+        save_weights(self.model, Path(self.checkpoint_dir, BEST_WEIGHTS_NAME))
+        self.saved = True
+        if not is_chief(self.model.distribute_strategy):
+            return
+        Path(self.checkpoint_dir, BEST_RECORD_NAME).write_text(json.dumps(self.best))
+
+
+def load_best_record(checkpoint_dir: PosixPath) -> Dict:
+    """Load the record of the best epoch saved by BestWeightsCheckpoint.
+
+    Args:
+        checkpoint_dir (PosixPath): checkpoint directory
+
+    Returns:
+        Dict: best (1 based) epoch & its monitored metric
+    """
+    return json.loads(Path(checkpoint_dir, BEST_RECORD_NAME).read_text())
+
+
+def _dense_layer(model: tf.keras.Model) -> tf.keras.layers.Dense:
+    """Get the (only) Dense layer of a model built by `build_model`."""
+    return [
+        layer for layer in model.layers if isinstance(layer, tf.keras.layers.Dense)
+    ][0]
+
+
+def _last_step_chunks(
+    df: "pd.DataFrame", window: "WindowGenerator", chunk_size: int
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Yield (last input time step, flattened labels) of the windows in df, chunk_size windows at a time.
+
+    Args:
+        df (pd.DataFrame): data to window
+        window (WindowGenerator): window parameters
+        chunk_size (int): number of windows per chunk
+
+    Yields:
+        Iterator[Tuple[np.ndarray, np.ndarray]]: (windows, features) & (windows, label steps * label columns)
+    """
+    data = as_window_data(df)
+    label_columns = window.label_columns or list(window.column_indices)
+    label_indices = [window.column_indices[name] for name in label_columns]
+    starts = np.arange(
+        0, len(data) - window.total_window_size + 1, window.sequence_stride
+    )
+    for chunk_starts in np.array_split(starts, max(1, -(-len(starts) // chunk_size))):
+        if len(chunk_starts) == 0:
+            continue
+        # only the rows of this chunk's windows are copied, data might be chunked or memory mapped
+        first, stop = chunk_starts[0], chunk_starts[-1] + window.total_window_size
+        rows = np.asarray(data[first:stop], dtype=np.float64)
+        # (windows, label columns, label steps) view
+        labels = rows[:, label_indices][window.label_start :]  # noqa: E203
+        label_windows = np.lib.stride_tricks.sliding_window_view(
+            labels, window.label_width, axis=0
+        )
+        yield (
+            rows[chunk_starts - first + window.input_width - 1],
+            label_windows[chunk_starts - first]
+            .transpose(0, 2, 1)
+            .reshape(len(chunk_starts), -1),
+        )
+
+
+def fit_least_squares(
+    window: "WindowGenerator",
+    output_steps: int,
+    num_features: int,
+    ridge: float = 0.0,
+    all_data: bool = False,
+    chunk_size: int = 100_000,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Solve for the Dense kernel & bias of a model built by `build_model` in closed form,
+    by accumulating the normal equations of the (last input step => labels) regression in chunks.
+
+    The labels are broadcast against the model's output features, as keras does when computing the loss,
+    so every output feature gets the weights of its label column (or of the only one).
+
+    Args:
+        window (WindowGenerator): window generator with dataset to fit on
+        output_steps (int): The number of time steps the model predicts
+        num_features (int): The number of features in the input data
+        ridge (float, optional): L2 penalty on the kernel (not the bias). Defaults to 0.0.
+        all_data (bool, optional): fit on train, val & test data, not just train. Defaults to False.
+        chunk_size (int, optional): number of windows per chunk. Defaults to 100_000.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: kernel (num_features, output_steps * num_features) & bias
+    """
+    dfs = [window.train_df]
+    if all_data:
+        dfs += [window.val_df, window.test_df]
+
+    xtx, xty = 0.0, 0.0
+    for df in dfs:
+        for last_step, labels in _last_step_chunks(df, window, chunk_size):
+            x = np.hstack([last_step, np.ones((len(last_step), 1))])
+            xtx = xtx + x.T @ x
+            xty = xty + x.T @ labels
+
+    penalty = np.diag([ridge] * num_features + [0.0])
+    # lstsq rather than solve, constant features make the normal equations singular
+    weights = np.linalg.lstsq(xtx + penalty, xty, rcond=None)[0]
+
+    weights = np.broadcast_to(
+        weights.reshape(num_features + 1, output_steps, -1),
+        (num_features + 1, output_steps, num_features),
+    ).reshape(num_features + 1, output_steps * num_features)
+    return weights[:-1].astype(np.float32), weights[-1].astype(np.float32)
+
+
+@profiling.profiled(rows=_trained_rows)
 def train_model(
     model: tf.keras.Model,
-    window: WindowGenerator,
+    window: "WindowGenerator",
     epochs: int,
     patience=2,
     all_data=False,
+    solver: str = "adam",
+    ridge: float = 0.0,
+    checkpoint_dir: Union[PosixPath, None] = None,
+    callbacks: Union[List[tf.keras.callbacks.Callback], None] = None,
+    verbose: Union[int, str] = "auto",
 ) -> Tuple[tf.keras.Model, tf.keras.callbacks.History]:
     """Train the given model on the given window.
 
@@ -46,30 +300,229 @@ def train_model(
         epochs (int): the number of epochs to train for
         patience (int): the number of epochs to wait before early stopping
         all_data (bool): whether to train on all data or just the training set
+        solver (str, optional): "adam" trains with gradient descent, "lstsq" solves for the weights of a model
+                                    built by `build_model` in closed form (epochs & patience are unused).
+                                    Defaults to "adam".
+        ridge (float, optional): L2 penalty of the lstsq solver. Defaults to 0.0.
+        checkpoint_dir (Union[PosixPath, None], optional): back up every epoch to resume an interrupted fit from
+                                    & checkpoint the best weights (which the model ends up with) here,
+                                    see `refit_model`. Under a multi worker strategy only the chief
+                                    saves the best weights & the model keeps its last ones. Defaults to None.
+        callbacks (Union[List[tf.keras.callbacks.Callback], None], optional): extra callbacks passed to fit,
+                                    unused by the lstsq solver. Defaults to None.
+        verbose (Union[int, str], optional): verbosity of fit. Defaults to "auto".
+
+    Raises:
+        ValueError: if the solver is not supported or there are no validation windows to train against
 
     Returns:
         Tuple[tf.keras.Model, tf.keras.callbacks.History]: the trained model and the training history
     """
+    if solver not in SOLVERS:
+        raise ValueError(f"Unsupported solver {solver}, expected one of {SOLVERS}")
+    # without val_loss early stopping & the best weights checkpoint have nothing to go on
+    if solver == "adam" and not all_data and len(window.val) == 0:
+        raise ValueError(
+            f"No validation windows, the val split is shorter than a window of {window.total_window_size} rows"
+        )
+
     early_stopping = tf.keras.callbacks.EarlyStopping(
         monitor="val_loss", patience=patience, mode="min"
     )
 
-    model.compile(
-        loss=tf.keras.losses.MeanSquaredError(),
-        optimizer=tf.keras.optimizers.Adam(),
-        metrics=[tf.keras.metrics.MeanAbsoluteError()],
-    )
+    compile_model(model)
+    if solver == "lstsq":
+        num_features = len(window.column_indices)
+        output_steps = window.label_width
+        model.build((None, window.input_width, num_features))
+        _dense_layer(model).set_weights(
+            fit_least_squares(
+                window, output_steps, num_features, ridge=ridge, all_data=all_data
+            )
+        )
+        return model, tf.keras.callbacks.History()
+
+    fit_callbacks = [early_stopping]
+    best_checkpoint = None
+    if checkpoint_dir is not None and not all_data:
+        backup_dir = Path(checkpoint_dir, BACKUP_DIR_NAME)
+        # BackupAndRestore leaves an empty backup dir behind once a fit completes
+        best_checkpoint = BestWeightsCheckpoint(
+            checkpoint_dir,
+            resume=backup_dir.exists() and any(backup_dir.iterdir()),
+        )
+        fit_callbacks = [
+            # str, multi worker strategies expect a str backup dir
+            tf.keras.callbacks.BackupAndRestore(str(backup_dir)),
+            best_checkpoint,
+            early_stopping,
+        ]
+    fit_callbacks += callbacks or []
+
     if all_data:
         history = model.fit(
             window.all,
             epochs=epochs,
-            callbacks=[early_stopping],
+            callbacks=fit_callbacks,
+            verbose=verbose,
         )
     else:
         history = model.fit(
             window.train,
             epochs=epochs,
             validation_data=window.val,
-            callbacks=[early_stopping],
+            callbacks=fit_callbacks,
+            verbose=verbose,
         )
+        # workers of a multi worker strategy keep their last weights, the chief may still be writing the best
+        if (
+            best_checkpoint is not None
+            and best_checkpoint.saved
+            and not isinstance(
+                model.distribute_strategy, tf.distribute.MultiWorkerMirroredStrategy
+            )
+        ):
+            model.load_weights(Path(checkpoint_dir, BEST_WEIGHTS_NAME))
     return model, history
+
+
+@profiling.profiled(rows=_refit_rows)
+def refit_model(
+    model: tf.keras.Model,
+    window: "WindowGenerator",
+    checkpoint_dir: PosixPath,
+    epochs: Union[int, None] = None,
+    callbacks: Union[List[tf.keras.callbacks.Callback], None] = None,
+) -> Tuple[tf.keras.Model, tf.keras.callbacks.History]:
+    """Warm start the (compiled) model from the best checkpoint of `train_model` & train it on all the data
+    for as many epochs as it took to reach the best checkpoint.
+
+    Args:
+        model (tf.keras.Model): the model trained by `train_model`
+        window (WindowGenerator): window generator with dataset to train on
+        checkpoint_dir (PosixPath): checkpoint directory passed to `train_model`
+        epochs (Union[int, None], optional): number of epochs, the best epoch if None. Defaults to None.
+        callbacks (Union[List[tf.keras.callbacks.Callback], None], optional): extra callbacks passed to fit.
+                                    Defaults to None.
+
+    Returns:
+        Tuple[tf.keras.Model, tf.keras.callbacks.History]: the refitted model and the training history
+    """
+    model.load_weights(Path(checkpoint_dir, BEST_WEIGHTS_NAME))
+    if epochs is None:
+        epochs = load_best_record(checkpoint_dir)["epoch"]
+
+    history = model.fit(
+        window.all,
+        epochs=epochs,
+        callbacks=[
+            tf.keras.callbacks.BackupAndRestore(
+                str(Path(checkpoint_dir, REFIT_BACKUP_DIR_NAME))
+            )
+        ]
+        + (callbacks or []),
+    )
+    return model, history
+
+
+def export_numpy_model(
+    model: tf.keras.Model, output_steps: int, num_features: int, npz_path: PosixPath
+) -> None:
+    """Export the Dense kernel & bias of a model built by `build_model` to a .npz file,
+    which predict.NumpyLinearModel can run without tensorflow.
+
+    Args:
+        model (tf.keras.Model): the (trained) model
+        output_steps (int): The number of time steps the model predicts
+        num_features (int): The number of features in the input data
+        npz_path (PosixPath): path to save the .npz file to
+    """
+    kernel, bias = _dense_layer(model).get_weights()
+    np.savez(
+        npz_path,
+        kernel=kernel,
+        bias=bias,
+        output_steps=output_steps,
+        num_features=num_features,
+    )
+    return None
+
+
+def _serving_function(
+    model: tf.keras.Model, window_size: int, num_features: int
+) -> tf.types.experimental.ConcreteFunction:
+    """Concrete function of the model's forward pass over (batch, window_size, num_features) float32 windows."""
+    return tf.function(
+        lambda windows: model(windows, training=False),
+        input_signature=[
+            tf.TensorSpec([None, window_size, num_features], tf.float32, name="windows")
+        ],
+    ).get_concrete_function()
+
+
+def export_serving_model(
+    model: tf.keras.Model,
+    window_size: int,
+    num_features: int,
+    saved_model_path: PosixPath,
+) -> None:
+    """Export a model as a SavedModel of a single `serving_default` concrete function with a fixed
+    (batch, window_size, num_features) signature, which predict.SignatureModel runs without deserialising keras.
+
+    Args:
+        model (tf.keras.Model): the (trained) model
+        window_size (int): The number of time steps in the input windows
+        num_features (int): The number of features in the input data
+        saved_model_path (PosixPath): directory to save the SavedModel to
+    """
+    serve = _serving_function(model, window_size, num_features)
+    # only the weights are tracked, the keras model (& its Lambda layer) isn't saved
+    module = tf.Module()
+    module.weights = model.weights
+    tf.saved_model.save(module, str(saved_model_path), signatures=serve)
+    return None
+
+
+def export_tflite_model(
+    model: tf.keras.Model,
+    window_size: int,
+    num_features: int,
+    tflite_path: PosixPath,
+    quantization: str = "none",
+    representative_windows: Union[np.ndarray, None] = None,
+) -> None:
+    """Export a model as a TFLite flatbuffer, which predict.TFLiteModel runs with the TFLite interpreter.
+
+    Args:
+        model (tf.keras.Model): the (trained) model
+        window_size (int): The number of time steps in the input windows
+        num_features (int): The number of features in the input data
+        tflite_path (PosixPath): path to save the .tflite file to
+        quantization (str, optional): "none", "float16" (weights) or "int8" (weights & activations,
+                                    inputs & outputs stay float32). Defaults to "none".
+        representative_windows (Union[np.ndarray, None], optional): (windows, window_size, num_features)
+                                    normalised windows to calibrate int8 activations with. Defaults to None.
+
+    Raises:
+        ValueError: if the quantization is not supported or int8 has no representative windows
+    """
+    if quantization not in TFLITE_QUANTIZATIONS:
+        raise ValueError(
+            f"Unsupported quantization {quantization}, expected one of {TFLITE_QUANTIZATIONS}"
+        )
+    if quantization == "int8" and representative_windows is None:
+        raise ValueError("int8 quantization needs representative windows")
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions(
+        [_serving_function(model, window_size, num_features)], model
+    )
+    if quantization != "none":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        converter.representative_dataset = lambda: (
+            [window[np.newaxis].astype(np.float32)] for window in representative_windows
+        )
+    Path(tflite_path).write_bytes(converter.convert())
+    return None
@@ -0,0 +1,414 @@
+"""Module for hyperparameter tuning
+runs trials of window, split & training settings concurrently in a process pool, each with its own thread budget,
+& prunes trials whose held out error falls behind the median of the other trials.
+trials are ranked & pruned on the forecast MAE (in real units) over the same held out rows, after the train
+& val splits of every trial, rather than on val_loss, which each trial's split & scaler measure differently"""
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path, PosixPath
+from typing import Dict, List, Union
+
+import joblib
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from sklearn.preprocessing import MinMaxScaler
+
+from powr import backtest, data, train, utils, window
+
+# leaderboard order, complete trials rank above pruned ones regardless of their loss
+TRIAL_STATUSES = ["complete", "pruned", "failed"]
+LEADERBOARD_NAME = "leaderboard.csv"
+BEST_ARGS_NAME = "best_args.json"
+TRIALS_DIR_NAME = "trials"
+# the loss trials are ranked & pruned on, see `HeldOutScore`
+SCORE_NAME = "held_out_mae"
+
+
+def search_grid(
+    search_space: Dict[str, List],
+    n_trials: Union[int, None] = None,
+    seed: int = 0,
+) -> List[Dict]:
+    """Every combination of the search space, or n_trials of them sampled at random.
+    combinations whose train & val splits leave nothing for the test split are skipped
+
+    Args:
+        search_space (Dict[str, List]): values to try by hyperparameter
+        n_trials (Union[int, None], optional): number of combinations to sample, all if None. Defaults to None.
+        seed (int, optional): seed for sampling. Defaults to 0.
+
+    Returns:
+        List[Dict]: hyperparameters of every trial, including the test_size the other splits leave
+    """
+    names = list(search_space)
+    trials = []
+    for values in itertools.product(*search_space.values()):
+        params = dict(zip(names, values))
+        test_size = round(1 - params["train_size"] - params["val_size"], 6)
+        if test_size <= 0:
+            continue
+        trials.append({**params, "test_size": test_size})
+    if n_trials is not None and n_trials < len(trials):
+        trials = random.Random(seed).sample(trials, n_trials)  # nosec
+    return trials
+
+
+def held_out_start(trials: List[Dict]) -> float:
+    """Share of the data before the held out rows every trial is scored on, i.e. after all the trials'
+    train & val splits, so that no trial trains or early stops on them."""
+    return max(trial["train_size"] + trial["val_size"] for trial in trials)
+
+
+class HeldOutScore(tf.keras.callbacks.Callback):
+    def __init__(
+        self,
+        scaler: MinMaxScaler,
+        df: pd.DataFrame,
+        first_scored_row: int,
+        window_size: int,
+        horizon: int,
+        target_column: str = "VALUE",
+        name: str = SCORE_NAME,
+        stride: Union[int, None] = None,
+    ):
+        """Score the model after every epoch by the MAE, denormalised to real units, of its forecasts
+        of the rows from first_scored_row on, & add it to the epoch's logs as name.
+
+        Trials scored on the same rows are comparable whatever their split & scaler.
+
+        Args:
+            scaler (MinMaxScaler): the scaler df was normalised with
+            df (pd.DataFrame): normalised data, with at least window_size rows before first_scored_row
+            first_scored_row (int): position in df of the first row forecasts are scored on
+            window_size (int): number of input rows of a forecast
+            horizon (int): number of rows a forecast predicts
+            target_column (str, optional): forecasted column. Defaults to "VALUE".
+            name (str, optional): name of the score in the logs. Defaults to SCORE_NAME.
+            stride (Union[int, None], optional): rows between forecast origins, horizon if None, i.e. every
+                                    scored row is forecast once (but a tail shorter than horizon). Defaults to None.
+
+        Raises:
+            ValueError: if fewer than horizon rows are scored or there's less than a window before them
+        """
+        super().__init__()
+        if first_scored_row < window_size or len(df) - first_scored_row < horizon:
+            raise ValueError(
+                f"Need {window_size} rows before & {horizon} rows from the first scored row, "
+                f"got {first_scored_row} & {len(df) - first_scored_row}"
+            )
+        self.scaler = scaler
+        self.df = df
+        # origins are the last input rows, horizon apart their forecasts cover the scored rows once,
+        # rather than horizon times, which for years of data is hundreds of MB every epoch
+        self.origins = np.arange(
+            first_scored_row - 1, len(df) - horizon, stride or horizon
+        )
+        self.window_size = window_size
+        self.horizon = horizon
+        self.target_column = target_column
+        self.name = name
+        self.scores: List[float] = []
+
+    def on_epoch_end(self, epoch, logs=None):
+        forecasts, actuals = backtest.backtest_forecasts(
+            self.model,
+            self.scaler,
+            self.df,
+            self.origins,
+            self.window_size,
+            self.horizon,
+            target_column=self.target_column,
+        )
+        score = float(np.mean(np.abs(forecasts - actuals)))
+        self.scores.append(score)
+        # later callbacks (e.g. MedianPruner) see the score with the other metrics
+        if logs is not None:
+            logs[self.name] = score
+
+
+def _write_json(path: Path, obj: Dict) -> None:
+    """Write json to a temporary file first, so that concurrent readers never see a partial file."""
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(obj))
+    os.replace(tmp_path, path)
+    return None
+
+
+class MedianPruner(tf.keras.callbacks.Callback):
+    def __init__(
+        self,
+        trials_dir: PosixPath,
+        trial_id: int,
+        warmup_epochs: int = 1,
+        min_trials: int = 2,
+        monitor: str = SCORE_NAME,
+    ):
+        """Record a trial's loss after every epoch & stop it once its best loss so far
+        is worse than the median of the other trials' best losses at the same epoch.
+
+        Trials running in other processes share their losses through a json record per trial in trials_dir.
+
+        Args:
+            trials_dir (PosixPath): directory of the trials' records
+            trial_id (int): id of this trial
+            warmup_epochs (int, optional): epochs to run before pruning. Defaults to 1.
+            min_trials (int, optional): other trials that have to have reached an epoch to prune at it.
+                                    Defaults to 2.
+            monitor (str, optional): loss to compare, it has to measure every trial on the same data
+                                    in the same units, e.g. `HeldOutScore`'s. Defaults to SCORE_NAME.
+        """
+        super().__init__()
+        self.trials_dir = Path(trials_dir)
+        self.record_path = Path(trials_dir, f"{trial_id}.json")
+        self.warmup_epochs = warmup_epochs
+        self.min_trials = min_trials
+        self.monitor = monitor
+        self.losses: List[float] = []
+        self.pruned = False
+
+    def _other_best_losses(self, epoch: int) -> List[float]:
+        """Best loss of every other trial up to the given (0 based) epoch."""
+        best_losses = []
+        for record_path in self.trials_dir.glob("*.json"):
+            if record_path == self.record_path:
+                continue
+            losses = json.loads(record_path.read_text())["losses"]
+            if len(losses) > epoch:
+                best_losses.append(min(losses[: epoch + 1]))
+        return best_losses
+
+    def on_epoch_end(self, epoch, logs=None):
+        current = (logs or {}).get(self.monitor)
+        if current is None:
+            return
+        self.losses.append(float(current))
+        _write_json(self.record_path, {"losses": self.losses})
+        if epoch + 1 < self.warmup_epochs:
+            return
+        other_best_losses = self._other_best_losses(epoch)
+        if len(other_best_losses) < self.min_trials:
+            return
+        if min(self.losses) > statistics.median(other_best_losses):
+            self.pruned = True
+            self.model.stop_training = True
+
+
+def run_trial(
+    trial_id: int,
+    params: Dict,
+    clean_data_path: PosixPath,
+    trials_dir: PosixPath,
+    forecast_steps: int,
+    label_columns: Union[List[str], None] = None,
+    prune: bool = True,
+    score_start: Union[float, None] = None,
+) -> Dict:
+    """Generate a dataset, window it & train a model with the trial's hyperparameters,
+    scoring it after every epoch on the held out rows from score_start on, see `HeldOutScore`.
+    exceptions are caught & reported, so that one trial failing doesn't affect the others
+
+    Args:
+        trial_id (int): id of the trial
+        params (Dict): window_size, epochs, patience, batch_size, train_size, val_size & test_size
+        clean_data_path (PosixPath): path of the clean (preprocessed) data
+        trials_dir (PosixPath): directory for the trials' records & scalers
+        forecast_steps (int): The number of time steps the model predicts
+        label_columns (Union[List[str], None], optional): columns to predict, all if None. Defaults to None.
+        prune (bool, optional): stop the trial early when it falls behind the others. Defaults to True.
+        score_start (Union[float, None], optional): share of the data before the held out rows,
+                                    after the trial's own train & val splits if None. Defaults to None.
+
+    Returns:
+        Dict: the trial's hyperparameters, status, best held out MAE, the epoch it was reached & best val_loss
+    """
+    start = time.perf_counter()
+    result = {"trial": trial_id, **params, "status": "complete", "error": None}
+    try:
+        clean_df = utils.load_df(clean_data_path)
+        scaler_path = Path(trials_dir, f"{trial_id}.scaler.pkl")
+        ds = data.generate_dataset(
+            clean_df,
+            scaler_path,
+            train_size=params["train_size"],
+            val_size=params["val_size"],
+            test_size=params["test_size"],
+        )
+        multi_window = window.WindowGenerator(
+            input_width=params["window_size"],
+            label_width=forecast_steps,
+            shift=forecast_steps,
+            dataset_dict=ds,
+            label_columns=label_columns,
+            batch_size=params["batch_size"],
+        )
+
+        # the held out rows & the window before them, normalised by the trial's scaler
+        score_start = score_start or params["train_size"] + params["val_size"]
+        first_scored_row = int(len(clean_df) * score_start)
+        scaler = joblib.load(scaler_path)
+        score_df = clean_df[first_scored_row - params["window_size"] :]  # noqa: E203
+        scorer = HeldOutScore(
+            scaler,
+            utils.scale_features(score_df, scaler=scaler)["df"],
+            first_scored_row=params["window_size"],
+            window_size=params["window_size"],
+            horizon=forecast_steps,
+            target_column=(label_columns or [clean_df.columns[0]])[0],
+        )
+
+        pruner = MedianPruner(trials_dir, trial_id)
+        model = train.build_model(forecast_steps, ds["train"].shape[1])
+        _, history = train.train_model(
+            model,
+            multi_window,
+            params["epochs"],
+            params["patience"],
+            # the scorer runs first, so that the pruner sees its score
+            callbacks=[scorer, pruner] if prune else [scorer],
+            verbose=0,
+        )
+        scores = scorer.scores
+        result.update(
+            status="pruned" if pruner.pruned else "complete",
+            **{SCORE_NAME: min(scores)},
+            best_epoch=scores.index(min(scores)) + 1,
+            epochs_run=len(scores),
+            val_loss=min(history.history["val_loss"]),
+        )
+    except Exception as error:
+        result.update(status="failed", error=repr(error))
+    finally:
+        tf.keras.backend.clear_session()
+    result["seconds"] = round(time.perf_counter() - start, 2)
+    return result
+
+
+def _init_trial_worker(threads_per_trial: int) -> None:
+    """Limit the threads of a trial worker process so that concurrent trials don't oversubscribe cores."""
+    os.environ["OMP_NUM_THREADS"] = str(threads_per_trial)
+    train.configure_threads(
+        intra_op_threads=threads_per_trial, inter_op_threads=threads_per_trial
+    )
+
+
+def tune(
+    search_space: Dict[str, List],
+    clean_data_path: PosixPath,
+    output_dir: PosixPath,
+    forecast_steps: int,
+    label_columns: Union[List[str], None] = None,
+    n_trials: Union[int, None] = None,
+    n_workers: Union[int, None] = None,
+    threads_per_trial: int = 1,
+    prune: bool = True,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Run a trial for (a sample of) every combination of the search space, concurrently in a process pool,
+    & write a leaderboard of the trials & the hyperparameters of the best one to output_dir.
+
+    With enough cores to run every trial at once, a sweep takes about as long as its slowest trial.
+
+    Args:
+        search_space (Dict[str, List]): values to try for window_size, epochs, patience, batch_size,
+                                    train_size & val_size, the test split gets whatever is left
+        clean_data_path (PosixPath): path of the clean (preprocessed) data
+        output_dir (PosixPath): directory to write the leaderboard, best hyperparameters & trial records to
+        forecast_steps (int): The number of time steps the model predicts
+        label_columns (Union[List[str], None], optional): columns to predict, all if None. Defaults to None.
+        n_trials (Union[int, None], optional): number of combinations to sample, all if None. Defaults to None.
+        n_workers (Union[int, None], optional): concurrent trials, as many as the cores allow if None.
+                                    Defaults to None.
+        threads_per_trial (int, optional): tensorflow threads of every trial. Defaults to 1.
+        prune (bool, optional): stop trials early that fall behind the others. Defaults to True.
+        seed (int, optional): seed for sampling combinations. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: leaderboard, best trial (lowest held out MAE) first
+    """
+    trials = search_grid(search_space, n_trials=n_trials, seed=seed)
+    # every trial is ranked & pruned on the same rows, none of them trains or validates on
+    score_start = held_out_start(trials) if trials else None
+    n_workers = n_workers or max(
+        min(len(trials), (os.cpu_count() or 1) // threads_per_trial), 1
+    )
+
+    trials_dir = Path(output_dir, TRIALS_DIR_NAME)
+    trials_dir.mkdir(parents=True, exist_ok=True)
+    # records of a previous sweep would skew pruning
+    for record_path in trials_dir.glob("*.json"):
+        record_path.unlink()
+    Path(output_dir, BEST_ARGS_NAME).unlink(missing_ok=True)
+
+    results = []
+    # spawn rather than fork, tensorflow isn't fork safe
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_trial_worker,
+        initargs=(threads_per_trial,),
+    ) as executor:
+        futures = {
+            executor.submit(
+                run_trial,
+                trial_id,
+                params,
+                clean_data_path,
+                trials_dir,
+                forecast_steps,
+                label_columns,
+                prune,
+                score_start,
+            ): (trial_id, params)
+            for trial_id, params in enumerate(trials)
+        }
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as error:
+                # the worker process itself died
+                trial_id, params = futures[future]
+                results.append(
+                    {
+                        "trial": trial_id,
+                        **params,
+                        "status": "failed",
+                        "error": repr(error),
+                    }
+                )
+
+    leaderboard = pd.DataFrame(
+        results,
+        columns=["trial"]
+        + list(trials[0] if trials else [])
+        + [
+            "status",
+            SCORE_NAME,
+            "best_epoch",
+            "epochs_run",
+            "val_loss",
+            "seconds",
+            "error",
+        ],
+    )
+    leaderboard["status"] = pd.Categorical(
+        leaderboard["status"], categories=TRIAL_STATUSES, ordered=True
+    )
+    leaderboard = leaderboard.sort_values(
+        ["status", SCORE_NAME], ignore_index=True, na_position="last"
+    )
+
+    # Save
+    leaderboard.to_csv(Path(output_dir, LEADERBOARD_NAME), index=False)
+    complete = leaderboard[leaderboard["status"] == "complete"]
+    if len(complete):
+        _write_json(
+            Path(output_dir, BEST_ARGS_NAME), trials[int(complete.iloc[0]["trial"])]
+        )
+    return leaderboard
@@ -1,10 +1,21 @@
 """Utility functions for the powr package."""
+import json
+import os
 from pathlib import Path, PosixPath
-from typing import Dict, List, Union
+from typing import Dict, Iterator, List, Union
 
+import numpy as np
 import pandas as pd
 import sklearn
 
+from powr import profiling
+
+# on disk formats supported by save_df/load_df
+# csv is human readable, npy is a memory mappable float block with index/meta sidecars
+DATA_FORMATS = ["csv", "npy"]
+# datasets too large for memory are saved as a directory of npy chunks per split, see `save_df_chunk`
+CHUNKED_FORMAT = "chunks"
+
 
 def are_dfs_equivalent(df_list: List[pd.DataFrame]) -> bool:
     """Check if all dataframes in a list are equivalent.
@@ -30,6 +41,38 @@ def are_dfs_equivalent(df_list: List[pd.DataFrame]) -> bool:
     return True
 
 
+def are_df_samples_compatible(df_list: List[pd.DataFrame]) -> bool:
+    """Check if samples (first n rows) of dataframes could belong to equivalent dataframes.
+    columns have to be the same, dtypes only have to be reconcilable: pandas infers dtypes
+    from the rows it reads, so an int sample could still turn into float or object later on
+
+    Args:
+        df_list (List[pd.DataFrame]): list of dataframe samples to check
+
+    Returns:
+        bool: True if all samples are compatible, False otherwise
+    """
+    if len(df_list) == 0:
+        return False
+
+    for df in df_list:
+        if df.columns.to_list() != df_list[0].columns.to_list():
+            return False
+        for col in df.columns:
+            dtype, first_dtype = df[col].dtype, df_list[0][col].dtype
+            if (
+                dtype != first_dtype
+                and object not in (dtype, first_dtype)
+                and not (
+                    pd.api.types.is_numeric_dtype(dtype)
+                    and pd.api.types.is_numeric_dtype(first_dtype)
+                )
+            ):
+                return False
+
+    return True
+
+
 def _str_to_datetime(
     datetime_string: str, known_strptimes: List[str], is_utc: bool = True
 ) -> pd.Timestamp:
@@ -57,11 +100,68 @@ def _str_to_datetime(
     )
 
 
+def _str_series_to_datetime(
+    datetime_strings: pd.Series, known_strptimes: List[str], is_utc: bool = True
+) -> pd.Series:
+    """Vectorised version of `_str_to_datetime` for a whole column of datetime strings.
+    every unique string is parsed once, each format is tried against the whole column
+    and only the values still unparsed are handed over to the next format
+
+    Args:
+        datetime_strings (pd.Series): series of datetime styled strings to convert
+        known_strptimes (List[str]): list of strptime formats to try, in order
+        is_utc (bool, optional): whether the datetime is UTC. Defaults to True.
+
+    Raises:
+        ValueError: if any of the datetime_strings cannot be converted
+
+    Returns:
+        pd.Series: series of datetime objects with the same index as datetime_strings
+    """
+    # parse each distinct string only once, codes map them back onto the rows
+    codes, uniques = pd.factorize(datetime_strings, sort=False)
+    parsed = np.full(len(uniques), np.datetime64("NaT"), dtype="datetime64[ns]")
+    unparsed = np.ones(len(uniques), dtype=bool)
+
+    for strptime in known_strptimes:
+        if not unparsed.any():
+            break
+        unparsed_idx = np.flatnonzero(unparsed)
+        trail = pd.to_datetime(
+            pd.Series(uniques[unparsed_idx], dtype=object),
+            format=strptime,
+            errors="coerce",
+            dayfirst=True,
+            utc=is_utc,
+        )
+        converted = trail.notna().to_numpy()
+        # .values of a tz aware series are the (naive) UTC datetime64s
+        parsed[unparsed_idx[converted]] = trail.values[converted]
+        unparsed[unparsed_idx[converted]] = False
+
+    failed = list(uniques[unparsed])
+    if (codes == -1).any():
+        failed.append(datetime_strings[codes == -1].iloc[0])
+    if failed:
+        raise ValueError(
+            f"Could not convert {len(failed)} value(s) to datetime, tried {known_strptimes}: {failed[:10]}"
+        )
+
+    datetimes = pd.Series(
+        parsed[codes], index=datetime_strings.index, name=datetime_strings.name
+    )
+    if is_utc:
+        datetimes = datetimes.dt.tz_localize("UTC")
+    return datetimes
+
+
+@profiling.profiled()
 def split_dataset_df(
     preprocessed_df: pd.DataFrame,
     train_size: float = 0.7,
     test_size: float = 0.1,
     val_size: float = 0.2,
+    copy: bool = True,
 ) -> Dict[str, pd.DataFrame]:
     """Split a dataframe into train, test and validation datasets.
 
@@ -70,14 +170,16 @@ def split_dataset_df(
         train_size (float, optional): train dataset size. Defaults to 0.7.
         test_size (float, optional): test dataset size. Defaults to 0.1.
         val_size (float, optional): validation dataset size. Defaults to 0.2.
+        copy (bool, optional): copy the data, otherwise the splits are views of preprocessed_df.
+                                    Defaults to True.
 
     Returns:
         Dict[str, pd.DataFrame]: dictionary of train, test and validation datasets
     """
-    df = preprocessed_df.copy(deep=True)
+    df = preprocessed_df.copy(deep=True) if copy else preprocessed_df
 
     n = len(df)
-    train_df = df[0 : int(n * 0.7)]  # noqa: E203
+    train_df = df[0 : int(n * train_size)]  # noqa: E203
     val_df = df[int(n * train_size) : int(n * (train_size + val_size))]  # noqa: E203
     test_df = df[int(n * (train_size + val_size)) :]  # noqa: E203
 
@@ -107,43 +209,245 @@ def _load_df_head_parse_datetime(
     return df
 
 
-def load_dataset(dataset_dir: str) -> Dict[str, pd.DataFrame]:
+def _save_df_npy(df: pd.DataFrame, npy_path: Path) -> None:
+    """Save a datetime indexed dataframe as a raw float .npy block plus sidecars
+        - <name>.npy: values as a 2D float64 array, float32 if all the columns are float32
+        - <name>.index.npy: datetime index as int64 nanoseconds since epoch
+        - <name>.meta.json: column names, index name & timezone
+
+    Args:
+        df (pd.DataFrame): dataframe with a DatetimeIndex & numeric columns
+        npy_path (Path): path to the .npy file to save the values to
+    """
+    # write to a temporary file first, the existing file might still be memory mapped
+    tmp_npy_path = npy_path.with_suffix(".tmp.npy")
+    dtype = np.float32 if (df.dtypes == np.float32).all() else np.float64
+    np.save(tmp_npy_path, df.to_numpy(dtype=dtype))
+    os.replace(tmp_npy_path, npy_path)
+    np.save(npy_path.with_suffix(".index.npy"), df.index.asi8)
+    meta = {
+        "columns": df.columns.to_list(),
+        "index_name": df.index.name,
+        "tz": str(df.index.tz) if df.index.tz is not None else None,
+    }
+    npy_path.with_suffix(".meta.json").write_text(json.dumps(meta))
+    return None
+
+
+def _load_df_npy(npy_path: Path, mmap_mode: Union[str, None] = "r") -> pd.DataFrame:
+    """Load a dataframe saved with `_save_df_npy`.
+    by default the values are memory mapped (read only) & wrapped without copying
+
+    Args:
+        npy_path (Path): path to the .npy file with the values
+        mmap_mode (Union[str, None], optional): numpy memmap mode, None reads into memory. Defaults to "r".
+
+    Returns:
+        pd.DataFrame: dataframe backed by the (memory mapped) values
+    """
+    meta = json.loads(npy_path.with_suffix(".meta.json").read_text())
+    values = np.load(npy_path, mmap_mode=mmap_mode)
+    index = pd.DatetimeIndex(
+        np.load(npy_path.with_suffix(".index.npy")).view("datetime64[ns]"),
+        name=meta["index_name"],
+    )
+    if meta["tz"] is not None:
+        index = index.tz_localize(meta["tz"])
+    return pd.DataFrame(values, index=index, columns=meta["columns"], copy=False)
+
+
+@profiling.profiled(rows=profiling.count_input_rows)
+def save_df(df: pd.DataFrame, path: Path) -> None:
+    """Save a datetime indexed dataframe, the format is picked from the file extension.
+
+    Args:
+        df (pd.DataFrame): dataframe to save
+        path (Path): path to save to, either a .csv or a .npy file
+
+    Raises:
+        ValueError: if the file extension is not supported
+    """
+    path = Path(path)
+    if path.suffix == ".csv":
+        df.to_csv(path, index=True)
+    elif path.suffix == ".npy":
+        _save_df_npy(df, path)
+    else:
+        raise ValueError(
+            f"Unsupported data format {path.suffix}, expected one of {DATA_FORMATS}"
+        )
+    return None
+
+
+@profiling.profiled()
+def load_df(path: Path, index_col: str = "CREATED_AT") -> pd.DataFrame:
+    """Load a datetime indexed dataframe, the format is picked from the file extension.
+
+    Args:
+        path (Path): path to load from, either a .csv or a .npy file
+        index_col (str, optional): name of the datetime index column in csv files. Defaults to "CREATED_AT".
+
+    Raises:
+        ValueError: if the file extension is not supported
+
+    Returns:
+        pd.DataFrame: loaded dataframe
+    """
+    path = Path(path)
+    if path.suffix == ".csv":
+        return _load_df_head_parse_datetime(
+            path, header_row=0, date_col=index_col, index_col=index_col
+        )
+    elif path.suffix == ".npy":
+        return _load_df_npy(path)
+    raise ValueError(
+        f"Unsupported data format {path.suffix}, expected one of {DATA_FORMATS}"
+    )
+
+
+def count_df_rows(path: Path) -> int:
+    """Number of rows of a dataframe saved with `save_df`, without loading it.
+
+    Args:
+        path (Path): path to a .csv or a .npy file
+
+    Returns:
+        int: number of rows
+    """
+    path = Path(path)
+    if path.suffix == ".npy":
+        return np.load(path, mmap_mode="r").shape[0]
+    with open(path, "rb") as f:
+        # minus the header
+        return sum(1 for _ in f) - 1
+
+
+def iter_df_chunks(
+    path: Path, chunksize: int, index_col: str = "CREATED_AT"
+) -> Iterator[pd.DataFrame]:
+    """Stream a dataframe saved with `save_df` in chunks, so that memory use is bounded by chunksize.
+
+    Args:
+        path (Path): path to a .csv or a .npy file
+        chunksize (int): maximum number of rows per chunk
+        index_col (str, optional): name of the datetime index column in csv files. Defaults to "CREATED_AT".
+
+    Yields:
+        Iterator[pd.DataFrame]: chunks in row order, views of the memory mapped values for .npy files
+    """
+    path = Path(path)
+    if path.suffix == ".npy":
+        df = _load_df_npy(path)
+        for start in range(0, len(df), chunksize):
+            yield df[start : start + chunksize]  # noqa: E203
+        return
+    with pd.read_csv(
+        path, parse_dates=[index_col], index_col=index_col, chunksize=chunksize
+    ) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def _chunk_paths(chunks_dir: Path) -> List[Path]:
+    """Value files of the chunks in a directory, in order (not their .index.npy sidecars)."""
+    return sorted(
+        path for path in Path(chunks_dir).glob("*.npy") if path.suffixes == [".npy"]
+    )
+
+
+def save_df_chunk(df: pd.DataFrame, chunks_dir: Path, chunk_index: int) -> Path:
+    """Save a chunk of a dataframe too large for memory as an npy file (see `_save_df_npy`),
+    the chunks of a directory make up the dataframe in the order of their index.
+
+    Args:
+        df (pd.DataFrame): chunk to save
+        chunks_dir (Path): directory of the dataframe's chunks
+        chunk_index (int): position of the chunk
+
+    Returns:
+        Path: path of the saved chunk
+    """
+    chunk_path = Path(chunks_dir, f"{chunk_index:05d}.npy")
+    chunk_path.parent.mkdir(parents=True, exist_ok=True)
+    _save_df_npy(df, chunk_path)
+    return chunk_path
+
+
+def clear_df_chunks(chunks_dir: Path) -> None:
+    """Remove the chunks saved in a directory, so that stale chunks aren't loaded with new ones."""
+    for chunk_path in _chunk_paths(chunks_dir):
+        for sidecar_path in [
+            chunk_path.with_suffix(".index.npy"),
+            chunk_path.with_suffix(".meta.json"),
+            chunk_path,
+        ]:
+            sidecar_path.unlink(missing_ok=True)
+    return None
+
+
+def load_df_chunks(chunks_dir: Path) -> List[pd.DataFrame]:
+    """Load the chunks saved with `save_df_chunk`, memory mapped.
+
+    Args:
+        chunks_dir (Path): directory of the dataframe's chunks
+
+    Returns:
+        List[pd.DataFrame]: chunks in order, backed by their memory mapped values
+    """
+    return [_load_df_npy(chunk_path) for chunk_path in _chunk_paths(chunks_dir)]
+
+
+@profiling.profiled()
+def load_dataset(
+    dataset_dir: str, fmt: str = "csv"
+) -> Dict[str, Union[pd.DataFrame, List[pd.DataFrame]]]:
     """Load train, test and validation datasets from a directory.
 
     Args:
         dataset_dir (str): directory containing train, test and validation datasets
+        fmt (str, optional): format the datasets were saved in, "csv", "npy" or "chunks". Defaults to "csv".
 
     Returns:
-        Dict[str, pd.DataFrame]: dictionary of train, test and validation datasets
+        Dict[str, Union[pd.DataFrame, List[pd.DataFrame]]]: dictionary of train, test and validation datasets,
+                                    lists of memory mapped chunks for the "chunks" format
     """
     ds = {}
     for ds_type in ["train", "test", "val"]:
-        df = _load_df_head_parse_datetime(
-            Path(dataset_dir, f"{ds_type}.csv"),
-            header_row=0,
-            date_col="CREATED_AT",
-            index_col="CREATED_AT",
-        )
-        ds[ds_type] = df
+        if fmt == CHUNKED_FORMAT:
+            ds[ds_type] = load_df_chunks(Path(dataset_dir, ds_type))
+        else:
+            ds[ds_type] = load_df(Path(dataset_dir, f"{ds_type}.{fmt}"))
     return ds
 
 
-def save_dataset(dataset: Dict[str, pd.DataFrame], dataset_dir_path: PosixPath) -> None:
+@profiling.profiled(rows=profiling.count_input_rows)
+def save_dataset(
+    dataset: Dict[str, pd.DataFrame], dataset_dir_path: PosixPath, fmt: str = "csv"
+) -> None:
     """Save train, test and validation datasets to a directory.
 
     Args:
         dataset (Dict[str, pd.DataFrame]): dictionary of train, test and validation datasets
         dataset_dir_path (PosixPath): path to the directory to save the datasets
+        fmt (str, optional): format to save the datasets in, "csv" or "npy". Defaults to "csv".
     """
     for ds_type, df in dataset.items():
-        df.to_csv(Path(dataset_dir_path, f"{ds_type}.csv"), index=True)
+        save_df(df, Path(dataset_dir_path, f"{ds_type}.{fmt}"))
     return None
 
 
+def _is_backed_by_array(df: pd.DataFrame, values: np.ndarray) -> bool:
+    """Whether values (from df.to_numpy()) are a view of df's data rather than a copy of it."""
+    # mixed dtype dataframes give a new copy on every call
+    return np.shares_memory(values, df.to_numpy())
+
+
+@profiling.profiled()
 def scale_features(
     df: pd.DataFrame,
     scaler: sklearn.base.BaseEstimator,
     fit: bool = False,
+    inplace: bool = False,
 ) -> Dict[str, Union[pd.DataFrame, sklearn.base.BaseEstimator]]:
     """Scale features of a dataframe using a scaler.
 
@@ -151,14 +455,64 @@ def scale_features(
         scaler (sklearn.base.BaseEstimator): scaler to use
         df (pd.DataFrame): dataframe to scale
         fit (bool, optional): whether to fit the scaler also. Defaults to False.
+        inplace (bool, optional): scale the values of df in place, without copying them,
+                                    needs a MinMaxScaler & df backed by a single float array. Defaults to False.
 
     Returns:
         Dict[str, Union[pd.DataFrame, sklearn.preprocessing._data.MinMaxScaler]]: dictionary containing the
                                                         scaled dataframe and the scaler
     """
+    if inplace:
+        if fit:
+            scaler.fit(df)
+        values = df.to_numpy()
+        if not _is_backed_by_array(df, values):
+            raise ValueError(
+                "Can only scale dataframes backed by a single float array in place"
+            )
+        # MinMaxScaler.transform, without the copy
+        values *= scaler.scale_.astype(values.dtype)
+        values += scaler.min_.astype(values.dtype)
+        return {"df": df, "scaler": scaler}
+
     scaled_df = df.copy(deep=True)
     if fit:
         scaled_df[df.columns] = scaler.fit_transform(df[df.columns])
     else:
         scaled_df[df.columns] = scaler.transform(df[df.columns])
     return {"df": scaled_df, "scaler": scaler}
+
+
+def concat_dfs(dfs: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate dataframes with the same columns along the rows, e.g. the splits of a dataset.
+    adjacent views of the same float array (see `split_dataset_df`) are joined without copying their values
+
+    Args:
+        dfs (List[pd.DataFrame]): dataframes to concatenate, in order
+
+    Returns:
+        pd.DataFrame: concatenated dataframe
+    """
+    arrays = [df.to_numpy() for df in dfs]
+    first = arrays[0]
+    adjacent = all(
+        _is_backed_by_array(df, array)
+        and array.flags.c_contiguous
+        and array.dtype == first.dtype
+        and array.shape[1:] == first.shape[1:]
+        for df, array in zip(dfs, arrays)
+    ) and all(
+        np.byte_bounds(previous)[1] == np.byte_bounds(array)[0]
+        for previous, array in zip(arrays, arrays[1:])
+    )
+    if not adjacent:
+        return pd.concat(dfs, axis=0)
+
+    values = np.lib.stride_tricks.as_strided(
+        first,
+        shape=(sum(len(array) for array in arrays), *first.shape[1:]),
+        strides=first.strides,
+        writeable=False,
+    )
+    index = dfs[0].index.append([df.index for df in dfs[1:]])
+    return pd.DataFrame(values, index=index, columns=dfs[0].columns, copy=False)
@@ -1,12 +1,195 @@
 """Module for data windowing
 shamelessly copied most of it from Tenforflow timeseries tutorial
 & modified it to suit my needs"""
-from typing import Dict, List, Union
+import math
+from typing import Dict, List, Tuple, Union
 
 import numpy as np
 import pandas as pd
 import tensorflow as tf
-from matplotlib import pyplot as plt
+
+from powr import utils
+
+WINDOW_BACKENDS = ["tf", "numpy"]
+
+
+class StridedWindowSequence(tf.keras.utils.Sequence):
+    def __init__(
+        self,
+        data: np.ndarray,
+        input_width: int,
+        label_start: int,
+        total_window_size: int,
+        label_column_indices: Union[List[int], None] = None,
+        sequence_stride: int = 1,
+        batch_size: int = 32,
+        shuffle: bool = True,
+        windows_per_epoch: Union[int, None] = None,
+        seed: Union[int, None] = None,
+        num_shards: int = 1,
+        shard_index: int = 0,
+    ):
+        """Batches of `inputs, labels` windows over a strided (zero copy) view of the data,
+        only the windows of the requested batch are ever materialised.
+
+        Can be passed to keras directly or iterated over as a generator of batches.
+
+        Args:
+            data (np.ndarray): 2D (time, features) array
+            input_width (int): number of time steps in the inputs
+            label_start (int): offset of the first label time step in a window
+            total_window_size (int): number of time steps in a window
+            label_column_indices (Union[List[int], None], optional): label features, all if None. Defaults to None.
+            sequence_stride (int, optional): time steps between the starts of consecutive windows. Defaults to 1.
+            batch_size (int, optional): number of windows per batch. Defaults to 32.
+            shuffle (bool, optional): shuffle the windows every epoch. Defaults to True.
+            windows_per_epoch (Union[int, None], optional): randomly sample this many windows every epoch,
+                                    all windows if None. Defaults to None.
+            seed (Union[int, None], optional): seed for shuffling & sampling. Defaults to None.
+            num_shards (int, optional): split every epoch's windows into this many equal shards,
+                                    e.g. one per data parallel worker. Defaults to 1.
+            shard_index (int, optional): index of the shard to yield. Defaults to 0.
+        """
+        super().__init__()
+        self._set_data(data, total_window_size, sequence_stride)
+        self.input_slice = slice(0, input_width)
+        self.labels_slice = slice(label_start, None)
+        self.label_column_indices = label_column_indices
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.windows_per_epoch = windows_per_epoch
+        self.num_shards = num_shards
+        self.shard_index = shard_index
+        self._rng = np.random.default_rng(seed)
+        self.on_epoch_end()
+
+    def _set_data(
+        self, data: np.ndarray, total_window_size: int, sequence_stride: int
+    ) -> None:
+        data = np.asarray(data, dtype=np.float32)
+        # (windows, features, time) view => (windows, time, features) view, neither copies the data
+        self.windows = np.lib.stride_tricks.sliding_window_view(
+            data, total_window_size, axis=0
+        )[::sequence_stride].transpose(0, 2, 1)
+        return None
+
+    def _get_windows(self, indices: np.ndarray) -> np.ndarray:
+        """(windows, time, features) block of the windows at indices."""
+        # fancy indexing materialises only these windows
+        return self.windows[indices]
+
+    @property
+    def num_windows(self) -> int:
+        return self.windows.shape[0]
+
+    def on_epoch_end(self):
+        """Pick (& order) the windows of the next epoch."""
+        if not self.shuffle:
+            self.indices = np.arange(self.num_windows)
+        elif (
+            self.windows_per_epoch is not None
+            and self.windows_per_epoch < self.num_windows
+        ):
+            self.indices = self._rng.choice(
+                self.num_windows, self.windows_per_epoch, replace=False
+            )
+        else:
+            self.indices = self._rng.permutation(self.num_windows)
+        if self.num_shards > 1:
+            # every shard gets as many windows, so that workers run as many steps
+            num_sharded = len(self.indices) // self.num_shards * self.num_shards
+            self.indices = self.indices[
+                self.shard_index : num_sharded : self.num_shards  # noqa: E203
+            ]
+
+    def __len__(self) -> int:
+        return math.ceil(len(self.indices) / self.batch_size)
+
+    def __getitem__(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, stop = index * self.batch_size, (index + 1) * self.batch_size
+        batch = self._get_windows(self.indices[start:stop])
+        inputs = batch[:, self.input_slice, :]
+        labels = batch[:, self.labels_slice, :]
+        if self.label_column_indices is not None:
+            labels = labels[:, :, self.label_column_indices]
+        return inputs, labels
+
+
+class ChunkedArray:
+    def __init__(self, chunks: List[np.ndarray]):
+        """2D (time, features) array made of consecutive chunks, e.g. memory mapped npy chunks of a split
+        (see `utils.save_df_chunk`), that is never concatenated as a whole.
+
+        Slicing rows returns a view within a chunk & copies only the rows of a slice that spans chunks.
+
+        Args:
+            chunks (List[np.ndarray]): 2D chunks with the same features, in time order
+        """
+        self.chunks = [chunk for chunk in chunks if len(chunk)]
+        self.offsets = np.cumsum([0] + [len(chunk) for chunk in self.chunks])
+        num_features = self.chunks[0].shape[1] if self.chunks else 0
+        self.shape = (int(self.offsets[-1]), num_features)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, rows: slice) -> np.ndarray:
+        start, stop, step = rows.indices(len(self))
+        if step != 1:
+            raise IndexError(
+                "Only contiguous row slices of chunked arrays are supported"
+            )
+        if start >= stop:
+            return np.empty((0, self.shape[1]), dtype=np.float32)
+        first = np.searchsorted(self.offsets, start, side="right") - 1
+        last = np.searchsorted(self.offsets, stop, side="left") - 1
+        parts = []
+        for position in range(first, last + 1):
+            chunk_start = max(start - self.offsets[position], 0)
+            chunk_stop = stop - self.offsets[position]
+            parts.append(self.chunks[position][chunk_start:chunk_stop])
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+class ChunkedWindowSequence(StridedWindowSequence):
+    """`StridedWindowSequence` over a `ChunkedArray`, the windows spanning the boundary of two (or more) chunks
+    are stitched together from their rows, so that the windows are the same as over the concatenated data."""
+
+    def _set_data(
+        self, data: ChunkedArray, total_window_size: int, sequence_stride: int
+    ) -> None:
+        self.data = data
+        self.total_window_size = total_window_size
+        self.sequence_stride = sequence_stride
+        self._num_windows = max(
+            0, (len(data) - total_window_size) // sequence_stride + 1
+        )
+        return None
+
+    def _get_windows(self, indices: np.ndarray) -> np.ndarray:
+        """(windows, time, features) block of the windows at indices."""
+        batch = np.empty(
+            (len(indices), self.total_window_size, self.data.shape[1]),
+            dtype=np.float32,
+        )
+        for position, window_index in enumerate(indices):
+            start = window_index * self.sequence_stride
+            stop = start + self.total_window_size
+            batch[position] = self.data[start:stop]
+        return batch
+
+    @property
+    def num_windows(self) -> int:
+        return self._num_windows
+
+
+def as_window_data(
+    data: Union[pd.DataFrame, List[pd.DataFrame]]
+) -> Union[np.ndarray, ChunkedArray]:
+    """float32 values of a split, a `ChunkedArray` of (memory mapped) chunks if it's a list of chunks."""
+    if isinstance(data, list):
+        return ChunkedArray([np.asarray(chunk, dtype=np.float32) for chunk in data])
+    return np.asarray(data, dtype=np.float32)
 
 
 class WindowGenerator:
@@ -15,9 +198,66 @@ class WindowGenerator:
         input_width: int,
         label_width: int,
         shift: int,
-        dataset_dict: Dict[str, pd.DataFrame],
+        dataset_dict: Dict[str, Union[pd.DataFrame, List[pd.DataFrame]]],
         label_columns: Union[List[str], None] = None,
+        batch_size: int = 32,
+        shuffle_seed: Union[int, None] = None,
+        num_parallel_calls: int = tf.data.AUTOTUNE,
+        cache: Union[bool, str] = True,
+        backend: str = "tf",
+        sequence_stride: int = 1,
+        windows_per_epoch: Union[int, None] = None,
+        num_shards: int = 1,
+        shard_index: int = 0,
     ):
+        """Set up the window & tf.data pipeline parameters.
+
+        Args:
+            input_width (int): number of time steps in the inputs
+            label_width (int): number of time steps in the labels
+            shift (int): number of time steps between the start of the inputs & the end of the labels
+            dataset_dict (Dict[str, Union[pd.DataFrame, List[pd.DataFrame]]]): train, val & test datasets,
+                                    or lists of their (memory mapped) chunks for data that doesn't fit in memory,
+                                    which only the numpy backend windows
+            label_columns (Union[List[str], None], optional): columns to predict, all if None. Defaults to None.
+            batch_size (int, optional): number of windows per batch. Defaults to 32.
+            shuffle_seed (Union[int, None], optional): seed for shuffling train windows. Defaults to None.
+            num_parallel_calls (int, optional): parallelism of splitting windows. Defaults to tf.data.AUTOTUNE.
+            cache (Union[bool, str], optional): cache the built val & test windows in memory (True), in files
+                                    prefixed by a path or not at all (False). The shuffled train & all windows
+                                    are never cached, as a cache would replay their first epoch's order,
+                                    they're rebuilt every epoch from the one float32 copy of the data.
+                                    NOTE windows overlap, so a cache holds ~total_window_size copies of
+                                    the data. Defaults to True. Only used by the tf backend.
+            backend (str, optional): "tf" builds tf.data pipelines with timeseries_dataset_from_array,
+                                    "numpy" builds StridedWindowSequences over strided views of the data,
+                                    which don't copy the windows. Defaults to "tf".
+            sequence_stride (int, optional): time steps between the starts of consecutive windows. Defaults to 1.
+            windows_per_epoch (Union[int, None], optional): randomly sample this many train windows every epoch,
+                                    all windows if None. Only used by the numpy backend. Defaults to None.
+            num_shards (int, optional): shard every dataset into this many equal parts for data parallel
+                                    training, the train windows are shuffled the same way on every shard
+                                    as long as shuffle_seed is set. Defaults to 1.
+            shard_index (int, optional): index of the shard this generator yields. Defaults to 0.
+
+        Raises:
+            ValueError: if the backend is not supported, the shard index is out of range
+                        or chunked datasets are windowed by the tf backend
+        """
+        if backend not in WINDOW_BACKENDS:
+            raise ValueError(
+                f"Unsupported window backend {backend}, expected one of {WINDOW_BACKENDS}"
+            )
+        self.chunked = isinstance(dataset_dict["train"], list)
+        if self.chunked and backend != "numpy":
+            raise ValueError(
+                "Chunked datasets can only be windowed by the numpy backend"
+            )
+        if not 0 <= shard_index < num_shards:
+            raise ValueError(
+                f"Shard index {shard_index} out of range for {num_shards} shards"
+            )
+
         # Store the raw data.
         self.train_df = dataset_dict["train"]
         self.val_df = dataset_dict["val"]
@@ -29,7 +269,8 @@ class WindowGenerator:
             self.label_columns_indices = {
                 name: i for i, name in enumerate(label_columns)
             }
-        self.column_indices = {name: i for i, name in enumerate(self.train_df.columns)}
+        columns = self.train_df[0].columns if self.chunked else self.train_df.columns
+        self.column_indices = {name: i for i, name in enumerate(columns)}
 
         # Work out the window parameters.
         self.input_width = input_width
@@ -45,6 +286,18 @@ class WindowGenerator:
         self.labels_slice = slice(self.label_start, None)
         self.label_indices = np.arange(self.total_window_size)[self.labels_slice]
 
+        # Work out the tf.data pipeline parameters, datasets are built once on first access.
+        self.batch_size = batch_size
+        self.shuffle_seed = shuffle_seed
+        self.num_parallel_calls = num_parallel_calls
+        self.cache = cache
+        self.backend = backend
+        self.sequence_stride = sequence_stride
+        self.windows_per_epoch = windows_per_epoch
+        self.num_shards = num_shards
+        self.shard_index = shard_index
+        self._datasets: Dict[str, Union[tf.data.Dataset, StridedWindowSequence]] = {}
+
     def __repr__(self):
         return "\n".join(
             [
@@ -75,6 +328,8 @@ class WindowGenerator:
         return inputs, labels
 
     def plot(self, model=None, plot_col="VALUE", max_subplots=3):
+        from matplotlib import pyplot as plt
+
         inputs, labels = self.example
         plt.figure(figsize=(12, 8))
         plot_col_index = self.column_indices[plot_col]
@@ -123,36 +378,98 @@ class WindowGenerator:
 
         plt.xlabel("Time [5min]")
 
-    def make_dataset(self, data):
+    def make_sequence(self, data, shuffle=True):
+        label_column_indices = None
+        if self.label_columns is not None:
+            label_column_indices = [
+                self.column_indices[name] for name in self.label_columns
+            ]
+        data = as_window_data(data)
+        sequence_class = (
+            ChunkedWindowSequence
+            if isinstance(data, ChunkedArray)
+            else StridedWindowSequence
+        )
+        return sequence_class(
+            data,
+            input_width=self.input_width,
+            label_start=self.label_start,
+            total_window_size=self.total_window_size,
+            label_column_indices=label_column_indices,
+            sequence_stride=self.sequence_stride,
+            batch_size=self.batch_size,
+            shuffle=shuffle,
+            windows_per_epoch=self.windows_per_epoch if shuffle else None,
+            seed=self.shuffle_seed,
+            num_shards=self.num_shards,
+            shard_index=self.shard_index,
+        )
+
+    def make_dataset(self, data, shuffle=True, name=None):
+        if self.backend == "numpy":
+            return self.make_sequence(data, shuffle=shuffle)
+
         data = np.array(data, dtype=np.float32)
         ds = tf.keras.utils.timeseries_dataset_from_array(
             data=data,
             targets=None,
             sequence_length=self.total_window_size,
-            sequence_stride=1,
-            shuffle=True,
-            batch_size=32,
+            sequence_stride=self.sequence_stride,
+            shuffle=shuffle,
+            seed=self.shuffle_seed,
+            batch_size=self.batch_size,
         )
+        if self.num_shards > 1:
+            # every shard gets as many batches, so that workers run as many steps
+            num_batches = len(ds) // self.num_shards * self.num_shards
+            ds = ds.take(num_batches).shard(self.num_shards, self.shard_index)
+            # already sharded, stop tf.distribute from sharding it again
+            options = tf.data.Options()
+            options.experimental_distribute.auto_shard_policy = (
+                tf.data.experimental.AutoShardPolicy.OFF
+            )
+            ds = ds.with_options(options)
 
-        ds = ds.map(self.split_window)
+        ds = ds.map(self.split_window, num_parallel_calls=self.num_parallel_calls)
+        # timeseries_dataset_from_array reshuffles every epoch, a cache after it would replay the first order
+        if self.cache and not shuffle:
+            ds = ds.cache("" if self.cache is True else f"{self.cache}.{name}")
+        ds = ds.prefetch(tf.data.AUTOTUNE)
 
         return ds
 
+    def _get_dataset(self, name, make_data, shuffle):
+        """Build a dataset on first access & reuse it afterwards."""
+        if name not in self._datasets:
+            self._datasets[name] = self.make_dataset(
+                make_data(), shuffle=shuffle, name=name
+            )
+        return self._datasets[name]
+
     @property
     def train(self):
-        return self.make_dataset(self.train_df)
+        return self._get_dataset("train", lambda: self.train_df, shuffle=True)
 
     @property
     def val(self):
-        return self.make_dataset(self.val_df)
+        return self._get_dataset("val", lambda: self.val_df, shuffle=False)
 
     @property
     def test(self):
-        return self.make_dataset(self.test_df)
+        return self._get_dataset("test", lambda: self.test_df, shuffle=False)
 
     @property
     def all(self):
-        return self.make_dataset(self.train_df.append(self.val_df.append(self.test_df)))
+        if self.chunked:
+            # windows spanning the splits are stitched from their chunks, nothing is concatenated
+            return self._get_dataset(
+                "all", lambda: self.train_df + self.val_df + self.test_df, shuffle=True
+            )
+        return self._get_dataset(
+            "all",
+            lambda: utils.concat_dfs([self.train_df, self.val_df, self.test_df]),
+            shuffle=True,
+        )
 
     @property
     def example(self):
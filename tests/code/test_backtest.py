@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import MinMaxScaler
+
+from powr import backtest, predict
+
+
+def test_forecast_origins():
+    """Test forecast_origins keeps daily origins with a full window before & horizon after them"""
+    index = pd.date_range("2022-01-01", periods=288 * 5, freq="5min", tz="UTC")
+    origins = backtest.forecast_origins(
+        index, window_size=288, horizon=288, start="2021-12-01"
+    )
+    # origins start at the end of the first full window
+    np.testing.assert_array_equal(
+        origins, [287, 287 + 288, 287 + 2 * 288, 287 + 3 * 288]
+    )
+    origins = backtest.forecast_origins(
+        index,
+        window_size=12,
+        horizon=12,
+        stride="12H",
+        start="2022-01-02",
+        end="2022-01-03",
+    )
+    np.testing.assert_array_equal(index[origins].hour, [0, 12, 0])
+
+
+def test_backtest_matches_per_origin_forecasts():
+    """Test the batched backtest matches forecasting origin by origin"""
+    rng = np.random.default_rng(0)
+    window_size, horizon, num_features = 6, 4, 2
+    model = predict.NumpyLinearModel(
+        kernel=rng.normal(size=(num_features, horizon * num_features)),
+        bias=rng.normal(size=horizon * num_features),
+        output_steps=horizon,
+        num_features=num_features,
+    )
+    index = pd.date_range("2022-01-01", periods=200, freq="5min", tz="UTC")
+    df = pd.DataFrame(
+        rng.uniform(-1, 1, (200, num_features)), columns=["VALUE", "a"], index=index
+    )
+    scaler = MinMaxScaler(feature_range=(-1, 1)).fit([[0.0, -5.0], [100.0, 5.0]])
+
+    results = backtest.backtest(
+        model, scaler, df, window_size, horizon, stride="1H", batch_size=5
+    )
+
+    origins = backtest.forecast_origins(df.index, window_size, horizon, stride="1H")
+    assert results["overall"]["n_origins"] == len(origins) == 16
+    abs_errors, abs_pct_errors = [], []
+    for origin in origins:
+        window = df.to_numpy()[origin - window_size + 1 : origin + 1]  # noqa: E203
+        forecast = scaler.inverse_transform(model.predict(window[None])[0])[:, 0]
+        actual = scaler.inverse_transform(
+            df.to_numpy()[origin + 1 : origin + 1 + horizon]  # noqa: E203
+        )[:, 0]
+        abs_errors.append(np.abs(forecast - actual))
+        abs_pct_errors.append(np.abs((forecast - actual) / actual) * 100)
+    abs_errors, abs_pct_errors = np.stack(abs_errors), np.stack(abs_pct_errors)
+    np.testing.assert_allclose(
+        results["steps"]["mae"], abs_errors.mean(axis=0), rtol=1e-5
+    )
+    np.testing.assert_allclose(
+        results["steps"]["mape"], abs_pct_errors.mean(axis=0), rtol=1e-5
+    )
+    np.testing.assert_allclose(
+        results["origins"]["mae"], abs_errors.mean(axis=1), rtol=1e-5
+    )
+    np.testing.assert_allclose(results["overall"]["mae"], abs_errors.mean(), rtol=1e-5)
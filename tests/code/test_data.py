@@ -1,8 +1,11 @@
+import gzip
+
+import numpy as np
 import pandas as pd
 import pytest
 
 from config import config
-from powr import data
+from powr import data, utils
 
 
 def test_load_merge_raw_data(tmp_path):
@@ -55,6 +58,47 @@ def test_load_merge_raw_data_invalid(tmp_path):
     )
 
 
+def test_load_merge_raw_data_parallel_compressed(tmp_path):
+    """Test load_merge_raw_data function with concurrent reads of plain & gzipped files"""
+    raw_data_dir = tmp_path / "raw_data"
+    raw_data_dir.mkdir()
+
+    (raw_data_dir / "test.csv").write_text("a,b,c\n1,2,3")
+    with gzip.open(raw_data_dir / "test2.csv.gz", "wt") as f:
+        f.write("a,b,c\n4,5,6")
+
+    df_raw = data.load_merge_raw_data(raw_data_dir, n_workers=2)
+
+    assert df_raw.shape == (2, 3)
+    assert df_raw["a"].tolist() == [1, 4]
+
+
+def test_iter_raw_data(tmp_path):
+    """Test iter_raw_data function yields bounded chunks of all files"""
+    raw_data_dir = tmp_path / "raw_data"
+    raw_data_dir.mkdir()
+
+    (raw_data_dir / "test.csv").write_text("a,b,c\n1,2,3\n4,5,6\n7,8,9")
+    (raw_data_dir / "test2.csv").write_text("a,b,c\n10,11,12")
+
+    chunks = list(data.iter_raw_data(raw_data_dir, chunksize=2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 1, 1]
+    assert pd.concat(chunks)["a"].tolist() == [1, 4, 7, 10]
+
+
+def test_iter_raw_data_invalid(tmp_path):
+    """Test iter_raw_data function fails before yielding when schemas differ"""
+    raw_data_dir = tmp_path / "raw_data"
+    raw_data_dir.mkdir()
+
+    (raw_data_dir / "test.csv").write_text("a,b,c\n1,2,3")
+    (raw_data_dir / "test2.csv").write_text("a,b,d\n4,5,6")
+
+    with pytest.raises(TypeError):
+        next(data.iter_raw_data(raw_data_dir))
+
+
 def test_clean_data():
     """Test clean_data function"""
 
@@ -78,3 +122,107 @@ def test_clean_data():
 
     # check data
     assert df_clean.shape == (865, 0)
+
+
+def test_clean_data_matches_pandas_pipeline():
+    """Test the fused clean_df kernel matches sort_values, groupby & resample on messy rows"""
+    rng = np.random.default_rng(0)
+    n_rows = 5000
+    created_at = pd.Timestamp("2022-01-01") + pd.to_timedelta(
+        rng.integers(0, 60 * 24 * 20, n_rows), unit="min"
+    )
+    df = pd.DataFrame(
+        {
+            "CREATED_AT": np.where(
+                rng.random(n_rows) < 0.5,
+                created_at.strftime("%d/%m/%Y %H:%M"),
+                created_at.strftime("%Y/%m/%d %H:%M"),
+            ),
+            "VALUE": rng.integers(-2, 20, n_rows).astype(float),
+            "METER": rng.choice(["a", "b"], n_rows),
+            "SITE": "site",
+        }
+    )
+    df.loc[rng.random(n_rows) < 0.05, "VALUE"] = np.nan
+    df = pd.concat([df, df.sample(1000, random_state=0)], ignore_index=True)
+
+    # the pandas pipeline the fused kernel replaces
+    rows = data._drop_invalid_rows(df, config.EXPECTED_TIME_FMTS)
+    nunique = rows.nunique()
+    rows = rows.drop(nunique[nunique == 1].index, axis=1)
+    expected = (
+        rows.sort_values(by=["CREATED_AT"], ignore_index=True)
+        .groupby("CREATED_AT")
+        .mean(numeric_only=True)
+        .resample("5min")
+        .sum()
+    )
+
+    df_clean = data.clean_df(df, datatime_str_fmts=config.EXPECTED_TIME_FMTS)
+
+    pd.testing.assert_frame_equal(df_clean, expected)
+    pd.testing.assert_frame_equal(data._resample_rows(rows), expected)
+
+
+def test_generate_dataset_low_memory(tmp_path):
+    """Test the low memory mode gives the same float32 dataset as views of a single block"""
+    index = pd.date_range("2022-01-01", periods=1000, freq="5min", tz="UTC")
+    cleaned_df = pd.DataFrame(
+        {"VALUE": np.random.default_rng(0).uniform(0, 100, len(index))}, index=index
+    )
+    ds = data.generate_dataset(data.preprocess_df(cleaned_df), tmp_path / "scaler.pkl")
+    ds_low_memory = data.generate_dataset(
+        data.preprocess_df(cleaned_df, low_memory=True),
+        tmp_path / "scaler_low_memory.pkl",
+        low_memory=True,
+    )
+
+    for ds_type in ["train", "val", "test"]:
+        assert (ds_low_memory[ds_type].dtypes == np.float32).all()
+        pd.testing.assert_frame_equal(
+            ds_low_memory[ds_type], ds[ds_type], check_dtype=False, atol=1e-5
+        )
+    # the sets are adjacent views of the same block, so they join without a copy
+    df_all = utils.concat_dfs(
+        [ds_low_memory["train"], ds_low_memory["val"], ds_low_memory["test"]]
+    )
+    for ds_type in ["train", "test"]:
+        assert np.shares_memory(df_all.to_numpy(), ds_low_memory[ds_type].to_numpy())
+
+
+@pytest.mark.parametrize("fmt", ["csv", "npy"])
+def test_generate_dataset_chunks_matches_in_memory(tmp_path, fmt):
+    """Test the out of core dataset, fitted & split chunk by chunk, matches the in memory one"""
+    index = pd.date_range(
+        "2022-01-01", periods=1000, freq="5min", tz="UTC", name="CREATED_AT"
+    )
+    cleaned_df = data.preprocess_df(
+        pd.DataFrame(
+            {"VALUE": np.random.default_rng(0).uniform(0, 100, len(index))},
+            index=index,
+        )
+    )
+    cleaned_data_path = tmp_path / f"data.{fmt}"
+    utils.save_df(cleaned_df, cleaned_data_path)
+    ds = data.generate_dataset(cleaned_df, tmp_path / "scaler.pkl")
+
+    # chunks straddle the set boundaries at rows 700 & 900
+    ds_chunks = data.generate_dataset_chunks(
+        cleaned_data_path,
+        tmp_path / "dataset",
+        tmp_path / "scaler_chunks.pkl",
+        chunksize=300,
+    )
+
+    assert [len(chunk) for chunk in ds_chunks["train"]] == [300, 300, 100]
+    for ds_type in ["train", "val", "test"]:
+        pd.testing.assert_frame_equal(
+            pd.concat(ds_chunks[ds_type]),
+            ds[ds_type],
+            check_dtype=False,
+            check_freq=False,
+            atol=1e-5,
+        )
+    assert utils.load_dataset(tmp_path / "dataset", fmt=utils.CHUNKED_FORMAT)["val"][
+        0
+    ].index.equals(ds["val"].index[:200])
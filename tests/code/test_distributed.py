@@ -0,0 +1,37 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from powr import distributed, train, utils
+
+
+@pytest.mark.training
+def test_train_model_data_parallel(tmp_path):
+    """Test data parallel training across 2 local workers checkpoints the best weights & refits"""
+    rng = np.random.default_rng(0)
+    index = pd.date_range("2022-01-01", periods=600, freq="5min", name="CREATED_AT")
+    df = pd.DataFrame(rng.normal(size=(600, 2)), columns=["VALUE", "a"], index=index)
+    dataset_dir = tmp_path
+    utils.save_dataset({"train": df, "val": df, "test": df}, dataset_dir)
+    window_kwargs = dict(
+        input_width=4, label_width=4, shift=4, label_columns=["VALUE"], batch_size=8
+    )
+    checkpoint_dir = Path(tmp_path, "checkpoints")
+
+    model, report = distributed.train_model_data_parallel(
+        dataset_dir, window_kwargs, checkpoint_dir, epochs=2, patience=2, n_workers=2
+    )
+    assert report["n_workers"] == 2
+    assert len(report["history"]["val_loss"]) == len(report["epoch_seconds"]) == 2
+    assert report["epoch_windows"] == (600 - 8 + 1) // 16 * 16
+    assert report["windows_per_second"] > 0
+    best = train.load_best_record(checkpoint_dir)
+    assert best["val_loss"] == pytest.approx(min(report["history"]["val_loss"]))
+
+    model, report = distributed.train_model_data_parallel(
+        dataset_dir, window_kwargs, checkpoint_dir, None, n_workers=2, refit=True
+    )
+    assert len(report["history"]["loss"]) == best["epoch"]
+    assert model.predict(np.zeros((1, 4, 2)), verbose=0).shape == (1, 4, 2)
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from powr import features
+
+
+def test_pipeline_matches_direct_computation():
+    """Test table lookups on the 5min grid & direct computation off it match sin & cos of the timestamps"""
+    pipeline = features.FeaturePipeline()
+    on_grid = pd.date_range("2012-01-01", periods=288 * 400, freq="5min", tz="UTC")
+    off_grid = on_grid[:1000] + pd.Timedelta("17s")
+
+    for index in [on_grid, on_grid[::7], off_grid]:
+        seconds = index.asi8 // 10**9
+        block = pipeline.transform(index)
+        assert block.dtype == np.float32
+        assert block.shape == (len(index), 6)
+        for position, (name, period) in enumerate(
+            [("day", 86400), ("hour", 3600), ("month", 2.628e6)]
+        ):
+            assert pipeline.columns[2 * position] == f"{name}_sin"
+            np.testing.assert_allclose(
+                block[:, 2 * position],
+                np.sin(seconds * (2 * np.pi / period)),
+                atol=1e-5,
+            )
+            np.testing.assert_allclose(
+                block[:, 2 * position + 1],
+                np.cos(seconds * (2 * np.pi / period)),
+                atol=1e-5,
+            )
+
+    # a single bin gets the same features as within a long range
+    np.testing.assert_array_equal(
+        pipeline.transform(on_grid[[12345]]), pipeline.transform(on_grid)[[12345]]
+    )
+
+
+def test_registered_features():
+    """Test pipelines without an explicit feature list pick up newly registered features"""
+    pipeline = features.FeaturePipeline()
+    try:
+        features.register_feature(features.CyclicalFeature("week", 7 * 86400))
+        assert pipeline.columns[-2:] == ["week_sin", "week_cos"]
+        df = pipeline.transform_df(
+            pd.DataFrame(
+                {"VALUE": [1.0, 2.0]},
+                index=pd.date_range("2022-01-01", periods=2, freq="5min", tz="UTC"),
+            )
+        )
+        assert df.columns.to_list() == ["VALUE", *pipeline.columns]
+    finally:
+        features.FEATURES.pop("week")
@@ -0,0 +1,24 @@
+import os
+from pathlib import Path
+
+import main
+
+
+def _pipeline(customer_dir: Path, output_dir: Path, fmt: str):
+    """Stand in for a customer's pipeline whose process dies for the customer named "dies"."""
+    if customer_dir.name == "dies":
+        os._exit(1)
+    return {"customer": customer_dir.name, "status": "ok", "error": None}
+
+
+def test_run_customer_in_process_isolates_dead_workers(tmp_path):
+    """Test a worker process dying only fails its own customer"""
+    summaries = [
+        main._run_customer_in_process(
+            Path(tmp_path, name), tmp_path, "csv", 1, pipeline=_pipeline
+        )
+        for name in ["dies", "lives"]
+    ]
+    assert summaries[0]["status"] == "failed"
+    assert "BrokenProcessPool" in summaries[0]["error"]
+    assert summaries[1] == {"customer": "lives", "status": "ok", "error": None}
@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import MinMaxScaler
+
+from powr import predict, train
+
+
+def test_predict_many():
+    """Test predict_many function matches predicting & formatting windows one by one"""
+    num_features = 2
+    model = train.build_model(288, num_features)
+    model.build((None, 288, num_features))
+    model.layers[1].bias.assign(np.linspace(-1, 1, 288 * num_features))
+    scaler = MinMaxScaler(feature_range=(-1, 1)).fit([[0.0, -5.0], [100.0, 5.0]])
+
+    windows = np.random.default_rng(0).uniform(-1, 1, (3, 288, num_features))
+    last_timestamps = pd.DatetimeIndex(
+        ["2022-01-01 00:00", "2022-01-01 00:05", "2022-06-30 23:55"], tz="UTC"
+    )
+
+    forecasts = predict.predict_many(
+        model, scaler, windows, last_timestamps, window_ids=["a", "b", "c"]
+    )
+
+    assert forecasts.shape == (3 * 288, 5)
+    for window_id, window, last_timestamp in zip("abc", windows, last_timestamps):
+        next_24 = model.predict(window[None].astype(np.float32), verbose=0)
+        expected = predict.format_forecast(
+            scaler.inverse_transform(next_24.reshape(288, num_features)),
+            last_timestamp,
+            feature_columns=["forecast_value", "day_sin"],
+        ).reset_index(drop=True)
+        pd.testing.assert_frame_equal(
+            forecasts[forecasts["window_id"] == window_id]
+            .drop(columns="window_id")
+            .reset_index(drop=True),
+            expected,
+            check_dtype=False,
+        )
+
+
+def test_artifact_cache(tmp_path):
+    """Test ArtifactCache hits, reloads changed artifacts & evicts least recently used ones"""
+    loads = []
+
+    def loader(path):
+        loads.append(path.name)
+        return path.read_text()
+
+    for name in ["a", "b", "c"]:
+        (tmp_path / name).write_text(name)
+    cache = predict.ArtifactCache(loader, max_size=2)
+
+    assert cache.get(tmp_path / "a") == "a"
+    assert cache.get(tmp_path / "a") == "a"
+    assert cache.get(tmp_path / "b") == "b"
+    assert cache.get(tmp_path / "c") == "c"  # evicts a
+    assert cache.get(tmp_path / "a") == "a"  # evicts b
+    (tmp_path / "c").write_text("changed")
+    assert cache.get(tmp_path / "c") == "changed"
+
+    assert loads == ["a", "b", "c", "a", "c"]
+    assert cache.stats == {
+        "hits": 1,
+        "misses": 5,
+        "evictions": 2,
+        "size": 2,
+        "max_size": 2,
+    }
+
+
+def test_numpy_linear_model(tmp_path):
+    """Test an exported NumpyLinearModel predicts the same as the keras model"""
+    num_features = 3
+    model = train.build_model(288, num_features)
+    model.build((None, 288, num_features))
+    rng = np.random.default_rng(0)
+    model.set_weights([rng.normal(size=w.shape) for w in model.get_weights()])
+
+    train.export_numpy_model(model, 288, num_features, tmp_path / "model.npz")
+    numpy_model = predict.load_model(tmp_path / "model.npz")
+
+    windows = rng.uniform(-1, 1, (5, 288, num_features)).astype(np.float32)
+    np.testing.assert_allclose(
+        numpy_model.predict(windows, batch_size=2),
+        model.predict(windows, verbose=0),
+        rtol=1e-5,
+        atol=1e-5,
+    )
+
+
+def test_exported_inference_models(tmp_path):
+    """Test the concrete function SavedModel & the TFLite models predict (about) the same as the keras model"""
+    num_features = 3
+    model = train.build_model(288, num_features)
+    model.build((None, 288, num_features))
+    rng = np.random.default_rng(0)
+    model.set_weights([rng.normal(size=w.shape) * 0.1 for w in model.get_weights()])
+    windows = rng.uniform(-1, 1, (5, 288, num_features)).astype(np.float32)
+    expected = model.predict(windows, verbose=0)
+
+    train.export_serving_model(model, 288, num_features, tmp_path / "serving")
+    serving_model = predict.load_model(tmp_path / "serving")
+    assert isinstance(serving_model, predict.SignatureModel)
+    np.testing.assert_allclose(serving_model.predict(windows), expected, atol=1e-5)
+
+    for quantization, atol in [("none", 1e-5), ("float16", 1e-2), ("int8", 5e-2)]:
+        tflite_path = tmp_path / f"model_{quantization}.tflite"
+        train.export_tflite_model(
+            model,
+            288,
+            num_features,
+            tflite_path,
+            quantization=quantization,
+            representative_windows=windows,
+        )
+        tflite_model = predict.load_model(tflite_path)
+        # single window forecasts & batches resize the interpreter's input
+        np.testing.assert_allclose(
+            tflite_model.predict(windows[:1]), expected[:1], atol=atol
+        )
+        np.testing.assert_allclose(
+            tflite_model.predict(windows, batch_size=2), expected, atol=atol
+        )
+
+    with pytest.raises(ValueError):
+        train.export_tflite_model(
+            model, 288, num_features, tmp_path / "int8.tflite", quantization="int8"
+        )
+
+
+def test_compare_models(tmp_path):
+    """Test compare_models reports the forecast error of every model against the reference"""
+    num_features = 2
+    rng = np.random.default_rng(0)
+    kernel = rng.normal(size=(num_features, 288 * num_features))
+    for name, bias in [("reference", 0.0), ("shifted", 0.5)]:
+        np.savez(
+            tmp_path / f"{name}.npz",
+            kernel=kernel,
+            bias=np.full(288 * num_features, bias),
+            output_steps=288,
+            num_features=num_features,
+        )
+
+    report_df = predict.compare_models(
+        {name: tmp_path / f"{name}.npz" for name in ["reference", "shifted"]},
+        rng.uniform(-1, 1, (4, 288, num_features)),
+        reference="reference",
+        n_forecasts=3,
+    )
+
+    assert report_df["model"].to_list() == ["reference", "shifted"]
+    np.testing.assert_allclose(report_df["mean_abs_error"], [0.0, 0.5], atol=1e-6)
+    assert (report_df[["load_seconds", "rss_mb", "forecast_ms"]] > 0).all().all()
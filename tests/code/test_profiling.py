@@ -0,0 +1,69 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from powr import profiling
+
+
+def test_profiler_records_nested_stages(tmp_path):
+    """Test the profiler records nested stages with rows, rows/s & a peak memory covering inner stages"""
+    profiler = profiling.Profiler(enabled=True)
+
+    @profiler.profiled(name="double")
+    def double(df):
+        # allocate enough for the peak to stand out
+        np.ones(10_000_000).sum()
+        return pd.concat([df, df])
+
+    with profiler.stage("outer") as record:
+        df = double(pd.DataFrame({"a": range(100)}))
+        record["rows"] = len(df)
+
+    inner, outer = profiler.records
+    assert inner["stage"] == "outer/double"
+    assert inner["rows"] == 200
+    assert outer["stage"] == "outer"
+    assert outer["rows_per_second"] > 0
+    assert outer["wall_seconds"] >= inner["wall_seconds"]
+    assert outer["peak_rss_mb"] >= inner["peak_rss_mb"]
+    if inner["peak_rss_mb"] == inner["peak_rss_mb"]:
+        assert inner["peak_rss_mb"] > 60
+
+    metrics = profiler.write(tmp_path / "metrics.json", command="test")
+    assert json.loads((tmp_path / "metrics.json").read_text()) == metrics
+    assert metrics["command"] == "test"
+
+
+def test_profiler_disabled():
+    """Test a disabled profiler calls through without recording anything"""
+    profiler = profiling.Profiler()
+
+    @profiler.profiled()
+    def identity(df):
+        return df
+
+    assert identity(1) == 1
+    with profiler.stage("stage"):
+        pass
+    assert profiler.records == []
+    assert profiling.count_rows({"a": np.zeros((3, 2)), "b": None}) == 3
+
+
+def test_profiler_counts_rows_of_keyword_calls():
+    """Test rows are counted whether arguments are passed by position or keyword & a failing count records None"""
+    profiler = profiling.Profiler(enabled=True)
+
+    @profiler.profiled(rows=profiling.count_input_rows)
+    def save(df, path=None):
+        return None
+
+    @profiler.profiled(rows=lambda result, *args, **kwargs: 1 / 0)
+    def identity(df):
+        return df
+
+    df = pd.DataFrame({"a": range(10)})
+    assert save(df) is None
+    assert save(df=df, path="df.csv") is None
+    assert identity(df=df) is df
+    assert [record["rows"] for record in profiler.records] == [10, 10, None]
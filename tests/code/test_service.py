@@ -0,0 +1,113 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import MinMaxScaler
+
+from powr import data, predict, service, utils
+
+
+def test_micro_batcher():
+    """Test MicroBatcher predicts concurrently submitted windows in shared batches"""
+    batch_sizes = []
+
+    def predict_fn(windows):
+        batch_sizes.append(len(windows))
+        return windows.sum(axis=1)
+
+    batcher = service.MicroBatcher(predict_fn, max_batch_size=4, max_wait_ms=50)
+    windows = [np.full((3, 2), i, dtype=np.float32) for i in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        predictions = list(executor.map(batcher.submit, windows))
+
+    for i, prediction in enumerate(predictions):
+        np.testing.assert_array_equal(prediction, [3 * i, 3 * i])
+    assert sum(batch_sizes) == 8
+    assert max(batch_sizes) <= 4
+    assert len(batch_sizes) < 8
+
+
+class _FailingModel:
+    def predict_on_batch(self, windows):
+        raise RuntimeError("model failed")
+
+
+def _post(server, records):
+    """POST records to the server's /predict, returning the status & json body."""
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{server.server_address[1]}/predict",
+        data=json.dumps(records).encode("utf-8"),
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+
+
+def test_forecast_service_preprocesses_readings():
+    """Test the service builds the time features of readings in real units & scales them as the dataset was"""
+    rng = np.random.default_rng(0)
+    index = pd.date_range(
+        "2022-01-01", periods=2 * service.WINDOW_SIZE, freq="5min", name="CREATED_AT"
+    )
+    readings = pd.DataFrame({"VALUE": rng.uniform(0, 500, len(index))}, index=index)
+    scaled = utils.scale_features(
+        data.preprocess_df(readings),
+        scaler=MinMaxScaler(feature_range=(-1, 1)),
+        fit=True,
+    )
+    num_features = scaled["df"].shape[1]
+    model = predict.NumpyLinearModel(
+        rng.normal(size=(num_features, service.WINDOW_SIZE * num_features)),
+        rng.normal(size=service.WINDOW_SIZE * num_features),
+        service.WINDOW_SIZE,
+        num_features,
+    )
+
+    forecast = service.ForecastService(model, scaled["scaler"]).forecast(readings)
+    window = scaled["df"].to_numpy()[None, -service.WINDOW_SIZE :]  # noqa: E203
+    expected = predict.format_forecast(
+        scaled["scaler"].inverse_transform(model.predict_on_batch(window)[0]),
+        index.max(),
+    )
+    pd.testing.assert_frame_equal(forecast, expected, check_exact=False, rtol=1e-4)
+
+
+def test_server_replies_to_failed_forecasts():
+    """Test the server replies with a 500 & the error when the model fails"""
+    index = pd.date_range("2022-01-01", periods=10, freq="5min", name="CREATED_AT")
+    scaler = MinMaxScaler(feature_range=(-1, 1)).fit(
+        data.preprocess_df(pd.DataFrame({"VALUE": np.arange(10.0)}, index=index))
+    )
+    server = service.make_server(
+        service.ForecastService(_FailingModel(), scaler), port=0
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        index = pd.date_range("2022-01-01", periods=service.WINDOW_SIZE, freq="5min")
+        records = [
+            {"CREATED_AT": str(created_at), "VALUE": 1.0} for created_at in index
+        ]
+        status, body = _post(server, records)
+        assert status == 500
+        assert "model failed" in body["error"]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_forecast_service_rejects_wrong_shaped_windows():
+    """Test a window with the wrong number of columns is rejected before it's batched"""
+    # fitted on an array, the scaler has no feature names to select the columns by
+    scaler = MinMaxScaler(feature_range=(-1, 1)).fit(np.ones((10, 2)))
+    forecast_service = service.ForecastService(_FailingModel(), scaler)
+    index = pd.date_range("2022-01-01", periods=service.WINDOW_SIZE, freq="5min")
+    with pytest.raises(ValueError, match="shape"):
+        forecast_service.forecast(pd.DataFrame(np.ones((len(index), 3)), index=index))
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import MinMaxScaler
+
+from config import config
+from powr import data, predict, stream
+
+
+def _raw_readings(n_bins: int, seed: int = 0) -> pd.DataFrame:
+    """Raw readings in arrival order, with duplicates, several readings per timestamp & bin,
+    invalid readings & bins without readings"""
+    rng = np.random.default_rng(seed)
+    minutes = np.sort(rng.choice(n_bins * 5, size=n_bins * 3))
+    # no readings for an hour
+    minutes = minutes[(minutes < 600) | (minutes >= 660)]
+    created_at = pd.Timestamp("2022-01-31 22:00") + pd.to_timedelta(minutes, unit="min")
+    df = pd.DataFrame(
+        {
+            "CREATED_AT": created_at.strftime("%d/%m/%Y %H:%M"),
+            "VALUE": rng.uniform(0, 10, len(minutes)).round(1),
+        }
+    )
+    df.loc[df.index % 7 == 0, "VALUE"] = -1.0
+    df.loc[df.index % 11 == 0, "VALUE"] = np.nan
+    # exact duplicates follow the original reading
+    return pd.concat([df, df[df.index % 5 == 0]]).sort_index(kind="stable")
+
+
+def test_streaming_window_matches_batch_pipeline():
+    """Test the streamed window matches clean_df, preprocess_df & the scaler on the same readings"""
+    raw_df = _raw_readings(n_bins=320)
+    dataset_df = data.preprocess_df(
+        data.clean_df(raw_df.copy(), datatime_str_fmts=config.EXPECTED_TIME_FMTS)
+    )
+    scaler = MinMaxScaler(feature_range=(-1, 1)).fit(dataset_df)
+    scaled_df = pd.DataFrame(
+        scaler.transform(dataset_df),
+        columns=dataset_df.columns,
+        index=dataset_df.index,
+    )
+    num_features = dataset_df.shape[1]
+    model = predict.NumpyLinearModel(
+        kernel=np.tile(np.eye(num_features), 288),
+        bias=np.zeros(288 * num_features),
+        output_steps=288,
+        num_features=num_features,
+    )
+
+    forecaster = stream.StreamingForecaster(
+        model, scaler, datatime_str_fmts=config.EXPECTED_TIME_FMTS
+    )
+    with pytest.raises(ValueError):
+        forecaster.forecast()
+    forecaster.update_many(raw_df)
+    forecaster.flush()
+
+    window, last_timestamp = forecaster.window()
+    assert forecaster.n_bins == len(dataset_df)
+    assert last_timestamp == dataset_df.index.max()
+    np.testing.assert_allclose(window, scaled_df[-288:].to_numpy(), atol=1e-5)
+
+    # readings of closed bins are too late to be counted
+    assert forecaster.update(raw_df["CREATED_AT"].iloc[0], 5.0) == 0
+    assert forecaster.late_readings == 1
+    np.testing.assert_array_equal(forecaster.window()[0], window)
+
+    forecast = forecaster.forecast()
+    assert forecast.shape == (288, 4)
+    assert forecast["forecast_at"].iloc[0] == (
+        dataset_df.index.max() + pd.Timedelta("5min")
+    ).strftime("%Y-%m-%dT%H:%M:%SZ")
+    # the identity model forecasts the last bin's value at every step
+    np.testing.assert_allclose(
+        forecast["forecast_value"], dataset_df["VALUE"].iloc[-1], atol=1e-4
+    )
+
+
+def test_streaming_fills_empty_bins():
+    """Test a reading after a long gap closes the empty bins in between as 0, keeping only a window of them"""
+    scaler = MinMaxScaler(feature_range=(-1, 1)).fit(
+        data.preprocess_df(
+            pd.DataFrame(
+                {"VALUE": [0.0, 10.0]},
+                index=pd.DatetimeIndex(
+                    ["2022-01-01", "2022-06-01"], tz="UTC", name="CREATED_AT"
+                ),
+            )
+        )
+    )
+    forecaster = stream.StreamingForecaster(None, scaler, window_size=4)
+    assert forecaster.update(pd.Timestamp("2022-01-01 00:01"), 5.0) == 0
+    assert forecaster.update(pd.Timestamp("2022-01-01 00:03"), 5.0) == 0
+    # 1000 bins later
+    assert forecaster.update(pd.Timestamp("2022-01-04 11:21"), 1.0) == 1000
+    assert forecaster.n_bins == 1000
+
+    window, last_timestamp = forecaster.window()
+    assert last_timestamp == pd.Timestamp("2022-01-04 11:15", tz="UTC")
+    # VALUE of the empty bins is scaled 0
+    np.testing.assert_allclose(window[:, 0], -1.0)
@@ -0,0 +1,140 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+import tensorflow as tf
+
+from powr import train, window
+
+
+def test_train_model_lstsq_matches_direct_least_squares():
+    """Test the lstsq solver's model predicts the least squares fit of labels on the last input step"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(60, 3)), columns=["VALUE", "a", "b"])
+    multi_window = window.WindowGenerator(
+        input_width=5,
+        label_width=4,
+        shift=4,
+        dataset_dict={"train": df, "val": df, "test": df},
+        label_columns=["VALUE"],
+    )
+    model = train.build_model(4, 3)
+    model, _ = train.train_model(
+        model, multi_window, epochs=1, solver="lstsq", ridge=0.0
+    )
+
+    data = df.to_numpy()
+    starts = np.arange(len(data) - multi_window.total_window_size + 1)
+    x = np.hstack([data[starts + 4], np.ones((len(starts), 1))])
+    y = np.stack([data[starts + 5 + step, 0] for step in range(4)], axis=1)
+    expected = x @ np.linalg.lstsq(x, y, rcond=None)[0]
+
+    windows = np.stack([data[start : start + 5] for start in starts])  # noqa: E203
+    predictions = model.predict(windows, verbose=0)
+    # every output feature is fitted to the VALUE label, as with the keras loss
+    for feature in range(3):
+        np.testing.assert_allclose(predictions[:, :, feature], expected, atol=1e-4)
+
+
+def test_train_model_drops_stale_best_weights(tmp_path):
+    """Test a fresh fit removes a previous fit's best weights & fails without validation windows"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(60, 2)), columns=["VALUE", "a"])
+    Path(tmp_path, train.BEST_WEIGHTS_NAME).write_text("stale")
+    Path(tmp_path, train.BEST_RECORD_NAME).write_text('{"epoch": 9, "val_loss": 0.0}')
+    checkpoint = train.BestWeightsCheckpoint(tmp_path)
+    checkpoint.set_model(train.build_model(4, 2))
+    checkpoint.on_train_begin()
+    assert not checkpoint.saved
+    assert not Path(tmp_path, train.BEST_WEIGHTS_NAME).exists()
+    assert not Path(tmp_path, train.BEST_RECORD_NAME).exists()
+
+    multi_window = window.WindowGenerator(
+        input_width=4,
+        label_width=4,
+        shift=4,
+        dataset_dict={"train": df, "val": df[:6], "test": df},
+        label_columns=["VALUE"],
+    )
+    with pytest.raises(ValueError):
+        train.train_model(
+            train.build_model(4, 2), multi_window, epochs=1, checkpoint_dir=tmp_path
+        )
+
+
+def test_fit_least_squares_on_chunks_matches_whole_data():
+    """Test the lstsq solver fits the same weights on chunks, with windows spanning them, as on the whole data"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(60, 3)), columns=["VALUE", "a", "b"])
+    chunks = [df[:7], df[7:31], df[31:]]
+    kwargs = dict(input_width=5, label_width=4, shift=4, label_columns=["VALUE"])
+    multi_window = window.WindowGenerator(
+        dataset_dict={"train": df, "val": df, "test": df}, **kwargs
+    )
+    chunked_window = window.WindowGenerator(
+        dataset_dict={"train": chunks, "val": chunks, "test": chunks},
+        backend="numpy",
+        **kwargs,
+    )
+
+    for expected, weights in zip(
+        train.fit_least_squares(multi_window, 4, 3, all_data=True),
+        train.fit_least_squares(chunked_window, 4, 3, all_data=True, chunk_size=9),
+    ):
+        np.testing.assert_allclose(weights, expected, atol=1e-4)
+
+
+class _Interrupt(tf.keras.callbacks.Callback):
+    def on_epoch_end(self, epoch, logs=None):
+        if epoch == 1:
+            raise KeyboardInterrupt
+
+
+def test_train_model_checkpoints_resumes_and_refits(tmp_path):
+    """Test an interrupted fit resumes from its backup & the refit runs for the best epoch count"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(60, 2)), columns=["VALUE", "a"])
+    multi_window = window.WindowGenerator(
+        input_width=4,
+        label_width=4,
+        shift=4,
+        dataset_dict={"train": df, "val": df, "test": df},
+        label_columns=["VALUE"],
+    )
+    model = train.build_model(4, 2)
+    model.compile(loss="mse", optimizer="adam")
+    with pytest.raises(KeyboardInterrupt):
+        model.fit(
+            multi_window.train,
+            epochs=4,
+            validation_data=multi_window.val,
+            callbacks=[
+                tf.keras.callbacks.BackupAndRestore(
+                    Path(tmp_path, train.BACKUP_DIR_NAME)
+                ),
+                train.BestWeightsCheckpoint(tmp_path),
+                _Interrupt(),
+            ],
+            verbose=0,
+        )
+    assert train.load_best_record(tmp_path)["epoch"] in (1, 2)
+
+    model, history = train.train_model(
+        train.build_model(4, 2),
+        multi_window,
+        epochs=4,
+        patience=10,
+        checkpoint_dir=tmp_path,
+    )
+    # epochs 1 & 2 were restored from the backup
+    assert len(history.history["val_loss"]) == 2
+    assert not any(Path(tmp_path, train.BACKUP_DIR_NAME).iterdir())
+    best = train.load_best_record(tmp_path)
+    assert best["val_loss"] <= min(history.history["val_loss"])
+    np.testing.assert_allclose(
+        model.evaluate(multi_window.val, verbose=0)[0], best["val_loss"], rtol=1e-5
+    )
+
+    model, history = train.refit_model(model, multi_window, tmp_path)
+    assert len(history.history["loss"]) == best["epoch"]
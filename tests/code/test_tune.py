@@ -0,0 +1,113 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import MinMaxScaler
+
+from powr import tune, utils
+
+
+def test_search_grid():
+    """Test search_grid skips splits that leave no test data & samples n_trials combinations"""
+    search_space = {
+        "window_size": [4, 8],
+        "batch_size": [16],
+        "train_size": [0.6, 0.7],
+        "val_size": [0.2, 0.3],
+    }
+    trials = tune.search_grid(search_space)
+    assert len(trials) == 6
+    assert all(trial["test_size"] > 0 for trial in trials)
+    assert {trial["test_size"] for trial in trials} == {0.1, 0.2}
+
+    sampled = tune.search_grid(search_space, n_trials=3, seed=0)
+    assert len(sampled) == 3
+    assert all(trial in trials for trial in sampled)
+
+
+def test_median_pruner(tmp_path):
+    """Test MedianPruner stops a trial that is worse than the median of the other trials"""
+    for trial_id, losses in enumerate([[1.0, 0.5], [2.0, 0.4], [0.8, 0.8]]):
+        Path(tmp_path, f"{trial_id}.json").write_text(json.dumps({"losses": losses}))
+
+    class _Model:
+        stop_training = False
+
+    pruner = tune.MedianPruner(tmp_path, trial_id=3)
+    pruner.model = _Model()
+    pruner.on_epoch_end(0, {tune.SCORE_NAME: 0.9})
+    assert not pruner.pruned
+    pruner.on_epoch_end(1, {tune.SCORE_NAME: 0.6})
+    assert pruner.pruned and pruner.model.stop_training
+    assert json.loads(Path(tmp_path, "3.json").read_text()) == {"losses": [0.9, 0.6]}
+
+
+def test_held_out_score():
+    """Test HeldOutScore logs the MAE in real units of forecasts of every row from the first scored row"""
+    df = pd.DataFrame({"VALUE": np.arange(20.0), "a": np.zeros(20)})
+    scaler = MinMaxScaler(feature_range=(-1, 1)).fit(df)
+    scaled_df = utils.scale_features(df, scaler=scaler)["df"]
+
+    class _Model:
+        # forecasts the last input value for every step
+        def predict(self, inputs, batch_size=None, verbose=0):
+            return np.repeat(inputs[:, -1:, :1], 2, axis=1)
+
+    scorer = tune.HeldOutScore(
+        scaler, scaled_df, first_scored_row=15, window_size=4, horizon=2
+    )
+    scorer.model = _Model()
+    assert list(scorer.origins) == [14, 16]
+    logs = {}
+    scorer.on_epoch_end(0, logs)
+    # each forecast is 1 & 2 rows behind
+    assert logs[tune.SCORE_NAME] == pytest.approx(1.5)
+    assert scorer.scores == [logs[tune.SCORE_NAME]]
+    every_row = tune.HeldOutScore(
+        scaler, scaled_df, first_scored_row=15, window_size=4, horizon=2, stride=1
+    )
+    assert list(every_row.origins) == [14, 15, 16, 17]
+
+    with pytest.raises(ValueError):
+        tune.HeldOutScore(
+            scaler, scaled_df, first_scored_row=19, window_size=4, horizon=2
+        )
+
+
+@pytest.mark.training
+def test_tune(tmp_path):
+    """Test tune runs every trial concurrently & writes a leaderboard & the best hyperparameters"""
+    rng = np.random.default_rng(0)
+    index = pd.date_range("2022-01-01", periods=400, freq="5min", name="CREATED_AT")
+    df = pd.DataFrame(rng.normal(size=(400, 2)), columns=["VALUE", "a"], index=index)
+    clean_data_path = Path(tmp_path, "data.csv")
+    utils.save_df(df, clean_data_path)
+    search_space = {
+        "window_size": [2, 4],
+        "epochs": [2],
+        "patience": [1],
+        "batch_size": [16],
+        "train_size": [0.6],
+        "val_size": [0.2, 0.3],
+    }
+
+    leaderboard = tune.tune(
+        search_space,
+        clean_data_path,
+        tmp_path,
+        forecast_steps=4,
+        label_columns=["VALUE"],
+        n_workers=2,
+    )
+    assert len(leaderboard) == 4
+    assert set(leaderboard["status"]) <= {"complete", "pruned"}
+    assert Path(tmp_path, tune.LEADERBOARD_NAME).exists()
+    best_args = json.loads(Path(tmp_path, tune.BEST_ARGS_NAME).read_text())
+    best = leaderboard[leaderboard["status"] == "complete"].iloc[0]
+    assert best_args["window_size"] == best["window_size"]
+    assert (
+        best[tune.SCORE_NAME]
+        == leaderboard[leaderboard["status"] == "complete"][tune.SCORE_NAME].min()
+    )
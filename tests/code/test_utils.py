@@ -1,5 +1,7 @@
+import numpy as np
 import pandas as pd
 import pytest
+from sklearn.preprocessing import MinMaxScaler
 
 from powr import utils
 
@@ -23,6 +25,19 @@ def test_are_df_equivalent():
     assert not utils.are_dfs_equivalent([])
 
 
+def test_are_df_samples_compatible():
+    df1 = pd.DataFrame({"a": [1, 2, 3], "b": ["x", "y", "z"]})
+    df2 = pd.DataFrame({"a": [1.5, 2, 3], "b": ["x", "y", "z"]})
+    df3 = pd.DataFrame({"a": ["1", "2", "3"], "b": ["x", "y", "z"]})
+    df4 = pd.DataFrame({"a": [1, 2, 3], "c": ["x", "y", "z"]})
+    df5 = pd.DataFrame({"a": pd.to_datetime(["2020", "2021", "2022"]), "b": "x"})
+    assert utils.are_df_samples_compatible([df1, df2])
+    assert utils.are_df_samples_compatible([df1, df3])
+    assert not utils.are_df_samples_compatible([df1, df4])
+    assert not utils.are_df_samples_compatible([df1, df5])
+    assert not utils.are_df_samples_compatible([])
+
+
 def test__str_to_datetime():
     assert utils._str_to_datetime(
         "2020-01-01", known_strptimes=["%Y-%m-%d"]
@@ -41,3 +56,100 @@ def test__str_to_datetime_error():
         str(error.value)
         == "Could not convert 2020-01-01 00:00:00.000000+00:00:00 to datetime, tried []"
     )
+
+
+def test__str_series_to_datetime():
+    datetime_strings = pd.Series(
+        ["2020/01/02 10:20", "1/1/2020 00:00", "03/01/2020 00:00", "1/1/2020 00:00"]
+    )
+    known_strptimes = ["%d/%m/%Y %H:%M", "%Y/%m/%d %H:%M"]
+    expected = datetime_strings.apply(
+        lambda x: utils._str_to_datetime(x, known_strptimes)
+    )
+    pd.testing.assert_series_equal(
+        utils._str_series_to_datetime(datetime_strings, known_strptimes), expected
+    )
+
+
+def test__str_series_to_datetime_error():
+    with pytest.raises(ValueError) as error:
+        utils._str_series_to_datetime(
+            pd.Series(["2020-01-01", "not a date", "not a date"]),
+            known_strptimes=["%Y-%m-%d"],
+        )
+    assert (
+        str(error.value)
+        == "Could not convert 1 value(s) to datetime, tried ['%Y-%m-%d']: ['not a date']"
+    )
+
+
+@pytest.mark.parametrize("fmt", utils.DATA_FORMATS)
+def test_save_load_dataset(tmp_path, fmt):
+    index = pd.DatetimeIndex(
+        ["2022-01-01 00:00", "2022-01-01 00:05", "2022-01-01 00:10"],
+        tz="UTC",
+        name="CREATED_AT",
+    )
+    df = pd.DataFrame({"VALUE": [1.5, 2.0, 3.25], "day_sin": [0.0, -0.5, 1.0]}, index)
+    dataset = {"train": df, "val": df[1:], "test": df[2:]}
+
+    utils.save_dataset(dataset, tmp_path, fmt=fmt)
+    loaded = utils.load_dataset(tmp_path, fmt=fmt)
+
+    for ds_type in dataset:
+        pd.testing.assert_frame_equal(loaded[ds_type], dataset[ds_type])
+
+
+def test_load_df_npy_is_memory_mapped(tmp_path):
+    index = pd.DatetimeIndex(["2022-01-01 00:00", "2022-01-01 00:05"], tz="UTC")
+    df = pd.DataFrame({"VALUE": [1.0, 2.0]}, index)
+    utils.save_df(df, tmp_path / "data.npy")
+
+    loaded = utils.load_df(tmp_path / "data.npy")
+
+    assert not loaded.to_numpy().flags.writeable
+
+
+def test_save_df_unsupported_format(tmp_path):
+    with pytest.raises(ValueError):
+        utils.save_df(pd.DataFrame(), tmp_path / "data.parquet")
+
+
+def test_concat_dfs_views():
+    """Test concat_dfs joins adjacent views without copying & falls back to copying otherwise"""
+    index = pd.date_range("2022-01-01", periods=10, freq="5min", tz="UTC")
+    df = pd.DataFrame(
+        np.arange(20, dtype=np.float32).reshape(10, 2), columns=["a", "b"], index=index
+    )
+    ds = utils.split_dataset_df(df, copy=False)
+
+    df_all = utils.concat_dfs([ds["train"], ds["val"], ds["test"]])
+    pd.testing.assert_frame_equal(df_all, df, check_freq=False)
+    assert np.shares_memory(df_all.to_numpy(), df.to_numpy())
+
+    df_copied = utils.concat_dfs([ds["train"], ds["test"]])
+    assert not np.shares_memory(df_copied.to_numpy(), df.to_numpy())
+    pd.testing.assert_frame_equal(
+        df_copied, pd.concat([ds["train"], ds["test"]]), check_freq=False
+    )
+
+
+def test_scale_features_inplace():
+    """Test scaling in place matches the scaler & writes into the dataframe's own values"""
+    df = pd.DataFrame(
+        np.random.default_rng(0).uniform(-5, 5, (20, 2)).astype(np.float32),
+        columns=["a", "b"],
+    )
+    expected = MinMaxScaler(feature_range=(-1, 1)).fit_transform(df)
+    values = df.to_numpy()
+
+    scaled = utils.scale_features(
+        df, MinMaxScaler(feature_range=(-1, 1)), fit=True, inplace=True
+    )
+    assert scaled["df"] is df
+    np.testing.assert_allclose(values, expected, atol=1e-6)
+
+    with pytest.raises(ValueError):
+        utils.scale_features(
+            pd.DataFrame({"a": [1.0, 2.0], "b": [1, 2]}), scaled["scaler"], inplace=True
+        )
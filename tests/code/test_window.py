@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from powr import window
+
+
+def _dataset_dict(n_rows=40, n_features=2):
+    df = pd.DataFrame(
+        np.arange(n_rows * n_features, dtype=float).reshape(n_rows, n_features),
+        columns=["VALUE", "day_sin"],
+    )
+    return {"train": df, "val": df, "test": df}
+
+
+def test_window_generator_datasets_are_built_once():
+    """Test WindowGenerator builds each dataset once with the configured batch size"""
+    multi_window = window.WindowGenerator(
+        input_width=4,
+        label_width=4,
+        shift=4,
+        dataset_dict=_dataset_dict(),
+        label_columns=["VALUE"],
+        batch_size=5,
+        shuffle_seed=0,
+    )
+
+    assert multi_window.train is multi_window.train
+    assert multi_window.val is multi_window.val
+
+    inputs, labels = next(iter(multi_window.val))
+    assert inputs.shape == (5, 4, 2)
+    assert labels.shape == (5, 4, 1)
+    # val windows aren't shuffled, labels are VALUE 4 steps after the inputs
+    np.testing.assert_array_equal(labels[0, :, 0], [8.0, 10.0, 12.0, 14.0])
+    assert sum(batch[0].shape[0] for batch in multi_window.train) == 40 - 8 + 1
+
+
+def test_cached_window_generator_reshuffles_train_every_epoch():
+    """Test caching doesn't freeze the train windows' order to the first epoch's"""
+    multi_window = window.WindowGenerator(
+        input_width=4,
+        label_width=4,
+        shift=4,
+        dataset_dict=_dataset_dict(),
+        label_columns=["VALUE"],
+        batch_size=5,
+        shuffle_seed=0,
+        cache=True,
+    )
+
+    epochs = [
+        np.concatenate([labels[:, 0, 0] for _, labels in multi_window.train])
+        for _ in range(2)
+    ]
+    assert not np.array_equal(*epochs)
+    np.testing.assert_array_equal(np.sort(epochs[0]), np.sort(epochs[1]))
+
+
+def test_numpy_backend_matches_tf_backend():
+    """Test the strided numpy backend yields the same windows as the tf.data backend"""
+    kwargs = dict(
+        input_width=4,
+        label_width=3,
+        shift=4,
+        dataset_dict=_dataset_dict(),
+        label_columns=["VALUE"],
+        batch_size=5,
+        sequence_stride=2,
+    )
+    tf_window = window.WindowGenerator(**kwargs)
+    np_window = window.WindowGenerator(backend="numpy", **kwargs)
+
+    for (tf_inputs, tf_labels), (np_inputs, np_labels) in zip(
+        tf_window.val, np_window.val
+    ):
+        np.testing.assert_array_equal(tf_inputs, np_inputs)
+        np.testing.assert_array_equal(tf_labels, np_labels)
+    assert len(np_window.val) == len(list(tf_window.val))
+    # windows are views of the data rather than copies
+    assert not np_window.val.windows.flags.owndata
+
+
+def test_numpy_backend_samples_windows_per_epoch():
+    """Test the numpy backend samples windows_per_epoch distinct train windows every epoch"""
+    multi_window = window.WindowGenerator(
+        input_width=4,
+        label_width=4,
+        shift=4,
+        dataset_dict=_dataset_dict(),
+        backend="numpy",
+        batch_size=4,
+        windows_per_epoch=10,
+        shuffle_seed=0,
+    )
+    train = multi_window.train
+    first_epoch = train.indices.copy()
+    assert len(first_epoch) == len(set(first_epoch)) == 10
+    assert len(train) == 3
+
+    train.on_epoch_end()
+    assert not np.array_equal(first_epoch, train.indices)
+    # validation windows are never sampled
+    assert multi_window.val.num_windows == len(multi_window.val.indices) == 33
+
+
+def test_shards_split_windows_evenly():
+    """Test the shards of both backends partition the train windows into equal parts"""
+    for backend in window.WINDOW_BACKENDS:
+        shards = [
+            window.WindowGenerator(
+                input_width=4,
+                label_width=4,
+                shift=4,
+                dataset_dict=_dataset_dict(),
+                label_columns=["VALUE"],
+                backend=backend,
+                batch_size=5,
+                shuffle_seed=0,
+                num_shards=3,
+                shard_index=index,
+            ).train
+            for index in range(3)
+        ]
+        # first input step of every window identifies it
+        starts = [
+            np.concatenate([inputs[:, 0, 0] for inputs, _ in shard]) for shard in shards
+        ]
+        assert len({len(shard_starts) for shard_starts in starts}) == 1
+        all_starts = np.concatenate(starts)
+        assert len(set(all_starts)) == len(all_starts)
+        assert len(all_starts) >= 33 - 3 * 5
+
+
+def test_chunked_windows_match_concatenated_data():
+    """Test windows over chunks, including those spanning chunk boundaries, match windows over the whole data"""
+    df = _dataset_dict(n_rows=60)["train"]
+    # chunks shorter than a window, a window spans three of them
+    chunks = [df[:25], df[25:30], df[30:32], df[32:]]
+    kwargs = dict(
+        input_width=4,
+        label_width=3,
+        shift=4,
+        label_columns=["VALUE"],
+        batch_size=7,
+        backend="numpy",
+    )
+    np_window = window.WindowGenerator(
+        dataset_dict={"train": df, "val": df, "test": df}, **kwargs
+    )
+    chunked_window = window.WindowGenerator(
+        dataset_dict={"train": chunks, "val": chunks, "test": chunks}, **kwargs
+    )
+
+    assert len(chunked_window.val) == len(np_window.val)
+    for (inputs, labels), (chunked_inputs, chunked_labels) in zip(
+        np_window.val, chunked_window.val
+    ):
+        np.testing.assert_array_equal(chunked_inputs, inputs)
+        np.testing.assert_array_equal(chunked_labels, labels)
+    # every window over train, val & test chunks as one sequence
+    assert chunked_window.all.num_windows == 3 * 60 - 8 + 1
+
+    np.testing.assert_array_equal(
+        window.ChunkedArray([chunk.to_numpy() for chunk in chunks])[20:40],
+        df[20:40].to_numpy(),
+    )
+    with pytest.raises(ValueError):
+        window.WindowGenerator(
+            dataset_dict={"train": chunks, "val": chunks, "test": chunks},
+            **{**kwargs, "backend": "tf"},
+        )